@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks of the .DAT conversion path and the sequence generator on synthetic VersaLab .DAT files
+    python FORC_benchmarks.py --sizes 50 200 1000 --output bench.json --compare old_bench.json
+'''
+from pathlib import Path
+import FORC_functions_RJ as FORC
+import numpy as np
+import pandas as pd
+import contextlib
+import subprocess
+import tracemalloc
+import platform
+import tempfile
+import argparse
+import time
+import json
+import sys
+import os
+
+# Relative slowdown reported as a regression by --compare
+REGRESSION_THRESHOLD = 0.2
+
+def measure(func, repeat = 3):
+    """Times func over repeat runs and measures the peak of the Python allocations of one run
+
+    Args:
+        func (callable): function without arguments.
+        repeat (int): number of timed runs, the best one is kept. Defaults to 3.
+
+    Returns:
+        dict: best, median wall time in sec and peak traced memory in bytes
+    """
+    times = []
+    # The "Done" messages of the converters are not part of the results
+    with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        # Separate run for memory, tracemalloc slows down the allocations
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'best_sec': min(times), 'median_sec': float(np.median(times)), 'peak_bytes': int(peak)}
+
+def benchmark_size(N_FORCs, work_dir, path_PMC_header, repeat = 3, step_size = 0.5):
+    """Runs every benchmark on a synthetic .DAT file of N_FORCs FORCs
+
+    Args:
+        N_FORCs (int): number of FORCs of the synthetic file.
+        work_dir (str): dir for the synthetic and exported files.
+        path_PMC_header (str): PMC header file used by gen_PMC_FORC_file.
+        repeat (int): timed runs per benchmark. Defaults to 3.
+        step_size (float): field step of the synthetic FORCs in Oe. Defaults to 0.5 Oe.
+
+    Returns:
+        dict: file size, rows and the results of every benchmark
+    """
+    # The gen_* converters take the dir holding a single .DAT file
+    dir_DAT = os.path.join(work_dir, f'DAT_{N_FORCs}')
+    os.makedirs(dir_DAT, exist_ok=True)
+    path_DAT = os.path.join(dir_DAT, f'synthetic_{N_FORCs}.DAT')
+    n_rows = FORC.write_synthetic_DAT_file(path_DAT, N_FORCs = N_FORCs, step_size = step_size)
+    data, metadata = FORC.read_DAT_FORC_columns(path_DAT)
+    dataset = FORC.FORCDataset.from_DAT_data(data, metadata = metadata)
+    frame = pd.DataFrame({'field': dataset.field, 'moment': dataset.moment})
+    out = os.path.join(work_dir, f'out_{N_FORCs}')
+
+    benchmarks = {
+        'parse_DAT': lambda: FORC.read_DAT_FORC_columns(path_DAT),
+        'segment_FORCs': lambda: FORC.FORCDataset.from_DAT_data(data, metadata = metadata),
+        'filter_FORCs': lambda: FORC.filter_FORC_dataset(dataset, dataset.field < 0.05),
+        'gen_PMC_FORC_file': lambda: FORC.gen_PMC_FORC_file(path_PMC_header, dir_DAT, out + '.forc', use_cache = False),
+        'gen_generic_FORCinel': lambda: FORC.gen_generic_FORC_file_from_PMC_data(dir_DAT, out + '.frc', use_cache = False),
+        'gen_generic_FORCinel_stream': lambda: FORC.gen_generic_FORC_file_from_PMC_data(dir_DAT, out + '_stream.frc', stream = True, use_cache = False),
+        'gen_generic_doFORC': lambda: FORC.gen_generic_FORC_file_from_PMC_data(dir_DAT, out + '_doFORC.txt', generic_type = 'doFORC', use_cache = False),
+        'gen_generic_doFORC_stream': lambda: FORC.gen_generic_FORC_file_from_PMC_data(dir_DAT, out + '_stream_doFORC.txt', generic_type = 'doFORC',\
+            stream = True, use_cache = False),
+        'n_row_avg_DataFrame': lambda: FORC.n_row_avg(frame, N_rows = 4),
+        'n_row_avg_dataset': lambda: FORC.n_row_avg(dataset, N_rows = 4),
+        'seqns_FORC_measurements_V1': lambda: FORC.seqns_FORC_measurements_V1(N_FORCs = N_FORCs, step_size = step_size,\
+            seq_file_path_n_name = out + '.seq', data_file_path = work_dir, data_file_name = 'synthetic.DAT'),
+    }
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = measure(func, repeat = repeat)
+        results[name]['rows_per_sec'] = n_rows/results[name]['best_sec']
+        print(f"{N_FORCs:>5} FORCs  {name:<30} {results[name]['best_sec']*1e3:10.1f} ms  {results[name]['peak_bytes']/2**20:8.1f} MB")
+    return {'N_FORCs': N_FORCs, 'rows': n_rows, 'file_bytes': os.path.getsize(path_DAT), 'benchmarks': results}
+
+def environment_info():
+    """Versions of Python, NumPy, pandas and the git revision the results belong to"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = Path(__file__).parent,\
+            capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,\
+        'platform': platform.platform(), 'git_revision': revision, 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare_results(new, old, threshold = REGRESSION_THRESHOLD):
+    """Lists the benchmarks that got slower than threshold relative to an older result file
+
+    Args:
+        new (dict): results of run_benchmarks.
+        old (dict): results loaded from an older JSON file.
+        threshold (float): relative slowdown reported. Defaults to 0.2.
+
+    Returns:
+        list: (N_FORCs, benchmark, old sec, new sec) of every regression
+    """
+    old_sizes = {size['N_FORCs']: size['benchmarks'] for size in old['sizes']}
+    regressions = []
+    for size in new['sizes']:
+        for name, result in size['benchmarks'].items():
+            old_result = old_sizes.get(size['N_FORCs'], {}).get(name)
+            if old_result is None:
+                continue
+            ratio = result['best_sec']/old_result['best_sec']
+            print(f"{size['N_FORCs']:>5} FORCs  {name:<30} {ratio:6.2f}x")
+            if ratio > 1 + threshold:
+                regressions.append((size['N_FORCs'], name, old_result['best_sec'], result['best_sec']))
+    return regressions
+
+def run_benchmarks(sizes = (50, 200, 1000), repeat = 3, step_size = 0.5, path_PMC_header = None):
+    """Runs the benchmarks for every size in a temporary dir
+
+    Args:
+        sizes (list): numbers of FORCs of the synthetic files. Defaults to (50, 200, 1000).
+        repeat (int): timed runs per benchmark. Defaults to 3.
+        step_size (float): field step of the synthetic FORCs in Oe. Defaults to 0.5 Oe.
+        path_PMC_header (str): PMC header file. Defaults to cube24.txt next to this file.
+
+    Returns:
+        dict: environment and the results of every size, as written to the JSON file
+    """
+    if path_PMC_header is None:
+        path_PMC_header = str(Path(__file__).parent/'cube24.txt')
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = [benchmark_size(N_FORCs, work_dir, path_PMC_header, repeat = repeat, step_size = step_size) for N_FORCs in sizes]
+    return {'environment': environment_info(), 'repeat': repeat, 'step_size': step_size, 'sizes': results}
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the FORC conversion path on synthetic VersaLab .DAT files')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200, 1000], help='numbers of FORCs of the synthetic files')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark, the best one is kept')
+    parser.add_argument('--step-size', type=float, default=0.5, help='field step of the synthetic FORCs in Oe')
+    parser.add_argument('--pmc-header', default=None, help='PMC header file, cube24.txt by default')
+    parser.add_argument('--output', default=None, help='JSON file the results are written to')
+    parser.add_argument('--compare', default=None, help='older JSON results to check for regressions')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, repeat = args.repeat, step_size = args.step_size, path_PMC_header = args.pmc_header)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Done writing {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare_results(results, json.load(f))
+        for N_FORCs, name, old_sec, new_sec in regressions:
+            print(f"Regression: {name} on {N_FORCs} FORCs {old_sec*1e3:.1f} ms -> {new_sec*1e3:.1f} ms")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+'''Command line of FORC_functions_RJ
+    forc <command> (console script of pyproject.toml), python FORC_cli.py <command> or python FORC_functions_RJ.py <command>
+'''
+import argparse
+import json
+import sys
+import os
+
+import FORC_functions_RJ as FORC
+
+def _add_conversion_arguments(parser):
+    # Options shared by the convert and batch commands, see convert_DAT_file
+    parser.add_argument('--formats', nargs='+', default=['PMC', 'FORCinel', 'doFORC'], choices=list(FORC.FORC_FILE_EXTENSIONS))
+    parser.add_argument('--pmc-header', default=None, help='sample PMC FORC file to steal headers from')
+    parser.add_argument('--stream', action='store_true', help='bounded-memory streaming conversion of each format')
+    parser.add_argument('--avging-time', type=float, default=0.5)
+    parser.add_argument('--saturating-field', type=float, default=500)
+    parser.add_argument('--suffix', default='_1', help='added to the .DAT file name for the exported files')
+    parser.add_argument('--compress', default=None, choices=[suffix[1:] for suffix in FORC.FORC_COMPRESSION_MODULES], help='write compressed files, e.g. .frc.gz')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the persistent cache of parsed .DAT files')
+    parser.add_argument('--no-average', action='store_true', help='keep the repeats of repeated FORCs as separate curves')
+    parser.add_argument('--reject-sigma', type=float, default=None, help='drop repeat points further than this many std from their mean')
+    parser.add_argument('--decimate', type=int, default=None, help='reduce blocks of this many points of every curve (keeps the reversal point)')
+    parser.add_argument('--decimate-method', default='mean', choices=['mean', 'median', 'bin'])
+    parser.add_argument('--decimate-step', type=float, default=None, help="field step in Oe of the 'bin' decimation")
+    parser.add_argument('--drift', default=None, choices=['time', 'curve'], help='correct the drift of the moment with the saturation points')
+    parser.add_argument('--smoothing', type=int, default=None, help='smoothing factor of the density format (default: from --pmc-header, else 3)')
+    parser.add_argument('--instrument', action='store_true', help='measure every stage of the conversion, totals are printed and saved in --report')
+    parser.add_argument('--trace-memory', action='store_true', help='with --instrument, peak memory of every stage from tracemalloc (slower)')
+    parser.add_argument('--profile-dir', default=None, help='with --instrument, run every stage under cProfile and save the .prof files here')
+
+def _conversion_kwargs(args):
+    # convert_DAT_file arguments of the shared conversion options
+    decimate = None
+    if args.decimate or args.decimate_step:
+        decimate = {'factor': args.decimate, 'method': args.decimate_method, 'target_step': args.decimate_step}
+    return {'formats': args.formats, 'path_PMC_header': args.pmc_header, 'avging_time': args.avging_time,\
+        'saturating_field': args.saturating_field, 'stream': args.stream, 'name_suffix': args.suffix, 'use_cache': not args.no_cache,\
+        'average_repeats': not args.no_average, 'reject_sigma': args.reject_sigma, 'decimate': decimate, 'SF': args.smoothing,\
+        'drift_correction': None if args.drift is None else {'against': args.drift}, 'compression': args.compress}
+
+def _instrumentation_kwargs(args):
+    # FORCInstrumentation arguments of the shared conversion options, None when nothing is measured
+    if not (args.instrument or args.trace_memory or args.profile_dir):
+        return None
+    return {'trace_memory': args.trace_memory, 'profile': args.profile_dir is not None, 'profile_dir': args.profile_dir}
+
+def _seq_number(text):
+    # Whole numbers stay int so the .seq file reads like one written from a notebook, e.g. FLD FIELD 500 not 500.0
+    value = float(text)
+    return int(value) if value.is_integer() and '.' not in text else value
+
+def main(argv = None):
+    """Command line entry point of the forc console script, run `forc --help` (or `python FORC_functions_RJ.py --help`) for the options
+
+    pandas and NumPy are only imported by the commands that read data files, seq and --help start without them.
+    """
+    parser = argparse.ArgumentParser(prog='forc', description='VersaLab FORC sequence and data file tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    seq_parser = subparsers.add_parser('seq', help='write the .seq file of a FORC measurement')
+    seq_parser.add_argument('seq_file', help='.seq file to write')
+    seq_parser.add_argument('--data-dir', required=True, help='dir of the data file on the instrument computer')
+    seq_parser.add_argument('--data-name', default='FORC.DAT', help='data file name, e.g. NN9_FORC.DAT')
+    seq_parser.add_argument('--set-temp', type=_seq_number, default=50, help='temperature of the measurement in K')
+    seq_parser.add_argument('--temp-rate', type=_seq_number, default=10, help='temperature ramp rate in K/min')
+    seq_parser.add_argument('--amplitude', type=_seq_number, default=2, help='vibration amplitude in mm')
+    seq_parser.add_argument('--frequency', type=_seq_number, default=39.7, help='vibration frequency in Hz')
+    seq_parser.add_argument('--H-sat', type=_seq_number, default=1000, help='saturating field in Oe')
+    seq_parser.add_argument('--max-field', type=_seq_number, default=300, help='end of the sweeps in Oe')
+    seq_parser.add_argument('--min-field', type=_seq_number, default=-300)
+    seq_parser.add_argument('--max-reversal-field', type=_seq_number, default=100)
+    seq_parser.add_argument('--min-reversal-field', type=_seq_number, default=-300)
+    seq_parser.add_argument('--N-FORCs', type=int, default=200)
+    seq_parser.add_argument('--step-size', type=_seq_number, default=0.5, help='field step of the sweeps in Oe')
+    seq_parser.add_argument('--avging-time', type=_seq_number, default=1, help='averaging time of every point in sec')
+    seq_parser.add_argument('--repeat', type=int, default=1, help='number of times every FORC is measured')
+    seq_parser.add_argument('--repeat-mode', default='interleaved', choices=['interleaved', 'block'])
+    seq_parser.add_argument('--FORCs-per-file', type=int, default=None, help='start a new _partNNN data file every this many curves')
+    seq_parser.add_argument('--estimate', action='store_true', help='also print the estimated measurement time')
+    
+    convert_parser = subparsers.add_parser('convert', help='convert .DAT files to PMC, FORCinel, doFORC, csv, npz or density files')
+    convert_parser.add_argument('data_files', nargs='+', help='.DAT files to convert')
+    convert_parser.add_argument('--save-dir', default='.', help='dir to save the converted files in (default: current dir)')
+    convert_parser.add_argument('--stitch', action='store_true', help='the files are the parts and resumed runs of one measurement')
+    convert_parser.add_argument('--report', default=None, help='save the stage measurements of --instrument as json')
+    _add_conversion_arguments(convert_parser)
+    
+    batch_parser = subparsers.add_parser('batch', help='convert every .DAT file under a directory tree')
+    batch_parser.add_argument('data_dir', help='dir to search for .DAT files')
+    batch_parser.add_argument('save_dir', help='dir to save the converted files in')
+    batch_parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of cores)')
+    batch_parser.add_argument('--no-recursive', action='store_true', help='only search the top dir')
+    batch_parser.add_argument('--report', default=None, help='save the summary report as json')
+    batch_parser.add_argument('--no-stitch', action='store_true', help='convert the _partNNN files of rotated data files separately')
+    _add_conversion_arguments(batch_parser)
+    
+    info_parser = subparsers.add_parser('info', help='print the metadata and FORCs of .DAT files')
+    info_parser.add_argument('data_files', nargs='+', help='.DAT files')
+    info_parser.add_argument('--json', action='store_true', help='print one json record per file')
+    info_parser.add_argument('--no-cache', action='store_true', help='do not use the persistent cache of parsed .DAT files')
+    
+    follow_parser = subparsers.add_parser('follow', help='convert a .DAT file while the measurement is still running')
+    follow_parser.add_argument('data_file', help='growing .DAT file')
+    follow_parser.add_argument('output_file', help='output file, updated after every completed FORC')
+    follow_parser.add_argument('--format', default='FORCinel', choices=list(FORC.FORC_END_LINES))
+    follow_parser.add_argument('--pmc-header', default=None, help='sample PMC FORC file to steal headers from')
+    follow_parser.add_argument('--interval', type=float, default=30, help='seconds between checks of the .DAT file')
+    follow_parser.add_argument('--timeout', type=float, default=3600, help='stop when no FORC was completed for this many seconds')
+    
+    estimate_parser = subparsers.add_parser('estimate', help='estimate the measurement time of seq files')
+    estimate_parser.add_argument('seq_files', nargs='+', help='seq files to estimate')
+    estimate_parser.add_argument('--per-FORC', action='store_true', help='also print the time of every FORC')
+
+    cache_parser = subparsers.add_parser('cache', help='inspect or clear the persistent cache of parsed .DAT files')
+    cache_parser.add_argument('action', choices=['info', 'clear'])
+    cache_parser.add_argument('--dir', default=None, help=f'cache directory (default: {FORC.FORC_CACHE_DIR})')
+    
+    store_parser = subparsers.add_parser('store', help='add .DAT files of temperature series to a FORC store, or list its datasets')
+    store_parser.add_argument('action', choices=['add', 'info'])
+    store_parser.add_argument('store_dir', help='dir of the store')
+    store_parser.add_argument('data_files', nargs='*', help='.DAT files or dirs to add')
+    store_parser.add_argument('--Hb-step', type=float, default=None, help='Hb step of the grid of a new store in Oe')
+    store_parser.add_argument('--Hb-range', type=float, nargs=2, default=None, metavar=('MIN', 'MAX'), help='Hb range of the grid of a new store in Oe')
+    store_parser.add_argument('--workers', type=int, default=None, help='worker processes (default: number of cores)')
+    store_parser.add_argument('--replace', action='store_true', help='replace datasets of the same sample and temperature')
+    store_parser.add_argument('--no-cache', action='store_true', help='do not use the persistent cache of parsed .DAT files')
+    
+    args = parser.parse_args(argv)
+    if args.command == 'seq':
+        seq_kwargs = dict(set_temp = args.set_temp, temp_rate = args.temp_rate, ampli = args.amplitude, freq = args.frequency, H_sat = args.H_sat,\
+            max_field = args.max_field, min_field = args.min_field, max_reversal_field = args.max_reversal_field, min_reversal_field = args.min_reversal_field,\
+            N_FORCs = args.N_FORCs, step_size = args.step_size, avging_time = args.avging_time, N_repeat = args.repeat, repeat_mode = args.repeat_mode,\
+            data_file_path = args.data_dir, data_file_name = args.data_name, N_FORCs_per_file = args.FORCs_per_file)
+        FORC.seqns_FORC_measurements_V1(seq_file_path_n_name = args.seq_file, **seq_kwargs)
+        if args.estimate:
+            estimate = FORC.estimate_FORC_measurement_time(**seq_kwargs)
+            print(f"Estimated {estimate.total_hours:.2f} h, {len(estimate.FORC_times)} FORCs, {estimate.n_points} points")
+        return 0
+    if args.command == 'convert':
+        kwargs = _conversion_kwargs(args)
+        instrumentation = _instrumentation_kwargs(args)
+        jobs = [list(args.data_files)] if args.stitch else list(args.data_files)
+        results = [FORC._convert_DAT_file_isolated(path_data_file, args.save_dir, kwargs, instrumentation) for path_data_file in jobs]
+        for result in results:
+            if result['ok']:
+                print(f"{result['path']}: {', '.join(result['outputs'].values())} ({result['time']:.2f} s)")
+            else:
+                print(f"FAILED {result['path']}: {result['error']}")
+        if instrumentation is not None:
+            stages = FORC.summarize_FORC_stages(record for result in results for record in result['stages'])
+            for name, total in stages.items():
+                print(f"  {name:<22} {total['runs']:5d} runs {total['wall_sec']:9.3f} s {total['peak_bytes']/1024**2:9.1f} MB peak")
+            if args.report:
+                with open(args.report, 'w') as f:
+                    json.dump({'stages': stages, 'results': results}, f, indent=2)
+        return 1 if any(not result['ok'] for result in results) else 0
+    if args.command == 'batch':
+        kwargs = _conversion_kwargs(args)
+        report = FORC.batch_convert_DAT_files(args.data_dir, args.save_dir, n_workers = args.workers, recursive = not args.no_recursive,\
+            path_report = args.report, stitch_parts = not args.no_stitch, instrumentation = _instrumentation_kwargs(args), **kwargs)
+        return 1 if report['n_failed'] else 0
+    if args.command == 'info':
+        for path_data_file in args.data_files:
+            info = FORC.FORC_file_info(path_data_file, use_cache = not args.no_cache)
+            if args.json:
+                print(json.dumps(info))
+                continue
+            print(f"{info['path']}: {info['title']!r} opened {info['file_open_time']}")
+            print(f"    {info['temperature']:.2f} K, avging time {info['avging_time']} s, H_sat {info['H_sat']:.1f} Oe, step {info['step_size']:.3g} Oe")
+            print(f"    {info['n_FORCs']} FORCs ({info['n_complete']} complete, repeats {max(info['n_repeats'], 1)}), {info['n_points']} points,"\
+                f" Ha {info['Ha_max']:.1f} to {info['Ha_min']:.1f} Oe, {info['hours']:.2f} h")
+        return 0
+    if args.command == 'follow':
+        FORC.follow_DAT_file(args.data_file, args.output_file, file_type = args.format, path_PMC_header = args.pmc_header,\
+            poll_interval = args.interval, timeout = args.timeout)
+        return 0
+    if args.command == 'estimate':
+        for path_seq_file in args.seq_files:
+            estimate = FORC.estimate_seq_file_time(path_seq_file)
+            print(f"{path_seq_file}: {estimate.total_hours:.2f} h, {len(estimate.FORC_times)} FORCs, {estimate.n_points} points"\
+                f" (setup {estimate.setup_time/60:.1f} min, teardown {estimate.teardown_time/60:.1f} min)")
+            if args.per_FORC:
+                for k, FORC_time in enumerate(estimate.FORC_times):
+                    print(f"    FORC_{str(k+1).zfill(3)}: {FORC_time/60:.1f} min")
+        return 0
+    if args.command == 'cache':
+        if args.action == 'clear':
+            print(f"Removed {FORC.clear_FORC_cache(args.dir)} cache entries")
+            return 0
+        entries = FORC.inspect_FORC_cache(args.dir)
+        for entry in entries:
+            print(f"{entry['bytes']/1024**2:9.2f} MB  {'valid' if entry['valid'] else 'stale'}  {entry['path']}")
+        print(f"{len(entries)} entries, {sum(entry['bytes'] for entry in entries)/1024**2:.2f} MB in {FORC.FORC_CACHE_DIR if args.dir is None else args.dir}")
+        return 0
+    if args.command == 'store':
+        # NumPy is imported with the store, the other commands import it on first use
+        import FORC_store
+        if args.action == 'add':
+            paths_data_files = [path for data_file in args.data_files for path in\
+                ([path for _, path in FORC.get_files_from_dir(data_file, '.DAT', recursive = True)] if os.path.isdir(data_file) else [data_file])]
+            store = FORC_store.build_FORC_store(args.store_dir, paths_data_files, Hb_step = args.Hb_step, Hb_range = args.Hb_range, use_cache = not args.no_cache,\
+                n_workers = args.workers, replace = args.replace)
+        else:
+            store = FORC_store.FORCStore(args.store_dir)
+        for entry in store.entries:
+            n_curves = entry['ranges']['offsets'][1] - entry['ranges']['offsets'][0]
+            n_points = entry['ranges']['field'][1] - entry['ranges']['field'][0]
+            print(f"{entry['sample']:<20} {entry['temperature']:8.2f} K  {n_curves:5d} FORCs {n_points:9d} points  {entry['name']}")
+        grid = store.manifest['grid']
+        print(f"{len(store)} datasets, {store.nbytes/1024**2:.2f} MB in {args.store_dir}, Hb grid {grid['Hb_min']} to {grid['Hb_max']} Oe in {grid['Hb_step']} Oe")
+        return 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,11 +4,333 @@
     11-2022: Written by Rahul Jangid for use by R. Kukreja's group
 '''
 from sys import platform
-import pandas as pd
-import numpy as np
 from pathlib import Path
+import concurrent.futures
+import importlib.util
+import collections
+import contextlib
+import tracemalloc
+import threading
+import logging
+import hashlib
+import shutil
+import time
+import json
+import csv
+import io
+import re
+import sys
 import os
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the peak memory of the stages is then only known with trace_memory
+    resource = None
+
+class _LazyModule:
+    """Stands in for a module until one of its attributes is used, then imports it and replaces itself in the globals
+
+    pandas and NumPy take hundreds of ms to import, the seqns_* builders and the command line help need neither.
+    """
+    def __init__(self, name, alias):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+np = _LazyModule('numpy', 'np')
+pd = _LazyModule('pandas', 'pd')
+
+# Columns of the QD VersaLab .DAT export used by the converters
+DAT_COMMENT_COLUMN = 'Comment'
+DAT_FIELD_COLUMN = 'Magnetic Field (Oe)'
+DAT_MOMENT_COLUMN = 'Moment (emu)'
+DAT_TEMP_COLUMN = 'Temperature (K)'
+DAT_AVGING_TIME_COLUMN = 'Averaging Time (sec)'
+DAT_TIME_COLUMN = 'Time Stamp (sec)'
+DAT_COLUMNS = (DAT_COMMENT_COLUMN, DAT_FIELD_COLUMN, DAT_MOMENT_COLUMN)
+
+# Output file extension, trailer lines and encoding of each export format.
+# doFORC files keep the .DAT extension like in the converter notebook
+FORC_FILE_EXTENSIONS = {'PMC': '.forc', 'FORCinel': '.frc', 'doFORC': '.DAT', 'csv': '.csv', 'npz': '.npz', 'density': '_density.npz'}
+FORC_END_LINES = {'PMC': ['MicroMag 2900/3900 Data File ends', '', ''], 'FORCinel': ['END', ''], 'doFORC': []}
+FORC_FILE_ENCODINGS = {'PMC': 'cp1252', 'FORCinel': None, 'doFORC': None}
+FORC_WRITE_BUFFER = 1 << 20
+
+# Compression of .DAT and exported files, picked from the extension, e.g. S23_200K.DAT.gz or S23_200K_1.frc.xz.
+# The codec modules are imported on first use, .zst needs the zstandard package
+FORC_COMPRESSION_MODULES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.zst': 'zstandard'}
+FORC_COMPRESSION_WRITE_OPTIONS = {'.gz': {'compresslevel': 6}, '.bz2': {}, '.xz': {}, '.zst': {}}
+
+def FORC_compression(path):
+    """Compression suffix of a path, '.gz', '.bz2', '.xz', '.zst' or None for plain files"""
+    suffix = os.path.splitext(str(path))[1].lower()
+    return suffix if suffix in FORC_COMPRESSION_MODULES else None
+
+def strip_compression_suffix(path):
+    """Path without its compression suffix, e.g. S23_200K.DAT.gz gives S23_200K.DAT"""
+    compression = FORC_compression(path)
+    return str(path)[:-len(compression)] if compression else str(path)
+
+def DAT_file_stem(path):
+    """File name without extension and compression suffix, e.g. S23_200K.DAT.gz gives S23_200K"""
+    return Path(strip_compression_suffix(path)).stem
+
+def open_FORC_file(path, mode = 'r', encoding = None, errors = None, newline = None, buffering = -1):
+    """Opens a file like open(), streaming .gz, .bz2, .xz and .zst files through their codec without a decompressed copy
+
+    Args:
+        path (str): path to the file, the compression is picked from its extension.
+        mode (str): 'r', 'w', 'a' with 'b' for binary files. Defaults to 'r'.
+        encoding, errors, newline: as for open() in text mode. Default to None.
+        buffering (int): buffer size of plain files. Defaults to -1.
+
+    Returns:
+        file: the open file
+    """
+    compression = FORC_compression(path)
+    if compression is None:
+        return open(path, mode, buffering=buffering, encoding=encoding, errors=errors, newline=newline)
+    try:
+        codec = importlib.import_module(FORC_COMPRESSION_MODULES[compression])
+    except ImportError:
+        raise ImportError(f"{path} needs the {FORC_COMPRESSION_MODULES[compression]} package") from None
+    binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+    f = codec.open(path, binary_mode, **({} if 'r' in binary_mode else FORC_COMPRESSION_WRITE_OPTIONS[compression]))
+    if 'b' in mode:
+        return f
+    return io.TextIOWrapper(f, encoding=encoding, errors=errors, newline=newline)
+
+def save_npz(path, **arrays):
+    """np.savez that also writes compressed files (e.g. .npz.gz), np.savez would add .npz to their name"""
+    if FORC_compression(path) is None:
+        np.savez(path, **arrays)
+        return
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    with open_FORC_file(path, 'wb') as f:
+        f.write(buffer.getvalue())
+
+# Instrumentation of the conversion and sequence stages, see FORCInstrumentation
+FORC_LOGGER = logging.getLogger('FORC_functions_RJ')
+FORC_PROFILE_TOP = 25
+_FORC_INSTRUMENTATIONS = []
+
+class FORCStageRecord:
+    """Measurements of one run of a stage, e.g. 'read_csv' or 'write_PMC'
+
+    Attributes:
+        name (str): name of the stage.
+        path (str): file the stage reads or writes, None if it has none.
+        wall_sec (float): wall time in sec.
+        rows (int): rows processed, None if not counted.
+        bytes_read (int): bytes read from files.
+        bytes_written (int): bytes written to files.
+        peak_bytes (int): peak memory during the stage, traced allocations when trace_memory is on, else the
+            peak resident memory of the process (0 where the platform does not report it).
+        profile (str): top of the cProfile stats when the stage was profiled, else None.
+    """
+    __slots__ = ('name', 'path', 'wall_sec', 'rows', 'bytes_read', 'bytes_written', 'peak_bytes', 'profile')
+
+    def __init__(self, name, path = None, rows = None, bytes_read = 0, bytes_written = 0):
+        self.name = name
+        self.path = None if path is None else str(path)
+        self.wall_sec = 0.0
+        self.rows = rows
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.peak_bytes = 0
+        self.profile = None
+
+    @property
+    def rows_per_sec(self):
+        """Processed rows per sec, None if the rows are not counted"""
+        return None if self.rows is None or self.wall_sec <= 0 else self.rows/self.wall_sec
+
+    def to_dict(self):
+        return dict({name: getattr(self, name) for name in self.__slots__}, rows_per_sec = self.rows_per_sec)
+
+    def __repr__(self):
+        rows = '' if self.rows is None else f", rows={self.rows}"
+        return f"FORCStageRecord(name={self.name!r}, wall_sec={self.wall_sec:.4f}{rows}, peak_bytes={self.peak_bytes})"
+
+def _peak_rss_bytes():
+    # Peak resident memory of the process, ru_maxrss is in kB on Linux and in bytes on macOS
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform == 'darwin' else peak*1024
+
+class FORCInstrumentation:
+    """Collects a FORCStageRecord of every stage run while it is active
+
+    The converters and the sequence generator mark their stages (reading the header, read_csv, segmenting the
+    curves, filtering, writing each format, ...) with FORC_stage. Outside of a FORCInstrumentation the stages
+    are only logged at DEBUG level on the 'FORC_functions_RJ' logger.
+
+        with FORCInstrumentation(callback = print, path_report = 'run.json') as instrumentation:
+            gen_PMC_FORC_file(...)
+        instrumentation.summary()
+
+    Args:
+        callback (callable): called with every FORCStageRecord when its stage ends. Defaults to None.
+        path_report (str): JSON run report written when the instrumentation is left. Defaults to None.
+        profile (bool or list): run the stages (or the stages with these names) under cProfile. Defaults to False.
+        trace_memory (bool): measure the peak memory of every stage with tracemalloc (slower). Defaults to False.
+        profile_dir (str): dir the .prof files of the profiled stages are saved in, for snakeviz or pstats. Defaults to None.
+    """
+    def __init__(self, callback = None, path_report = None, profile = False, trace_memory = False, profile_dir = None):
+        self.callback = callback
+        self.path_report = path_report
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.records = []
+        self.wall_sec = 0.0
+        self._lock = threading.Lock()
+        self._start = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._start = time.perf_counter()
+        _FORC_INSTRUMENTATIONS.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _FORC_INSTRUMENTATIONS.remove(self)
+        self.wall_sec = time.perf_counter() - self._start
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if self.path_report is not None:
+            self.write_report(self.path_report)
+        return False
+
+    def profiles(self, name):
+        """True if the stage name runs under cProfile"""
+        return self.profile is True or (bool(self.profile) and not isinstance(self.profile, bool) and name in self.profile)
+
+    def add(self, record):
+        """Stores a finished stage and passes it to the callback"""
+        with self._lock:
+            self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self):
+        """Totals per stage name: runs, wall time, rows, bytes and the highest peak memory
+
+        Returns:
+            dict: stage name to totals, in the order the stages first ran
+        """
+        return summarize_FORC_stages(record.to_dict() for record in self.records)
+
+    def report(self):
+        """Run report with the environment, the stage totals and every stage record"""
+        return {'python': sys.version.split()[0], 'numpy': np.__version__, 'pandas': pd.__version__,
+                'wall_sec': self.wall_sec, 'trace_memory': self.trace_memory,
+                'summary': self.summary(), 'stages': [record.to_dict() for record in self.records]}
+
+    def write_report(self, path_report):
+        """Saves the run report as json"""
+        with open(path_report, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def __repr__(self):
+        return f"FORCInstrumentation(stages={len(self.records)}, wall_sec={self.wall_sec:.3f})"
+
+@contextlib.contextmanager
+def FORC_stage(name, path = None, rows = None, bytes_read = 0):
+    """Marks a stage of the pipeline, the block can fill in rows and bytes of the yielded FORCStageRecord
+
+        with FORC_stage('read_csv', path_data_file) as stage:
+            data = pd.read_csv(...)
+            stage.rows = len(data)
+
+    Args:
+        name (str): name of the stage.
+        path (str): file the stage reads or writes. Defaults to None.
+        rows (int): rows processed, if known beforehand. Defaults to None.
+        bytes_read (int): bytes read, if known beforehand. Defaults to 0.
+
+    Yields:
+        FORCStageRecord: the record of this run of the stage
+    """
+    record = FORCStageRecord(name, path, rows, bytes_read)
+    instrumentation = _FORC_INSTRUMENTATIONS[-1] if _FORC_INSTRUMENTATIONS else None
+    profiler = None
+    if instrumentation is not None:
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        if instrumentation.profiles(name):
+            # Only imported when profiling, like pandas and NumPy they are not needed for the import
+            import cProfile, pstats
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another stage of a concurrent writer is already being profiled
+                profiler = None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.wall_sec = time.perf_counter() - start
+        if instrumentation is not None:
+            record.peak_bytes = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else _peak_rss_bytes()
+            if profiler is not None:
+                profiler.disable()
+                stats_text = io.StringIO()
+                stats = pstats.Stats(profiler, stream=stats_text)
+                stats.sort_stats('cumulative').print_stats(FORC_PROFILE_TOP)
+                record.profile = stats_text.getvalue()
+                if instrumentation.profile_dir is not None:
+                    os.makedirs(instrumentation.profile_dir, exist_ok=True)
+                    stats.dump_stats(os.path.join(instrumentation.profile_dir, f"{name}_{os.getpid()}_{len(instrumentation.records)}.prof"))
+            instrumentation.add(record)
+        if FORC_LOGGER.isEnabledFor(logging.DEBUG):
+            FORC_LOGGER.debug("%s %s: %.4f s, rows %s, read %d B, written %d B", name, record.path or '', record.wall_sec,\
+                record.rows, record.bytes_read, record.bytes_written)
+
+def summarize_FORC_stages(records):
+    """Totals per stage name of stage records (dicts of FORCStageRecord.to_dict, e.g. from a batch report)
+
+    Args:
+        records (iterable): stage records as dicts.
+
+    Returns:
+        dict: stage name to runs, wall time, rows, bytes, highest peak memory and rows/s, in the order the stages first ran
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['name'], {'runs': 0, 'wall_sec': 0.0, 'rows': 0, 'bytes_read': 0, 'bytes_written': 0, 'peak_bytes': 0})
+        total['runs'] += 1
+        total['wall_sec'] += record['wall_sec']
+        total['rows'] += record['rows'] or 0
+        total['bytes_read'] += record['bytes_read']
+        total['bytes_written'] += record['bytes_written']
+        total['peak_bytes'] = max(total['peak_bytes'], record['peak_bytes'])
+    for total in totals.values():
+        total['rows_per_sec'] = total['rows']/total['wall_sec'] if total['rows'] and total['wall_sec'] > 0 else None
+    return totals
+
+def _file_size(path):
+    # Size of a written file, 0 if it is not there
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
 def concat_type():
     """Function returns concat type depending on OS
 
@@ -163,8 +485,126 @@ def seqns_MvsH_sweep_measurement(freq = 39.7, amp = 2, min_field = -400, mid_fie
     line = f"VSMMH 1 0 0 0 0 {amp} {freq} {avging_time} 0 2 0 1 2 {min_field} {mid_field} {max_field} {step_size} 0 10000 {step_size} 0 2 1 0 1 0 \"A/C,0,10,10,0\" "
     return line
 
+def seqns_data_file_name(data_file_name = str, part = 1):
+    """Numbered name of a data file part, e.g. NN9_FORC.DAT -> NN9_FORC_part001.DAT
+
+    Args:
+        data_file_name (str): data file name. Defaults to str.
+        part (int): part number starting at 1. Defaults to 1.
+
+    Returns:
+        str: name of the part
+    """
+    stem, extension = os.path.splitext(data_file_name)
+    return f"{stem}_part{str(part).zfill(3)}{extension}"
+
+def seqns_single_FORC(FORC_number = str, Ha_field = float, ramp_rate = float, H_sat = 1000, ampli = 2, freq = 39.7, max_field = 300, min_field = -300,\
+    step_size = 0.5, avging_time = 1, data_file_line = None, repeat = None):
+    """Generates the lines of a single FORC: saturation measurement, ramp to Ha and MvsH sweep
+
+    Args:
+        FORC_number (str): number of the FORC used in the comment, e.g. "001". Defaults to str.
+        Ha_field (float): reversal field in Oe. Defaults to float.
+        ramp_rate (float): ramp rate from H_sat to Ha in Oe/sec. Defaults to float.
+        H_sat (int, optional): Saturating field in Oe. Defaults to 1000 Oe.
+        ampli (int, 1 < A < 4): Set the amplitude of sample viberation in mm. Defaults to 2 mm.
+        freq (float, optional): Freq to viberate the sample at in Hz. Defaults to 39.7 Hz.
+        max_field (int, optional): end of the sweep in Oe. Defaults to 300 Oe.
+        min_field (int, optional): min field of the sweep in Oe. Defaults to -300 Oe.
+        step_size (float, optional): field step of the sweep in Oe. Defaults to 0.5 Oe.
+        avging_time (int, optional): Avging time per point in sec. Defaults to 1 sec.
+        data_file_line (str, optional): VSMDF line to start a new data file with this FORC. Defaults to None.
+        repeat (int, optional): repeat number (1 based) of a repeated FORC, written in the comments as
+            FORC_001_repeat_2 so the converters can average the repeats. Defaults to None.
+
+    Returns:
+        list: lines of the seq file
+    """
+    label = f"FORC_{FORC_number}" if repeat is None else f"FORC_{FORC_number}_repeat_{repeat}"
+    
+    # Start saturation measurement
+    lines = [seqns_comment(label)]
+    if data_file_line is not None:
+        lines.append(data_file_line)
+    lines += [seqns_set_field(field = H_sat, ramp_rate = 50, apprach_type = 0),
+              seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1),
+              seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 0, measuremet_type = 1),
+              seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 1, measuremet_type = 1)]
+    
+    # Start FORC measurement
+    lines += [seqns_add_cmmt_in_data(comment = "start_data_FORC" if repeat is None else f"start_data_{label}"),
+              seqns_set_field(field = Ha_field, ramp_rate = ramp_rate, apprach_type = 0),
+              seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1),
+              seqns_MvsH_sweep_measurement(freq = freq, amp = ampli, min_field = min_field, mid_field = Ha_field,\
+                  max_field = max_field,  step_size = step_size, avging_time = avging_time),
+              seqns_add_cmmt_in_data(comment = "end_data_FORC")]
+    return lines
+
+def seqns_FORC_measurement_lines(set_temp = 50, temp_rate = 10, ampli = 2, freq = 39.7, H_sat = 1000, max_field = 300, min_field = -300,\
+    max_reversal_field = 100, min_reversal_field = -300, N_FORCs = 200, step_size = 0.5, avging_time = 1, data_file_path = str, data_file_name = str,\
+    N_FORCs_per_file = None, plan = None, N_repeat = 1, repeat_mode = 'interleaved'):
+    """Generates the lines of a FORC measurement sequence, see seqns_FORC_measurements_V1 for the arguments
+
+    Returns:
+        list: lines of the seq file
+    """
+    # Calculating the step size in reversal field
+    field_range = max_reversal_field - min_reversal_field
+    dHa = field_range/N_FORCs
+    
+    # Initial temp setup
+    lines = [seqns_set_field(field = 0, ramp_rate = 100, apprach_type = 0),
+             seqns_set_temp(temp = set_temp, rate = temp_rate, mode = 0),
+             seqns_wait_for_settle(wait_time = 3600, temp_bool = 1, field_bool = 1),
+             seqns_add_touchdown()]
+    
+    if plan is None:
+        # Uniform reversal fields, every FORC sweeps the full field window as in the original generator
+        Ha_fields = [max_reversal_field-(idx+1)*dHa for idx in range(N_FORCs-1)]
+        ramp_rates, max_fields, step_sizes = [dHa]*len(Ha_fields), [max_field]*len(Ha_fields), [step_size]*len(Ha_fields)
+        min_fields = [min_field]*len(Ha_fields)
+        FORC_numbers = list(range(1, len(Ha_fields) + 1))
+    else:
+        Ha_fields, ramp_rates = plan.Ha.tolist(), plan.ramp_rate.tolist()
+        max_fields, step_sizes = plan.sweep_stop.tolist(), plan.step_size.tolist()
+        # A planned Ha below min_field would leave its reversal point outside the sweep window
+        min_fields = [min(min_field, Ha_field) for Ha_field in Ha_fields]
+        FORC_numbers = plan.FORC_number.tolist()
+    
+    # Order of the measured curves as (FORC, repeat), repeats right after each other or as repeated blocks of all FORCs
+    if repeat_mode == 'interleaved':
+        curves = [(k, r) for k in range(len(Ha_fields)) for r in range(N_repeat)]
+    elif repeat_mode == 'block':
+        curves = [(k, r) for r in range(N_repeat) for k in range(len(Ha_fields))]
+    else:
+        raise ValueError(f"Unknown repeat_mode '{repeat_mode}', use 'interleaved' or 'block'")
+    
+    for idx, (k, r) in enumerate(curves):
+        Ha_field = Ha_fields[k]
+        FORC_number = str(FORC_numbers[k]).zfill(3)
+        
+        # New data file for the first FORC and every N_FORCs_per_file FORCs
+        data_file_line = None
+        if N_FORCs_per_file is None and idx == 0:
+            data_file_line = seqns_create_data_file(file_directory = data_file_path, file_name = data_file_name)
+        elif N_FORCs_per_file is not None and idx % N_FORCs_per_file == 0:
+            part_name = seqns_data_file_name(data_file_name, idx//N_FORCs_per_file + 1)
+            data_file_line = seqns_create_data_file(file_directory = data_file_path, file_name = part_name)
+        
+        lines += seqns_single_FORC(FORC_number = FORC_number, Ha_field = Ha_field, ramp_rate = ramp_rates[k], H_sat = H_sat, ampli = ampli, freq = freq,\
+            max_field = max_fields[k], min_field = min_fields[k], step_size = step_sizes[k], avging_time = avging_time,\
+            data_file_line = data_file_line, repeat = r+1 if N_repeat > 1 else None)
+    
+    # Ending seqns with setting 300 K and 0 Oe field
+    lines += [seqns_set_field(field = 0, ramp_rate = 100, apprach_type = 0),
+              seqns_set_temp(temp = 300, rate = temp_rate, mode = 0),
+              seqns_wait_for_settle(wait_time = 5, temp_bool = 1, field_bool = 1)]
+    
+    return lines
+
 def seqns_FORC_measurements_V1(set_temp = 50, temp_rate = 10, ampli = 2, freq = 39.7, H_sat = 1000, max_field = 300, min_field = -300, max_reversal_field = 100,\
-    min_reversal_field = -300, N_FORCs = 200, step_size = 0.5, avging_time = 1, N_repeat = 1, seq_file_path_n_name = str, data_file_path = str, data_file_name = str):
+    min_reversal_field = -300, N_FORCs = 200, step_size = 0.5, avging_time = 1, N_repeat = 1, seq_file_path_n_name = str, data_file_path = str, data_file_name = str,\
+    N_FORCs_per_file = None, plan = None, repeat_mode = 'interleaved'):
     """Generates a seqns file to do FORC measurements for Quantum Design VSM
 
     Args:
@@ -179,122 +619,557 @@ def seqns_FORC_measurements_V1(set_temp = 50, temp_rate = 10, ampli = 2, freq =
         N_FORCs (int, optional): _description_. Defaults to 200.
         step_size (float, optional): _description_. Defaults to 0.5 Oe.
         avging_time (int, optional): _description_. Defaults to 1 sec.
-        N_repeat (int, optional): _description_. Defaults to 1. #### Still working on this!!!
+        N_repeat (int, optional): number of times every FORC is measured, the repeats are labelled FORC_001_repeat_2 in the
+            data file comments and averaged by the converters. Defaults to 1.
         seq_file_path_n_name (_type_, optional): path/name of the seqns file. Defaults to str.
         data_file_path (_type_, optional): data file path. Defaults to str.
         data_file_name (_type_, optional): data file name. Defaults to str.
+        N_FORCs_per_file (int, optional): start a new data file every N_FORCs_per_file measured curves, named
+            NN9_FORC_part001.DAT, NN9_FORC_part002.DAT, ... None keeps all FORCs in one file. Defaults to None.
+        plan (FORCPlan, optional): per-FORC reversal fields, sweep ends, step sizes and ramp rates from plan_FORC_grid or
+            plan_FORC_grid_for_budget, replaces the uniform grid of max/min_reversal_field, N_FORCs, max_field and step_size. Defaults to None.
+        repeat_mode (str, optional): 'interleaved' measures the repeats of a FORC right after each other, 'block' repeats
+            the whole set of FORCs N_repeat times (drift shows up between the blocks). Defaults to 'interleaved'.
     """
-    # Calculating the step size in reversal field
-    field_range = max_reversal_field - min_reversal_field
-    dHa = field_range/N_FORCs
+    with FORC_stage('seq_lines') as stage:
+        lines = seqns_FORC_measurement_lines(set_temp = set_temp, temp_rate = temp_rate, ampli = ampli, freq = freq, H_sat = H_sat, max_field = max_field,\
+            min_field = min_field, max_reversal_field = max_reversal_field, min_reversal_field = min_reversal_field, N_FORCs = N_FORCs, step_size = step_size,\
+            avging_time = avging_time, data_file_path = data_file_path, data_file_name = data_file_name, N_FORCs_per_file = N_FORCs_per_file, plan = plan,\
+            N_repeat = N_repeat, repeat_mode = repeat_mode)
+        stage.rows = len(lines)
     
-    with open(seq_file_path_n_name, 'w') as f:
-        for idx in range(N_FORCs-1):
-            # Chaning the Ha field
-            Ha_field = max_reversal_field-(idx+1)*dHa
-            FORC_number = str(idx+1).zfill(3)
-            if idx == 0:
-                # Initial temp setup
-                f.write(seqns_set_field(field = 0, ramp_rate = 100, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_set_temp(temp = set_temp, rate = temp_rate, mode = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 3600, temp_bool = 1, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_add_touchdown())
-                f.write('\n')
-                
-                # Start saturation measurement
-                f.write(seqns_comment(f"FORC_{FORC_number}"))
-                f.write('\n')
-                f.write(seqns_create_data_file(file_directory = data_file_path, file_name = data_file_name))
-                f.write('\n')
-                f.write(seqns_set_field(field = H_sat, ramp_rate = 50, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 0, measuremet_type = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 1, measuremet_type = 1))
-                f.write('\n')
-                
-                # Start FORC measurement
-                f.write(seqns_add_cmmt_in_data(comment = "start_data_FORC"))
-                f.write('\n')
-                f.write(seqns_set_field(field = Ha_field, ramp_rate = dHa, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_MvsH_sweep_measurement(freq = freq, amp = ampli, min_field = min_field, mid_field = Ha_field,\
-                    max_field = max_field,  step_size = step_size, avging_time = avging_time))
-                f.write('\n')
-                f.write(seqns_add_cmmt_in_data(comment = "end_data_FORC"))
-                f.write('\n')
-            elif idx > 0 and idx < (N_FORCs-2):
-                # Start saturation measurement
-                f.write(seqns_comment(f"FORC_{FORC_number}"))
-                f.write('\n')
-                f.write(seqns_set_field(field = H_sat, ramp_rate = 50, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 0, measuremet_type = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 1, measuremet_type = 1))
-                f.write('\n')
-                
-                # Start FORC measurement
-                f.write(seqns_add_cmmt_in_data(comment = "start_data_FORC"))
-                f.write('\n')
-                f.write(seqns_set_field(field = Ha_field, ramp_rate = dHa, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_MvsH_sweep_measurement(freq = freq, amp = ampli, min_field = min_field, mid_field = Ha_field,\
-                    max_field = max_field,  step_size = step_size, avging_time = avging_time))
-                f.write('\n')
-                f.write(seqns_add_cmmt_in_data(comment = "end_data_FORC"))
-                f.write('\n')
-            elif idx == (N_FORCs-2):
-                # Start saturation measurement
-                f.write(seqns_comment(f"FORC_{FORC_number}"))
-                f.write('\n')
-                f.write(seqns_set_field(field = H_sat, ramp_rate = 50, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 0, measuremet_type = 1))
-                f.write('\n')
-                f.write(seqns_adv_measurement(freq = freq, amp = 2, avg_time = 2, start_stop_bool = 1, measuremet_type = 1))
-                f.write('\n')
-                
-                # Start FORC measurement
-                f.write(seqns_add_cmmt_in_data(comment = "start_data_FORC"))
-                f.write('\n')
-                f.write(seqns_set_field(field = Ha_field, ramp_rate = dHa, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1))
-                f.write('\n')
-                f.write(seqns_MvsH_sweep_measurement(freq = freq, amp = ampli, min_field = min_field, mid_field = Ha_field,\
-                    max_field = max_field,  step_size = step_size, avging_time = avging_time))
-                f.write('\n')
-                f.write(seqns_add_cmmt_in_data(comment = "end_data_FORC"))
-                f.write('\n')
-                
-                # Ending seqns with setting 300 K and 0 Oe field
-                f.write(seqns_set_field(field = 0, ramp_rate = 100, apprach_type = 0))
-                f.write('\n')
-                f.write(seqns_set_temp(temp = 300, rate = temp_rate, mode = 0))
-                f.write('\n')
-                f.write(seqns_wait_for_settle(wait_time = 5, temp_bool = 1, field_bool = 1))
-                f.write('\n')
-
-            # f.write('\n')
+    with FORC_stage('write_seq', seq_file_path_n_name, rows = len(lines)) as stage:
+        with open(seq_file_path_n_name, 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+        stage.bytes_written = _file_size(seq_file_path_n_name)
             
     print("Done generating the sequence file!!!")
     print("Seqence exported at:")
     print(seq_file_path_n_name)
     
+# Sequence commands understood by the time estimator, as written by the seqns_* functions
+SEQ_COMMANDS = ('REM', 'FLD', 'TMP', 'WAI', 'VSMCO', 'VSMMH', 'VSMLS', 'VSMCM', 'VSMDF')
+SEQ_TOKEN_PATTERN = re.compile(r'"[^"]*"|\S+')
+
+# Instrument overheads in sec used by the time estimator
+SEQ_TIMING = {'command': 0.5,          # every command line
+              'field_settle': 5,       # WAI with field_bool after the field ramp ends
+              'temp_settle': 300,      # WAI with temp_bool after the temp ramp ends
+              'measurement': 2,        # start of a VSMCO measurement on top of its avging time
+              'sweep_point': 0.2,      # every point of a VSMMH sweep on top of its avging time
+              'touchdown': 120,        # VSMLS touchdown for centering the sample
+              'data_file': 1}          # VSMDF opening a new data file
+
+def parse_seq_line(line):
+    """Splits a line of a seq file into its command and arguments
+
+    Args:
+        line (str): line of the seq file, e.g. 'FLD FIELD 500 50 0 0'.
+
+    Returns:
+        tuple: (command, list of str arguments), the FIELD/TEMP/WAITFOR keyword is dropped and quotes are kept.
+            (None, []) for an empty line
+    """
+    tokens = SEQ_TOKEN_PATTERN.findall(line)
+    if not tokens:
+        return None, []
+    command = tokens[0]
+    if command in ('FLD', 'TMP', 'WAI') and len(tokens) > 1:
+        return command, tokens[2:]
+    if command == 'REM':
+        return command, [line.strip()[4:]]
+    return command, tokens[1:]
+
+def parse_seq_file(path_seq_file):
+    """Parses a seq file into its commands
+
+    Args:
+        path_seq_file (str): path to the seq file.
+
+    Returns:
+        list: (command, arguments) per non empty line
+    """
+    with open(path_seq_file, 'r') as f:
+        return parse_seq_lines(f.read().splitlines())
+
+def parse_seq_lines(lines):
+    """Parses the lines of a sequence into its commands, unknown commands raise ValueError
+
+    Args:
+        lines (list): lines of the seq file.
+
+    Returns:
+        list: (command, arguments) per non empty line
+    """
+    commands = []
+    for line_number, line in enumerate(lines, 1):
+        command, args = parse_seq_line(line)
+        if command is None:
+            continue
+        if command not in SEQ_COMMANDS:
+            raise ValueError(f"Unknown command {command!r} in line {line_number} of the sequence")
+        commands.append((command, args))
+    return commands
+
+class SeqTimeEstimate:
+    """Estimated wall time of a sequence
+
+    Attributes:
+        durations (np.ndarray): duration in sec of every command.
+        FORC_times (np.ndarray): time in sec of every FORC, from its REM ##FORC_ line to the next one.
+        setup_time (float): time in sec before the first FORC (field, temperature and touchdown).
+        teardown_time (float): time in sec after the end_data_FORC comment of the last FORC.
+        n_points (int): number of points measured in the MvsH sweeps.
+    """
+    __slots__ = ('durations', 'FORC_times', 'setup_time', 'teardown_time', 'n_points')
+
+    def __init__(self, durations, FORC_times, setup_time, teardown_time, n_points):
+        self.durations = durations
+        self.FORC_times = FORC_times
+        self.setup_time = setup_time
+        self.teardown_time = teardown_time
+        self.n_points = n_points
+
+    @property
+    def total_time(self):
+        """Total time of the sequence in sec"""
+        return float(self.durations.sum())
+
+    @property
+    def total_hours(self):
+        return self.total_time/3600
+
+    def __repr__(self):
+        return (f"SeqTimeEstimate(total_hours={self.total_hours:.2f}, n_FORCs={len(self.FORC_times)}, "
+                f"n_points={self.n_points}, setup_time={self.setup_time:.0f}, teardown_time={self.teardown_time:.0f})")
+
+def simulate_seq_time(commands, initial_field = 0, initial_temp = 300, timing = None):
+    """Estimates the wall time of a sequence from its ramp rates, waits, sweeps and averaging times
+
+    Field and temperature ramps run in the background and are waited for by the next WAI or measurement command,
+    so a field and a temperature ramp set back to back overlap. A VSMMH sweep measures ceil((max - mid)/step) + 1
+    points from the mid (reversal) field up to the max field and leaves the field at the max field.
+
+    Args:
+        commands (list): (command, arguments) from parse_seq_lines or parse_seq_file.
+        initial_field (float): field in Oe when the sequence starts. Defaults to 0 Oe.
+        initial_temp (float): temperature in K when the sequence starts. Defaults to 300 K.
+        timing (dict): overheads in sec replacing the ones of SEQ_TIMING. Defaults to None.
+
+    Returns:
+        SeqTimeEstimate: estimated times
+    """
+    timing = {**SEQ_TIMING, **(timing or {})}
+    n = len(commands)
+    names = np.array([command for command, _ in commands] + [''], dtype=object)[:n]
+    # Numeric arguments of the commands, NaN where the command has no such argument
+    params = np.full((n, 4), np.nan)
+    FORC_start = np.zeros(n, dtype=bool)
+    FORC_end = np.zeros(n, dtype=bool)
+    for row, (command, args) in enumerate(commands):
+        if command in ('FLD', 'TMP'):
+            params[row, :2] = args[0], args[1]
+        elif command == 'WAI':
+            params[row, :3] = args[0], args[1], args[2]
+        elif command == 'VSMCO':
+            # avging time, start (0) or stop (1)
+            params[row, :2] = args[7], args[4]
+        elif command == 'VSMMH':
+            # avging time, mid field, max field, step size
+            params[row] = args[7], args[14], args[15], args[16]
+        elif command == 'REM':
+            FORC_start[row] = args[0].startswith('##FORC_')
+        elif command == 'VSMCM':
+            FORC_end[row] = args[0].strip('"').lower() == 'end_data_forc'
+
+    is_FLD, is_TMP, is_WAI = names == 'FLD', names == 'TMP', names == 'WAI'
+    is_VSMCO, is_VSMMH = names == 'VSMCO', names == 'VSMMH'
+    durations = np.full(n, float(timing['command']))
+
+    # Field after every command, a sweep leaves the field at its max field
+    field = np.where(is_FLD, params[:, 0], np.where(is_VSMMH, params[:, 2], np.nan))
+    field_before = pd.Series(np.concatenate([[initial_field], field])).ffill().to_numpy()[:-1]
+    temp = np.where(is_TMP, params[:, 0], np.nan)
+    temp_before = pd.Series(np.concatenate([[initial_temp], temp])).ffill().to_numpy()[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        field_ramp = np.where(is_FLD, np.abs(params[:, 0] - field_before)/params[:, 1], 0)
+        temp_ramp = np.where(is_TMP, np.abs(params[:, 0] - temp_before)/params[:, 1]*60, 0)
+    field_ramp = np.nan_to_num(field_ramp, nan=0, posinf=0)
+    temp_ramp = np.nan_to_num(temp_ramp, nan=0, posinf=0)
+
+    # Ramps pending before a blocking command are waited for by it, field and temp ramps overlap
+    blocking = is_WAI | is_VSMCO | is_VSMMH | (names == 'VSMLS')
+    group = np.cumsum(blocking) - blocking
+    pending_field = np.bincount(group, weights=field_ramp, minlength=n)
+    pending_temp = np.bincount(group, weights=temp_ramp, minlength=n)
+    blocking_rows = np.flatnonzero(blocking)
+    durations[blocking_rows] += np.maximum(pending_field, pending_temp)[group[blocking_rows]]
+    # Ramps not followed by any blocking command still run before the sequence ends
+    if n and not blocking[-1]:
+        durations[-1] += max(pending_field[group[-1]], pending_temp[group[-1]])
+
+    durations += np.where(is_WAI, np.nan_to_num(params[:, 0]) + params[:, 2]*timing['field_settle'] + params[:, 1]*timing['temp_settle'], 0)
+    durations += np.where(is_VSMCO & (params[:, 1] == 0), params[:, 0] + timing['measurement'], 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_sweep_points = np.where(is_VSMMH, np.ceil(np.abs(params[:, 2] - params[:, 1])/params[:, 3]) + 1, 0)
+    n_sweep_points = np.nan_to_num(n_sweep_points, nan=0, posinf=0)
+    durations += n_sweep_points*(np.nan_to_num(params[:, 0]) + timing['sweep_point'])
+    durations[names == 'VSMLS'] += timing['touchdown']
+    durations[names == 'VSMDF'] += timing['data_file']
+
+    # Splitting the time into setup, FORCs and teardown
+    FORC_rows = np.flatnonzero(FORC_start)
+    end_rows = np.flatnonzero(FORC_end)
+    teardown_start = end_rows[-1] + 1 if len(end_rows) else n
+    FORC_id = np.cumsum(FORC_start)
+    in_FORCs = np.arange(n) < teardown_start
+    FORC_times = np.bincount(FORC_id[in_FORCs], weights=durations[in_FORCs], minlength=len(FORC_rows) + 1)
+    return SeqTimeEstimate(durations = durations, FORC_times = FORC_times[1:], setup_time = float(FORC_times[0]),\
+        teardown_time = float(durations[teardown_start:].sum()), n_points = int(n_sweep_points.sum()))
+
+def estimate_seq_file_time(path_seq_file, **kwargs):
+    """Estimates the wall time of a seq file, see simulate_seq_time for the keyword arguments
+
+    Args:
+        path_seq_file (str): path to the seq file.
+
+    Returns:
+        SeqTimeEstimate: estimated times
+    """
+    return simulate_seq_time(parse_seq_file(path_seq_file), **kwargs)
+
+def estimate_FORC_measurement_time(timing = None, **kwargs):
+    """Estimates the wall time of a FORC measurement without writing the seq file, e.g. to compare N_FORCs, step_size,
+    avging_time or H_sat choices
+
+    Args:
+        timing (dict): overheads in sec replacing the ones of SEQ_TIMING. Defaults to None.
+        **kwargs: arguments of seqns_FORC_measurement_lines.
+
+    Returns:
+        SeqTimeEstimate: estimated times
+    """
+    kwargs.setdefault('data_file_path', '')
+    kwargs.setdefault('data_file_name', 'FORC.DAT')
+    return simulate_seq_time(parse_seq_lines(seqns_FORC_measurement_lines(**kwargs)), timing = timing)
+
+class FORCPlan:
+    """Per-FORC plan of a FORC measurement used by seqns_FORC_measurement_lines
+
+    Attributes:
+        Ha (np.ndarray): reversal field of every FORC in Oe, in measurement order.
+        sweep_stop (np.ndarray): end of the sweep of every FORC in Oe.
+        step_size (np.ndarray): field step of the sweep of every FORC in Oe.
+        ramp_rate (np.ndarray): ramp rate from H_sat to Ha of every FORC in Oe/sec.
+        FORC_number (np.ndarray): number of every FORC used in the seq comments, 1 to n_FORCs unless the plan
+            is a subset of a larger one (e.g. a resumed run).
+    """
+    __slots__ = ('Ha', 'sweep_stop', 'step_size', 'ramp_rate', 'FORC_number')
+
+    def __init__(self, Ha, sweep_stop, step_size, ramp_rate, FORC_number = None):
+        self.Ha = np.asarray(Ha, dtype=float)
+        n = len(self.Ha)
+        self.FORC_number = np.arange(1, n + 1) if FORC_number is None else np.asarray(FORC_number, dtype=np.int64)
+        self.sweep_stop = np.broadcast_to(np.asarray(sweep_stop, dtype=float), n).copy()
+        self.step_size = np.broadcast_to(np.asarray(step_size, dtype=float), n).copy()
+        self.ramp_rate = np.broadcast_to(np.asarray(ramp_rate, dtype=float), n).copy()
+
+    @property
+    def n_FORCs(self):
+        return len(self.Ha)
+
+    @property
+    def n_points(self):
+        """Number of points measured in all sweeps"""
+        return int((np.ceil((self.sweep_stop - self.Ha)/self.step_size) + 1).sum())
+
+    def subset(self, keep):
+        """Plan of the FORCs where keep is True, keeping their FORC numbers"""
+        keep = np.asarray(keep, dtype=bool)
+        return FORCPlan(self.Ha[keep], self.sweep_stop[keep], self.step_size[keep], self.ramp_rate[keep], self.FORC_number[keep])
+
+    def __repr__(self):
+        return (f"FORCPlan(n_FORCs={self.n_FORCs}, n_points={self.n_points}, "
+                f"Ha=[{self.Ha.max() if self.n_FORCs else np.nan}, {self.Ha.min() if self.n_FORCs else np.nan}])")
+
+def plan_FORC_grid(Hc_max = 300, Hu_min = -150, Hu_max = 150, spacing = 2, regions = None, max_field = 300, ramp_rate = 50, decimals = 3):
+    """Plans a FORC grid covering the Hc = (Hb - Ha)/2, Hu = (Hb + Ha)/2 window of interest
+
+    Every FORC only sweeps up to the field where it leaves the window, min(Ha + 2*Hc_max, 2*Hu_max - Ha, max_field),
+    and FORCs with no point inside the window are not measured. Ha is approached at ramp_rate instead of dHa Oe/sec.
+
+    Args:
+        Hc_max (float): max coercive field of the window in Oe. Defaults to 300 Oe.
+        Hu_min (float): min interaction field of the window in Oe. Defaults to -150 Oe.
+        Hu_max (float): max interaction field of the window in Oe. Defaults to 150 Oe.
+        spacing (float): reversal field spacing and step size in Oe. Defaults to 2 Oe.
+        regions (list): (Ha_high, Ha_low, spacing) per region of reversal fields measured with their own spacing
+            and step size, replaces spacing. Defaults to None.
+        max_field (float): highest field of the sweeps in Oe. Defaults to 300 Oe.
+        ramp_rate (float): ramp rate from H_sat to Ha in Oe/sec. Defaults to 50 Oe/sec.
+        decimals (int): decimals the fields are rounded to. Defaults to 3.
+
+    Returns:
+        FORCPlan: the plan, FORCs ordered from the highest to the lowest Ha
+    """
+    if regions is None:
+        regions = [(Hu_max, Hu_min - Hc_max, spacing)]
+    Ha, step_size = [], []
+    for Ha_high, Ha_low, region_spacing in regions:
+        region_Ha = Ha_high - region_spacing*np.arange(int(np.floor((Ha_high - Ha_low)/region_spacing + 1e-9)) + 1)
+        Ha.append(region_Ha)
+        step_size.append(np.full(len(region_Ha), float(region_spacing)))
+    Ha = np.round(np.concatenate(Ha), decimals)
+    step_size = np.concatenate(step_size)
+    Ha, first = np.unique(Ha, return_index=True)
+    Ha, step_size = Ha[::-1], step_size[first][::-1]
+
+    # Sweeps end where they leave the window, rounded up to a whole number of steps
+    sweep_stop = np.minimum(np.minimum(Ha + 2*Hc_max, 2*Hu_max - Ha), max_field)
+    sweep_stop = np.minimum(Ha + np.ceil(np.round((sweep_stop - Ha)/step_size, 9))*step_size, max_field)
+    keep = (sweep_stop > Ha) & (sweep_stop >= 2*Hu_min - Ha)
+    return FORCPlan(Ha = Ha[keep], sweep_stop = np.round(sweep_stop[keep], decimals), step_size = step_size[keep], ramp_rate = ramp_rate)
+
+def plan_FORC_grid_for_budget(time_budget, Hc_max = 300, Hu_min = -150, Hu_max = 150, max_field = 300, ramp_rate = 50, min_spacing = 0.1,\
+    max_spacing = 50, timing = None, **kwargs):
+    """Plans the finest uniform FORC grid of the window of interest that is measured within a time budget
+
+    Args:
+        time_budget (float): available instrument time in hours.
+        Hc_max (float): max coercive field of the window in Oe. Defaults to 300 Oe.
+        Hu_min (float): min interaction field of the window in Oe. Defaults to -150 Oe.
+        Hu_max (float): max interaction field of the window in Oe. Defaults to 150 Oe.
+        max_field (float): highest field of the sweeps in Oe. Defaults to 300 Oe.
+        ramp_rate (float): ramp rate from H_sat to Ha in Oe/sec. Defaults to 50 Oe/sec.
+        min_spacing (float): finest spacing tried in Oe. Defaults to 0.1 Oe.
+        max_spacing (float): coarsest spacing tried in Oe. Defaults to 50 Oe.
+        timing (dict): overheads in sec replacing the ones of SEQ_TIMING. Defaults to None.
+        **kwargs: arguments of seqns_FORC_measurement_lines used for the time estimate (set_temp, H_sat, avging_time, ...),
+            pass the same ones to the generator.
+
+    Returns:
+        tuple: (FORCPlan, SeqTimeEstimate) of the finest grid within the budget
+    """
+    def plan_and_estimate(spacing):
+        plan = plan_FORC_grid(Hc_max = Hc_max, Hu_min = Hu_min, Hu_max = Hu_max, spacing = spacing, max_field = max_field, ramp_rate = ramp_rate)
+        return plan, estimate_FORC_measurement_time(timing = timing, plan = plan, **kwargs)
+
+    best = plan_and_estimate(max_spacing)
+    if best[1].total_hours > time_budget:
+        raise ValueError(f"Even a {max_spacing} Oe grid takes {best[1].total_hours:.2f} h, more than the {time_budget} h budget")
+    # Bisection on the log of the spacing, the measurement time falls monotonically with the spacing
+    low, high = np.log(min_spacing), np.log(max_spacing)
+    for _ in range(30):
+        if high - low < 1e-3:
+            break
+        middle = (low + high)/2
+        candidate = plan_and_estimate(float(np.round(np.exp(middle), 3)))
+        if candidate[1].total_hours <= time_budget:
+            best, high = candidate, middle
+        else:
+            low = middle
+    return best
+
+def uniform_FORC_plan(max_field = 300, max_reversal_field = 100, min_reversal_field = -300, N_FORCs = 200, step_size = 0.5):
+    """Plan of the uniform grid seqns_FORC_measurement_lines measures without plan
+
+    Args:
+        max_field (int, optional): end of the sweeps in Oe. Defaults to 300 Oe.
+        max_reversal_field (int, optional): Defaults to 100 Oe.
+        min_reversal_field (int, optional): Defaults to -300 Oe.
+        N_FORCs (int, optional): Defaults to 200.
+        step_size (float, optional): Defaults to 0.5 Oe.
+
+    Returns:
+        FORCPlan: the plan, Ha approached at dHa Oe/sec like in the generator
+    """
+    dHa = (max_reversal_field - min_reversal_field)/N_FORCs
+    Ha = [max_reversal_field-(idx+1)*dHa for idx in range(N_FORCs-1)]
+    return FORCPlan(Ha = Ha, sweep_stop = max_field, step_size = step_size, ramp_rate = dHa)
+
+def find_missing_FORCs(dataset, plan, N_repeat = 1, tolerance = None):
+    """Planned FORCs that a (partial) run did not complete
+
+    Every complete curve of the dataset (END comment found) is matched to the planned FORC with the
+    nearest reversal field. A FORC is done when it has N_repeat complete curves within tolerance.
+
+    Args:
+        dataset (FORCDataset): the measured curves.
+        plan (FORCPlan): the planned FORCs.
+        N_repeat (int): complete curves needed per FORC. Defaults to 1.
+        tolerance (float): max distance in Oe between the measured and planned Ha. Defaults to None
+            (half the smallest planned Ha spacing).
+
+    Returns:
+        np.ndarray: bool per planned FORC, True if it still has to be measured
+    """
+    planned = plan.Ha
+    if len(planned) == 0:
+        return np.zeros(0, dtype=bool)
+    if tolerance is None:
+        spacing = np.abs(np.diff(np.sort(planned)))
+        spacing = spacing[spacing > 0]
+        tolerance = spacing.min()/2 if len(spacing) else 0.5
+    measured = dataset.Ha[dataset.complete & np.isfinite(dataset.Ha)]*10**4
+    
+    # Nearest planned Ha of every measured curve
+    order = np.argsort(planned)
+    position = np.clip(np.searchsorted(planned[order], measured), 1, max(len(planned) - 1, 1))
+    left, right = order[position - 1], order[np.minimum(position, len(planned) - 1)]
+    nearest = np.where(np.abs(planned[left] - measured) <= np.abs(planned[right] - measured), left, right)
+    matched = np.abs(planned[nearest] - measured) <= tolerance
+    done = np.bincount(nearest[matched], minlength=len(planned)) >= N_repeat
+    return ~done
+
+def seqns_resume_FORC_measurements(path_partial_data_file, seq_file_path_n_name = str, data_file_path = str, data_file_name = None,\
+    tolerance = None, **kwargs):
+    """Generates a seqns file measuring only the FORCs a partial run did not complete, into a new data file
+
+    The planned FORCs are the ones seqns_FORC_measurements_V1 generates for the same arguments (or plan).
+    Convert the original and the resumed data files together (convert_DAT_file with both paths, or batch
+    on their dir) to merge them into one dataset ordered by reversal field.
+
+    Args:
+        path_partial_data_file (str): .DAT file of the aborted run (or a list of its parts).
+        seq_file_path_n_name (str): path/name of the resumed seqns file.
+        data_file_path (str): data file path on the instrument.
+        data_file_name (str): name of the resumed data file. Defaults to None (the partial file name + _resume).
+        tolerance (float): max distance in Oe between measured and planned Ha, see find_missing_FORCs. Defaults to None.
+        **kwargs: arguments of seqns_FORC_measurements_V1 of the original run (set_temp, H_sat, N_FORCs, plan, N_repeat, ...).
+
+    Returns:
+        FORCPlan: the FORCs of the resumed sequence
+    """
+    plan = kwargs.pop('plan', None)
+    if plan is None:
+        plan = uniform_FORC_plan(**{name: kwargs[name] for name in ('max_field', 'max_reversal_field', 'min_reversal_field', 'N_FORCs', 'step_size')\
+            if name in kwargs})
+    first_path = path_partial_data_file if isinstance(path_partial_data_file, (str, os.PathLike)) else path_partial_data_file[0]
+    if data_file_name is None:
+        # The instrument writes the resumed run uncompressed
+        stem = DAT_file_stem(first_path)
+        match = DAT_PART_PATTERN.match(stem)
+        data_file_name = (match['stem'] if match else stem) + '_resume' + Path(strip_compression_suffix(first_path)).suffix
+    if isinstance(path_partial_data_file, (str, os.PathLike)):
+        dataset = load_FORC_dataset(path_partial_data_file, use_cache = False)
+    else:
+        dataset = load_FORC_dataset_parts(path_partial_data_file, n_workers = 1, use_cache = False)
+    missing = find_missing_FORCs(dataset, plan, N_repeat = kwargs.get('N_repeat', 1), tolerance = tolerance)
+    resumed_plan = plan.subset(missing)
+    print(f"{plan.n_FORCs - resumed_plan.n_FORCs} of {plan.n_FORCs} FORCs are complete, resuming {resumed_plan.n_FORCs}")
+    
+    seqns_FORC_measurements_V1(seq_file_path_n_name = seq_file_path_n_name, data_file_path = data_file_path, data_file_name = data_file_name,\
+        plan = resumed_plan, **kwargs)
+    return resumed_plan
+
+# Columns of the synthetic .DAT files, in the order of a VersaLab VSM export
+SYNTHETIC_DAT_COLUMNS = (DAT_COMMENT_COLUMN, DAT_TIME_COLUMN, DAT_TEMP_COLUMN, DAT_FIELD_COLUMN, DAT_MOMENT_COLUMN, 'M. Std. Err. (emu)',\
+    'Transport Action', DAT_AVGING_TIME_COLUMN, 'Frequency (Hz)', 'Peak Amplitude (mm)')
+
+def preisach_FORC_moment(Ha, Hb, alpha, beta, Ms = 1e-3, chi = 0.0):
+    """Moment of a Preisach model on the FORC reversing at Ha, at the fields Hb
+
+    From positive saturation the hysterons with beta >= Ha switch down at Ha, and the ones with
+    alpha <= Hb switch back up on the way to Hb.
+
+    Args:
+        Ha (float): reversal field in Oe.
+        Hb (np.ndarray): fields of the branch in Oe.
+        alpha (np.ndarray): up switching field of every hysteron in Oe.
+        beta (np.ndarray): down switching field of every hysteron in Oe.
+        Ms (float): saturation moment in emu. Defaults to 1e-3 emu.
+        chi (float): reversible susceptibility in emu/Oe. Defaults to 0.
+
+    Returns:
+        np.ndarray: moment in emu at every Hb
+    """
+    Hb = np.asarray(Hb, dtype=float)
+    alpha_down = np.sort(alpha[beta >= Ha])
+    still_down = len(alpha_down) - np.searchsorted(alpha_down, Hb, side='right')
+    return Ms*(1 - 2*still_down/len(alpha)) + chi*Hb
+
+def write_synthetic_DAT_file(path_data_file, N_FORCs = 200, H_sat = 1000, max_field = 300, max_reversal_field = 100, min_reversal_field = -300,\
+    step_size = 0.5, avging_time = 1, temperature = 300, plan = None, Ms = 1e-3, Hc = 80, Hc_spread = 0.4, Hu_spread = 30, chi = 1e-8,\
+    noise = 1e-7, N_hysterons = 20000, seed = 0):
+    """Writes a VersaLab .DAT file of the FORC measurement seqns_FORC_measurements_V1 would run, for benchmarks and tests
+
+    The curves come from a Preisach model with log-normal coercive fields around Hc and normal interaction
+    fields, plus a reversible part and Gaussian noise. Every FORC has a saturation point at H_sat, the
+    START_DATA_FORC comment, the sweep from Ha to the end of the sweep and the END_DATA_FORC comment,
+    upper case like the instrument exports them, below the 30 header lines of a VersaLab export.
+
+    Args:
+        path_data_file (str): path of the .DAT file to write.
+        N_FORCs (int, optional): Defaults to 200.
+        H_sat (int, optional): Defaults to 1000 Oe.
+        max_field (int, optional): end of the sweeps in Oe. Defaults to 300 Oe.
+        max_reversal_field (int, optional): Defaults to 100 Oe.
+        min_reversal_field (int, optional): Defaults to -300 Oe.
+        step_size (float, optional): Defaults to 0.5 Oe.
+        avging_time (int, optional): Defaults to 1 sec.
+        temperature (float, optional): Defaults to 300 K.
+        plan (FORCPlan, optional): planned FORCs replacing the uniform grid. Defaults to None.
+        Ms (float, optional): saturation moment. Defaults to 1e-3 emu.
+        Hc (float, optional): median coercive field of the hysterons. Defaults to 80 Oe.
+        Hc_spread (float, optional): sigma of log(Hc). Defaults to 0.4.
+        Hu_spread (float, optional): sigma of the interaction fields. Defaults to 30 Oe.
+        chi (float, optional): reversible susceptibility. Defaults to 1e-8 emu/Oe.
+        noise (float, optional): std of the moment noise. Defaults to 1e-7 emu.
+        N_hysterons (int, optional): Defaults to 20000.
+        seed (int, optional): random seed, the same arguments write the same file. Defaults to 0.
+
+    Returns:
+        int: number of rows written below the column names
+    """
+    rng = np.random.default_rng(seed)
+    if plan is None:
+        plan = uniform_FORC_plan(max_field = max_field, max_reversal_field = max_reversal_field, min_reversal_field = min_reversal_field,\
+            N_FORCs = N_FORCs, step_size = step_size)
+    Hc_hysterons = Hc*np.exp(Hc_spread*rng.standard_normal(N_hysterons))
+    Hu_hysterons = Hu_spread*rng.standard_normal(N_hysterons)
+    alpha, beta = Hu_hysterons + Hc_hysterons, Hu_hysterons - Hc_hysterons
+    
+    # Rows of every FORC: saturation point, start comment, sweep, end comment (NaN field)
+    fields, moments, comments = [], [], []
+    for Ha, sweep_stop, step in zip(plan.Ha, plan.sweep_stop, plan.step_size):
+        Hb = np.minimum(Ha + step*np.arange(int(np.ceil(np.round((sweep_stop - Ha)/step, 9))) + 1), sweep_stop)
+        fields += [[H_sat, np.nan], Hb, [np.nan]]
+        moments += [[Ms + chi*H_sat, np.nan], preisach_FORC_moment(Ha, Hb, alpha, beta, Ms = Ms, chi = chi), [np.nan]]
+        comments += [['', FORC_START_MARKER], ['']*len(Hb), [FORC_END_MARKER]]
+    field, moment, comment = np.concatenate(fields), np.concatenate(moments), np.concatenate(comments)
+    is_data = ~np.isnan(field)
+    n_data = np.count_nonzero(is_data)
+    field[is_data] += rng.normal(0, 0.02, n_data)
+    moment[is_data] += rng.normal(0, noise, n_data)
+    
+    # Time stamps advance by the averaging time plus the instrument overhead of every point
+    time_stamp = 3.7e9 + np.cumsum(np.where(is_data, avging_time + 0.3, 0.1))
+    data_values = np.where(is_data, 1.0, np.nan)
+    data = pd.DataFrame({DAT_COMMENT_COLUMN: comment,
+                         DAT_TIME_COLUMN: time_stamp,
+                         DAT_TEMP_COLUMN: data_values*(temperature + rng.normal(0, 0.01, len(field))),
+                         DAT_FIELD_COLUMN: field,
+                         DAT_MOMENT_COLUMN: moment,
+                         'M. Std. Err. (emu)': data_values*noise,
+                         'Transport Action': data_values,
+                         DAT_AVGING_TIME_COLUMN: data_values*avging_time,
+                         'Frequency (Hz)': data_values*39.7,
+                         'Peak Amplitude (mm)': data_values*2}, columns=list(SYNTHETIC_DAT_COLUMNS))
+    # Same 30 lines as a VersaLab export, the column names are the 31st line
+    header_lines = ['[Header]', '; VSM Data File', 'TITLE,Synthetic FORC', 'BYAPP,VSM,1.0.9 Build 41',
+                    'INFO,Preisach model,SAMPLE_MATERIAL', f'INFO,seed {seed},SAMPLE_COMMENT', 'INFO,,SAMPLE_MASS',
+                    'INFO,,SAMPLE_VOLUME', 'INFO,,SAMPLE_MOLECULAR_WEIGHT', 'INFO,,SAMPLE_SIZE', 'INFO,,SAMPLE_SHAPE',
+                    'INFO,Quartz,SAMPLE_HOLDER', 'INFO,35,SAMPLE_HOLDER_OFFSET', 'INFO,,SAMPLE_OFFSET',
+                    'INFO,Standard,SAMPLE_HOLDER_TYPE', 'INFO,VSM,APPNAME', 'INFO,VersaLab,HW_PLATFORM', 'INFO,1.0.9,APP_VERSION',
+                    'INFO,Synthetic,SAMPLE_ID', 'INFO,2,VIB_AMPLITUDE', 'INFO,39.7,VIB_FREQ', 'DATATYPE,COMMENT,1',
+                    'DATATYPE,TIME,2', 'FIELDGROUP,VSM,4,5,6,7,8,9', 'STARTUPAXIS,X,4', 'STARTUPAXIS,Y1,5',
+                    f'FILEOPENTIME,{time_stamp[0]:.2f},01/01/2023,12:00 AM', '; end', '; of header', '[Data]']
+    with open_FORC_file(path_data_file, 'w', newline='') as f:
+        f.write('\n'.join(header_lines) + '\n')
+        data.to_csv(f, index=False, float_format='%.12g', lineterminator='\n')
+    return len(data)
+
 def import_first_n_lines(file_path, n):
     """_summary_
 
@@ -305,7 +1180,7 @@ def import_first_n_lines(file_path, n):
     Returns:
         _type_: _description_
     """
-    with open(file_path, 'r', encoding='cp1252') as f:
+    with open_FORC_file(file_path, 'r', encoding='cp1252') as f:
         lines = []
         for i, line in enumerate(f):
             lines.append(line)
@@ -317,13 +1192,27 @@ def n_row_avg(df, N_rows = int):
     """Averages N_rows of a df and returns a new_df of size df/N_row
 
     Args:
-        df (_type_): _description_
+        df (pd.DataFrame or FORCDataset): data to average. A FORCDataset is averaged curve by curve,
+            see decimate_FORC_dataset for keeping the reversal points.
         N_rows (_type_, optional): _description_. Defaults to int.
 
     Returns:
         _type_: _description_
     """
-    new_df = df.groupby(df.index//N_rows).mean()
+    if isinstance(df, FORCDataset):
+        # Groups of N_rows restart at every curve so curves are never mixed
+        return decimate_FORC_dataset(df, factor = N_rows, method = 'mean', keep_reversal = False)
+    
+    # Reshaping the numeric columns to (n_groups, N_rows) blocks padded with NaN
+    numeric = df.select_dtypes(include='number')
+    values = numeric.to_numpy(dtype=np.float64)
+    n_groups = -(-len(values)//N_rows)
+    blocks = np.full((n_groups*N_rows, values.shape[1]), np.nan)
+    blocks[:len(values)] = values
+    blocks = blocks.reshape(n_groups, N_rows, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new_values = np.nansum(blocks, axis=1)/np.count_nonzero(~np.isnan(blocks), axis=1)
+    new_df = pd.DataFrame(new_values, columns=numeric.columns)
     return new_df
 
 def find_string_index(string_list, string_to_find):
@@ -372,28 +1261,38 @@ def delete_rows_with_number(df, column, number):
     # Delete the rows
     return df[~mask]
 
-def get_files_from_dir(directory, extension):
+def get_files_from_dir(directory, extension, recursive = False, compressed = True):
     """_summary_
 
     Args:
         directory (str): Directory in which to search for files
         extension (str): extensition of files to look for
+        recursive (bool): also search all sub directories. Defaults to False.
+        compressed (bool): also match the compressed files, e.g. .DAT.gz or .DAT.xz for .DAT. Defaults to True.
 
     Returns:
         data_files(list): returns a list containing both file names and full file path
     """
     # Initialize an empty list to store the file names and paths
     dat_files = []
-
-    # Get the list of files in the directory
-    files = os.listdir(directory)
+    extensions = (extension,)
+    if compressed:
+        extensions += tuple(extension + compression for compression in FORC_COMPRESSION_MODULES)
+
+    # Get the list of files in the directory (and sub directories)
+    if recursive:
+        files = []
+        for root, _, root_files in os.walk(directory):
+            files += [os.path.relpath(os.path.join(root, file), directory) for file in sorted(root_files)]
+    else:
+        files = os.listdir(directory)
 
     # Iterate through the list of files
     for file in files:
     # Check if the file is a .extension file
-        if file.endswith(extension):
+        if file.endswith(extensions):
             # Get the file name and path
-            file_name = file
+            file_name = os.path.basename(file)
             file_path = os.path.join(directory, file)
             # Add the file name and path to the list
             dat_files.append((file_name, file_path))
@@ -401,32 +1300,318 @@ def get_files_from_dir(directory, extension):
     # Return the list of file names and paths
     return dat_files
 
-def gen_PMC_FORC_file(path_PMC_header, path_data_file_dir, path_final_PMC_file, avging_time = 0.5):
-    """Generates a PMC .forc file from single .DAT file from VSM  
+class DATMetadata:
+    """Metadata of a VersaLab .DAT file parsed from its [Header] block
+
+    Attributes:
+        path (str): path to the .DAT file.
+        title (str): TITLE entry of the header.
+        info (dict): INFO entries of the header, e.g. info['SAMPLE_MATERIAL'].
+        file_open_time (str): FILEOPENTIME entry of the header.
+        header_lines (int): number of lines up to and including [Data], i.e. the rows to skip.
+        columns (list): names of all data columns.
+        temperature (float): median temperature in K of the first data rows, NaN if unknown.
+        avging_time (float): median averaging time in sec of the first data rows, NaN if unknown.
+    """
+    __slots__ = ('path', 'title', 'info', 'file_open_time', 'header_lines', 'columns', 'temperature', 'avging_time')
+
+    def __init__(self, path = None, title = '', info = None, file_open_time = '', header_lines = 0, columns = None,\
+        temperature = float('nan'), avging_time = float('nan')):
+        self.path = path
+        self.title = title
+        self.info = {} if info is None else info
+        self.file_open_time = file_open_time
+        self.header_lines = header_lines
+        self.columns = [] if columns is None else columns
+        self.temperature = temperature
+        self.avging_time = avging_time
+
+    def __repr__(self):
+        return (f"DATMetadata(path={self.path!r}, title={self.title!r}, temperature={self.temperature}, "
+                f"avging_time={self.avging_time}, columns={len(self.columns)})")
+
+def read_DAT_header(path_data_file, n_peek_rows = 500):
+    """Reads the [Header] block of a VersaLab .DAT file and finds the start of the [Data] section
 
     Args:
-        path_PMC_header (str): path to the sample PMC FORC file to steal headers from.
-        path_data_file_dir (str): path to the dir storing the single .DAT data file.
-        path_final_PMC_file (str): path and name of the final file. example: "path/NN9_FORCs_PMC_try_6_1.forc"
+        path_data_file (str): path to the .DAT file.
+        n_peek_rows (int): number of data rows used to estimate temperature and averaging time. Defaults to 500.
+
+    Returns:
+        DATMetadata: metadata of the file
     """
-    # Getting all files from the dir
-    path_data_file = get_files_from_dir(path_data_file_dir, ".DAT")[0][1]
-    
-    # Importing data
-    data = pd.read_csv(path_data_file, skiprows=30)
-    
-    # Calculating number of data points
-    num_data_points = len(data) - data['Magnetic Field (Oe)'].isna().sum()
-    
-    # Select the column you want to count the string in
-    column = data['Comment']
+    metadata = DATMetadata(path = str(path_data_file))
+    with FORC_stage('read_header', path_data_file) as stage, open_FORC_file(path_data_file, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        # Header entries are comma separated "KEY,value,..." lines
+        for line in f:
+            metadata.header_lines += 1
+            if line.strip() == '[Data]':
+                break
+            entries = next(csv.reader([line]), [])
+            if len(entries) < 2:
+                continue
+            if entries[0] == 'TITLE':
+                metadata.title = entries[1]
+            elif entries[0] == 'INFO' and len(entries) >= 3:
+                metadata.info[entries[2]] = entries[1]
+            elif entries[0] == 'FILEOPENTIME':
+                metadata.file_open_time = ' '.join(entries[1:])
+        else:
+            raise ValueError(f"No [Data] section found in {path_data_file}")
+        
+        # Column names and a peek at the first rows for temperature and averaging time
+        reader = csv.reader(f)
+        metadata.columns = next(reader, [])
+        peek = {DAT_TEMP_COLUMN: [], DAT_AVGING_TIME_COLUMN: []}
+        index = {name: metadata.columns.index(name) for name in peek if name in metadata.columns}
+        for i, row in enumerate(reader):
+            if i == n_peek_rows:
+                break
+            for name, col in index.items():
+                if col < len(row) and row[col].strip():
+                    peek[name].append(float(row[col]))
+        stage.rows = metadata.header_lines
+    if peek[DAT_TEMP_COLUMN]:
+        metadata.temperature = float(np.median(peek[DAT_TEMP_COLUMN]))
+    if peek[DAT_AVGING_TIME_COLUMN]:
+        metadata.avging_time = float(np.median(peek[DAT_AVGING_TIME_COLUMN]))
+    return metadata
+
+def DAT_csv_engine(engine = 'auto'):
+    """Picks the pd.read_csv engine used for .DAT files
+
+    Args:
+        engine (str): 'auto', 'pyarrow', 'c' or 'python'. 'auto' uses pyarrow when installed, else c. Defaults to 'auto'.
+
+    Returns:
+        str: engine name
+    """
+    if engine == 'auto':
+        return 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+    return engine
+
+def read_DAT_file(path_data_file, columns = DAT_COLUMNS, dtype = None, engine = 'auto', chunk_size = None, metadata = None):
+    """Reads the requested columns of a VersaLab .DAT file with explicit dtypes
 
-    # Select the string you want to count
-    string = 'START_DATA_FORC'
+    Args:
+        path_data_file (str): path to the .DAT file.
+        columns (list): columns to read. Defaults to Comment, Magnetic Field (Oe) and Moment (emu).
+        dtype (dict): dtype per column. Defaults to str for Comment and float64 for everything else.
+        engine (str): pd.read_csv engine, see DAT_csv_engine. Defaults to 'auto'.
+        chunk_size (int): if given, returns an iterator of DataFrames with chunk_size rows (c engine). Defaults to None.
+        metadata (DATMetadata): already parsed header, read from the file if None. Defaults to None.
 
-    # Count the number of times the string appears in the column
-    num_FORCs = column.str.count(string).sum()
+    Returns:
+        data (pd.DataFrame or iterator): the requested columns
+        metadata (DATMetadata): metadata of the file
+    """
+    if metadata is None:
+        metadata = read_DAT_header(path_data_file)
+    columns = list(columns)
+    missing = [name for name in columns if name not in metadata.columns]
+    if missing:
+        raise KeyError(f"Columns {missing} not found in {path_data_file}")
+    if dtype is None:
+        dtype = {name: (str if name == DAT_COMMENT_COLUMN else 'float64') for name in columns}
     
+    # pyarrow does not read in chunks
+    engine = DAT_csv_engine(engine)
+    if chunk_size is not None and engine == 'pyarrow':
+        engine = 'c'
+    if chunk_size is not None:
+        return pd.read_csv(path_data_file, skiprows=metadata.header_lines, usecols=columns, dtype=dtype, engine=engine, chunksize=chunk_size), metadata
+    with FORC_stage('read_csv', path_data_file, bytes_read = _file_size(path_data_file)) as stage:
+        # Keeping the column order of the request
+        data = pd.read_csv(path_data_file, skiprows=metadata.header_lines, usecols=columns, dtype=dtype, engine=engine)[columns]
+        stage.rows = len(data)
+    return data, metadata
+
+def read_DAT_FORC_columns(path_data_file, dtype = None, engine = 'auto'):
+    """Reads the columns a FORCDataset is built from, the Time Stamp column only if the file has one
+
+    Args:
+        path_data_file (str): path to the .DAT file.
+        dtype (dict): dtype per column, see read_DAT_file. Defaults to None.
+        engine (str): pd.read_csv engine, see DAT_csv_engine. Defaults to 'auto'.
+
+    Returns:
+        data (pd.DataFrame): the columns
+        metadata (DATMetadata): metadata of the file
+    """
+    metadata = read_DAT_header(path_data_file)
+    columns = DAT_COLUMNS + ((DAT_TIME_COLUMN,) if DAT_TIME_COLUMN in metadata.columns else ())
+    return read_DAT_file(path_data_file, columns = columns, dtype = dtype, engine = engine, metadata = metadata)
+
+def locate_rows(starts, stops, rows):
+    """Finds the range starts[k]:stops[k] (sorted, non-overlapping) holding each row
+
+    Args:
+        starts (np.ndarray): first row of each range.
+        stops (np.ndarray): end row (exclusive) of each range.
+        rows (np.ndarray): row offsets to locate.
+
+    Returns:
+        np.ndarray: range number k per row, -1 for rows outside all ranges
+    """
+    k = np.searchsorted(starts, rows, side='right') - 1
+    inside = k >= 0
+    inside[inside] = rows[inside] < stops[k[inside]]
+    return np.where(inside, k, -1)
+
+# Comment markers written by seqns_FORC_measurements_V1 around each measured branch
+FORC_START_MARKER = 'START_DATA_FORC'
+FORC_END_MARKER = 'END_DATA_FORC'
+# Label of repeated FORCs in the START comment, e.g. start_data_FORC_012_repeat_3
+FORC_REPEAT_PATTERN = r'FORC_(?P<FORC>\d+)_REPEAT_(?P<repeat>\d+)'
+
+class FORCSegmentIndex:
+    """Row offsets of every FORC in a parsed .DAT file, built from the start_data_FORC/end_data_FORC comments
+
+    For FORC k the saturation point(s) are rows sat_start[k]:sat_stop[k], the START comment is row
+    start_marker[k] and the measured branch is rows branch_start[k]:branch_stop[k] (branch_stop is the
+    END comment row). A FORC without END comment (aborted run) runs up to the next START comment or the
+    end of the file and has complete[k] = False.
+
+    Attributes:
+        n_rows (int): number of rows in the parsed data.
+        sat_start, sat_stop, start_marker, branch_start, branch_stop (np.ndarray): int64 row offsets per FORC.
+        complete (np.ndarray): bool per FORC, True if the END comment was found.
+        Ha (np.ndarray): reversal field in Oe (first point of the branch) per FORC, NaN if unknown.
+        n_points (int): number of data points (rows with a field value).
+    """
+    __slots__ = ('n_rows', 'sat_start', 'sat_stop', 'start_marker', 'branch_start', 'branch_stop', 'complete', 'Ha', 'n_points')
+
+    def __init__(self, start_rows, end_rows, n_rows, field = None, n_points = None):
+        start_rows = np.asarray(start_rows, dtype=np.int64)
+        end_rows = np.asarray(end_rows, dtype=np.int64)
+        self.n_rows = int(n_rows)
+        
+        # Pairing every START with the first END before the next START
+        next_start = np.append(start_rows[1:], self.n_rows)
+        idx_end = np.searchsorted(end_rows, start_rows)
+        candidate = end_rows[np.minimum(idx_end, len(end_rows) - 1)] if len(end_rows) else np.full(len(start_rows), self.n_rows)
+        self.complete = (idx_end < len(end_rows)) & (candidate < next_start)
+        self.start_marker = start_rows
+        self.branch_start = start_rows + 1
+        self.branch_stop = np.where(self.complete, candidate, next_start)
+        
+        # Saturation points sit between the previous END (or START if it has none) and the START
+        previous_stop = np.concatenate(([-1], self.branch_stop[:-1])) + 1
+        self.sat_start = np.minimum(previous_stop, start_rows)
+        self.sat_stop = start_rows
+        
+        self.Ha = np.full(len(start_rows), np.nan)
+        if field is not None:
+            field = np.asarray(field, dtype=np.float64)
+            has_point = self.branch_start < self.branch_stop
+            self.Ha[has_point] = field[self.branch_start[has_point]]
+            if n_points is None:
+                n_points = np.count_nonzero(~np.isnan(field))
+        self.n_points = 0 if n_points is None else int(n_points)
+
+    def __len__(self):
+        return len(self.start_marker)
+
+    def __repr__(self):
+        return f"FORCSegmentIndex(n_FORCs={self.n_FORCs}, n_segments={self.n_segments}, n_points={self.n_points}, n_rows={self.n_rows})"
+
+    @property
+    def n_FORCs(self):
+        """Number of FORCs (START comments)"""
+        return len(self.start_marker)
+
+    @property
+    def n_segments(self):
+        """Number of segments in the PMC sense: a saturation point and a branch per FORC"""
+        return 2*len(self.start_marker)
+
+    def curve(self, k):
+        """Row slice of the measured branch of FORC k, e.g. field[index.curve(k)] is a zero-copy view"""
+        return slice(int(self.branch_start[k]), int(self.branch_stop[k]))
+
+    def sat(self, k):
+        """Row slice of the saturation point(s) measured before FORC k"""
+        return slice(int(self.sat_start[k]), int(self.sat_stop[k]))
+
+    def in_branch(self, rows):
+        """Bool mask of the rows (np.ndarray of row offsets) that lie inside a measured branch"""
+        return locate_rows(self.branch_start, self.branch_stop, rows) >= 0
+
+    def is_start_marker(self, rows):
+        """Bool mask of the rows (np.ndarray of row offsets) that are START comments"""
+        k = np.searchsorted(self.start_marker, rows)
+        found = k < len(self.start_marker)
+        found[found] = self.start_marker[k[found]] == rows[found]
+        return found
+
+    def generic_mask(self, n_rows, first_row = 0):
+        """Rows kept in the generic FORCinel/doFORC files: everything but the START comments. The rows at
+        the saturating field are dropped by their field value, see drop_saturating_field
+
+        Args:
+            n_rows (int): number of rows.
+            first_row (int): offset of the first row in the file, for chunked data. Defaults to 0.
+
+        Returns:
+            np.ndarray: bool mask
+        """
+        return ~self.is_start_marker(np.arange(first_row, first_row + n_rows, dtype=np.int64))
+
+def find_marker_rows(comments, marker):
+    """Row offsets of the comments containing marker (case insensitive, the seqns write lower case)
+
+    Args:
+        comments (pd.Series): Comment column.
+        marker (str): e.g. FORC_START_MARKER.
+
+    Returns:
+        np.ndarray: int64 row offsets
+    """
+    found = comments.fillna('').astype(str).str.upper().str.contains(marker, regex=False).to_numpy(dtype=bool)
+    return np.flatnonzero(found).astype(np.int64)
+
+def find_FORC_repeat_labels(comments, start_rows):
+    """FORC and repeat numbers of repeated FORCs from their START comments
+
+    Args:
+        comments (pd.Series): Comment column.
+        start_rows (np.ndarray): row offsets of the START comments, e.g. FORCSegmentIndex.start_marker.
+
+    Returns:
+        FORC_number, repeat (np.ndarray): int64 per FORC, 0 for FORCs without label
+    """
+    labels = comments.iloc[start_rows].fillna('').astype(str).str.upper().str.extract(FORC_REPEAT_PATTERN)
+    FORC_number = pd.to_numeric(labels['FORC']).fillna(0).to_numpy(dtype=np.int64)
+    repeat = pd.to_numeric(labels['repeat']).fillna(0).to_numpy(dtype=np.int64)
+    return FORC_number, repeat
+
+def build_FORC_segment_index(data):
+    """Builds the FORCSegmentIndex of a parsed .DAT file
+
+    Args:
+        data (pd.DataFrame): data with Comment and Magnetic Field (Oe) columns from read_DAT_file.
+
+    Returns:
+        FORCSegmentIndex: row offsets of every FORC
+    """
+    comments = data[DAT_COMMENT_COLUMN]
+    return FORCSegmentIndex(find_marker_rows(comments, FORC_START_MARKER), find_marker_rows(comments, FORC_END_MARKER),\
+        len(data), field = data[DAT_FIELD_COLUMN].to_numpy())
+
+def gen_PMC_header_lines(path_PMC_header, num_FORCs, num_data_points, avging_time = 0.5, count_width = 0):
+    """Imports the header of a sample PMC file and replaces the dataset specific lines
+
+    Args:
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from.
+        num_FORCs (int): number of FORCs in the dataset.
+        num_data_points (int): number of data points in the dataset.
+        avging_time (float): Avging time for measurement. Defaults to 0.5 sec.
+        count_width (int): pads the counts with spaces to this width so the header length does not change
+            when the counts are rewritten in place. Defaults to 0 (no padding).
+
+    Returns:
+        header_lines (list): header lines of the PMC file
+    """
     # Importing the header lines to use for PMC files
     header_lines = import_first_n_lines(path_PMC_header, 86)
     
@@ -443,10 +1628,10 @@ def gen_PMC_FORC_file(path_PMC_header, path_data_file_dir, path_final_PMC_file,
     # index_Num_Data_Points = find_substring_index(header_lines, 'Number of data')
     
     # Replacing the real NForcs and Nsegments in the line
-    list_rplace_lines = [f'NForc                           {int(num_FORCs)}\n', 
-                         f'Number of segments              {int(num_FORCs*2)}\n',
+    list_rplace_lines = [f'NForc                           {int(num_FORCs):<{count_width}}\n', 
+                         f'Number of segments              {int(num_FORCs*2):<{count_width}}\n',
                          f'Averaging time                 +{int(avging_time*10)}00.0000E-03\n',
-                         f'Number of data                  {int(num_data_points)}\n']
+                         f'Number of data                  {int(num_data_points):<{count_width}}\n']
     
     for idx, _ in enumerate(list_rplace_header_lines):
         header_lines[index_header_replace[idx]] = list_rplace_lines[idx]
@@ -455,122 +1640,1841 @@ def gen_PMC_FORC_file(path_PMC_header, path_data_file_dir, path_final_PMC_file,
     # header_lines[index_NSegments_PMC] = f'Number of segments              {int(num_FORCs*2)}\n'
     # header_lines[index_Avging_time_PMC] = f'Averaging time                 +{int(avging_time*10)}00.0000E-03\n'
     # header_lines[index_Num_Data_Points] = f'Number of data                  {int(num_data_points)}\n'
+
+    return header_lines
+
+def format_FORC_data_line(field, moment):
+    """Formats one Field/Moment row the same way as the to_csv export of the converters
+
+    Args:
+        field (float): field in T. NaN gives an empty entry.
+        moment (float): moment in Am^2. NaN gives an empty entry.
+
+    Returns:
+        str: "field,moment" line without line terminator, empty for comment rows
+    """
+    entries = ['%.15f' % value for value in (field, moment) if value == value]
+    return ','.join(entries)
+
+def format_FORC_data_block(field, moment):
+    """Formats Field/Moment arrays into lines in one %-formatting call per run of finite rows
+
+    Args:
+        field (np.ndarray): field in T. Rows where field and moment are NaN give empty lines.
+        moment (np.ndarray): moment in Am^2.
+
+    Returns:
+        str: one '\\n' terminated line per row
+    """
+    field = np.asarray(field, dtype=np.float64)
+    moment = np.asarray(moment, dtype=np.float64)
+    values = np.column_stack((field, moment)).ravel().tolist()
+    special = np.flatnonzero(np.isnan(field) | np.isnan(moment)).tolist()
+    
+    pieces = []
+    start = 0
+    for idx in special + [len(field)]:
+        if idx > start:
+            pieces.append(('%.15f,%.15f\n'*(idx - start)) % tuple(values[2*start:2*idx]))
+        if idx < len(field):
+            pieces.append(format_FORC_data_line(values[2*idx], values[2*idx + 1]) + '\n')
+        start = idx + 1
+    return ''.join(pieces)
+
+class FORCDataWriter:
+    """Writes two-column Field/Moment blocks from arrays to an open text file in large chunks
+
+    Lines are separated by '\\n', NaN rows become the blank segment separators and the end_lines
+    (e.g. 'END' or the PMC trailer) close the file, so no trailing newline has to be removed afterwards.
+
+    Args:
+        f (file): file opened for writing in text mode.
+        end_lines (list): trailer lines written by close(). Defaults to no trailer.
+        chunk_rows (int): number of rows formatted at once. Defaults to 65536.
+    """
+    def __init__(self, f, end_lines = (), chunk_rows = 65536):
+        self.f = f
+        self.end_lines = list(end_lines)
+        self.chunk_rows = chunk_rows
+        self.n_lines = 0
+        
+    def write(self, field, moment):
+        """Appends the rows of the field/moment arrays"""
+        for start in range(0, len(field), self.chunk_rows):
+            text = format_FORC_data_block(field[start:start + self.chunk_rows], moment[start:start + self.chunk_rows])
+            # The newline of the last line is only written when more lines follow
+            if self.n_lines:
+                self.f.write('\n')
+            self.f.write(text[:-1])
+            self.n_lines += text.count('\n')
+    
+    def close(self):
+        """Writes the end_lines"""
+        if self.end_lines:
+            if self.n_lines:
+                self.f.write('\n')
+            self.f.write('\n'.join(self.end_lines))
+        self.end_lines = []
+
+def write_FORC_data(f, field, moment, end_lines = (), chunk_rows = 65536):
+    """Writes Field/Moment arrays and the end_lines to an open text file, see FORCDataWriter
+
+    Args:
+        f (file): file opened for writing in text mode.
+        field (np.ndarray): field in T.
+        moment (np.ndarray): moment in Am^2.
+        end_lines (list): trailer lines. Defaults to no trailer.
+        chunk_rows (int): number of rows formatted at once. Defaults to 65536.
+    """
+    writer = FORCDataWriter(f, end_lines, chunk_rows)
+    writer.write(field, moment)
+    writer.close()
+
+class FORCDataset:
+    """Compact ragged-array FORC dataset: contiguous field/moment arrays plus int offsets per curve
+
+    The measured branch of curve k is field[offsets[k]:offsets[k+1]] and the saturation point(s)
+    measured before it are sat_field[sat_offsets[k]:sat_offsets[k+1]]. Fields are in T and moments
+    in Am^2 like in the exported files, the metadata is in the units of the sequence generator.
+
+    Attributes:
+        field, moment (np.ndarray): float64 (or float32) branch points of all curves.
+        offsets (np.ndarray): int64, n_curves + 1 offsets into field/moment.
+        sat_field, sat_moment (np.ndarray): saturation points of all curves.
+        sat_offsets (np.ndarray): int64, n_curves + 1 offsets into sat_field/sat_moment.
+        complete (np.ndarray): bool per curve, False for curves without end_data_FORC comment.
+        FORC_number, repeat (np.ndarray): int64 per curve, FORC and repeat number of repeated FORCs, 0 if not labelled.
+        time, sat_time (np.ndarray): float64 time stamp in sec of every branch and saturation point, NaN if unknown.
+        temperature (float): temperature in K.
+        avging_time (float): averaging time in sec.
+        H_sat (float): saturating field in Oe.
+        step_size (float): field step in Oe.
+        name (str): name of the dataset, e.g. the .DAT file stem.
+    """
+    __slots__ = ('field', 'moment', 'offsets', 'sat_field', 'sat_moment', 'sat_offsets', 'complete', 'FORC_number', 'repeat',\
+        'time', 'sat_time', 'temperature', 'avging_time', 'H_sat', 'step_size', 'name')
+
+    def __init__(self, field, moment, offsets, sat_field = None, sat_moment = None, sat_offsets = None, complete = None,\
+        FORC_number = None, repeat = None, time = None, sat_time = None, temperature = float('nan'), avging_time = float('nan'),\
+        H_sat = float('nan'), step_size = float('nan'), name = ''):
+        self.field = np.ascontiguousarray(field)
+        self.moment = np.ascontiguousarray(moment, dtype=self.field.dtype)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        n_curves = len(self.offsets) - 1
+        if sat_field is None:
+            sat_field, sat_moment, sat_offsets = np.empty(0, self.field.dtype), np.empty(0, self.field.dtype), np.zeros(n_curves + 1, np.int64)
+        self.sat_field = np.ascontiguousarray(sat_field, dtype=self.field.dtype)
+        self.sat_moment = np.ascontiguousarray(sat_moment, dtype=self.field.dtype)
+        self.sat_offsets = np.asarray(sat_offsets, dtype=np.int64)
+        self.complete = np.ones(n_curves, dtype=bool) if complete is None else np.asarray(complete, dtype=bool)
+        self.FORC_number = np.zeros(n_curves, dtype=np.int64) if FORC_number is None else np.asarray(FORC_number, dtype=np.int64)
+        self.repeat = np.zeros(n_curves, dtype=np.int64) if repeat is None else np.asarray(repeat, dtype=np.int64)
+        self.time = np.full(len(self.field), np.nan) if time is None else np.asarray(time, dtype=np.float64)
+        self.sat_time = np.full(len(self.sat_field), np.nan) if sat_time is None else np.asarray(sat_time, dtype=np.float64)
+        self.temperature = temperature
+        self.avging_time = avging_time
+        self.H_sat = H_sat
+        self.step_size = step_size
+        self.name = name
+
+    @classmethod
+    def from_DAT_data(cls, data, index = None, metadata = None, dtype = 'float64', name = ''):
+        """Builds the dataset from the columns read by read_DAT_file
+
+        Args:
+            data (pd.DataFrame): data with Comment, Magnetic Field (Oe) and Moment (emu) columns.
+            index (FORCSegmentIndex): segment index of data, built if None. Defaults to None.
+            metadata (DATMetadata): metadata for temperature and averaging time. Defaults to None.
+            dtype (np.dtype): np.float64 or np.float32. Defaults to float64.
+            name (str): name of the dataset. Defaults to ''.
+
+        Returns:
+            FORCDataset: the dataset
+        """
+        with FORC_stage('segment_FORCs', metadata.path if metadata is not None else None, rows = len(data)):
+            return cls._from_DAT_data(data, index, metadata, dtype, name)
+
+    @classmethod
+    def _from_DAT_data(cls, data, index, metadata, dtype, name):
+        if index is None:
+            index = build_FORC_segment_index(data)
+        field_Oe = data[DAT_FIELD_COLUMN].to_numpy(dtype=np.float64)
+        moment_emu = data[DAT_MOMENT_COLUMN].to_numpy(dtype=np.float64)
+        rows = np.flatnonzero(~np.isnan(field_Oe))
+        
+        # Branch and saturation rows with the curve they belong to
+        curve_of_row = locate_rows(index.branch_start, index.branch_stop, rows)
+        sat_of_row = locate_rows(index.sat_start, index.sat_stop, rows)
+        branch_rows, branch_curve = rows[curve_of_row >= 0], curve_of_row[curve_of_row >= 0]
+        sat_rows, sat_curve = rows[sat_of_row >= 0], sat_of_row[sat_of_row >= 0]
+        n_curves = index.n_FORCs
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(branch_curve, minlength=n_curves))))
+        sat_offsets = np.concatenate(([0], np.cumsum(np.bincount(sat_curve, minlength=n_curves))))
+        
+        # Changing to SI units
+        dataset = cls((field_Oe[branch_rows]*10**-4).astype(dtype), (moment_emu[branch_rows]*10**-3).astype(dtype), offsets,\
+            (field_Oe[sat_rows]*10**-4).astype(dtype), (moment_emu[sat_rows]*10**-3).astype(dtype), sat_offsets,\
+            complete = index.complete, name = name)
+        dataset.FORC_number, dataset.repeat = find_FORC_repeat_labels(data[DAT_COMMENT_COLUMN], index.start_marker)
+        if DAT_TIME_COLUMN in data:
+            time_stamp = data[DAT_TIME_COLUMN].to_numpy(dtype=np.float64)
+            dataset.time, dataset.sat_time = time_stamp[branch_rows], time_stamp[sat_rows]
+        if len(sat_rows):
+            dataset.H_sat = float(np.median(field_Oe[sat_rows]))
+        if len(branch_rows) > 1:
+            steps = np.diff(field_Oe[branch_rows])[np.diff(branch_curve) == 0]
+            dataset.step_size = float(np.median(steps)) if len(steps) else float('nan')
+        if metadata is not None:
+            dataset.temperature = metadata.temperature
+            dataset.avging_time = metadata.avging_time
+        return dataset
+
+    @classmethod
+    def from_DAT_file(cls, path_data_file, dtype = 'float64'):
+        """Reads a .DAT file from VSM into a dataset
+
+        Args:
+            path_data_file (str): path to the .DAT data file.
+            dtype (np.dtype): np.float64 or np.float32. Defaults to float64.
+
+        Returns:
+            FORCDataset: the dataset
+        """
+        data, metadata = read_DAT_FORC_columns(path_data_file)
+        return cls.from_DAT_data(data, metadata = metadata, dtype = dtype, name = DAT_file_stem(path_data_file))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return (f"FORCDataset(name={self.name!r}, n_curves={len(self)}, n_points={self.n_points}, "
+                f"temperature={self.temperature}, H_sat={self.H_sat}, step_size={self.step_size})")
+
+    @property
+    def n_curves(self):
+        """Number of FORCs"""
+        return len(self.offsets) - 1
+
+    @property
+    def n_points(self):
+        """Number of data points including the saturation points"""
+        return len(self.field) + len(self.sat_field)
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays in bytes"""
+        return sum(getattr(self, name).nbytes for name in FORC_CACHE_ARRAYS)
+
+    @property
+    def Ha(self):
+        """Reversal field in T of each curve (first branch point), NaN for empty curves"""
+        Ha = np.full(len(self), np.nan)
+        has_point = self.offsets[1:] > self.offsets[:-1]
+        Ha[has_point] = self.field[self.offsets[:-1][has_point]]
+        return Ha
+
+    @property
+    def curve_lengths(self):
+        """Number of branch points of each curve"""
+        return np.diff(self.offsets)
+
+    def curve(self, k):
+        """Zero-copy field and moment views of the branch of curve k"""
+        return self.field[self.offsets[k]:self.offsets[k + 1]], self.moment[self.offsets[k]:self.offsets[k + 1]]
+
+    def sat(self, k):
+        """Zero-copy field and moment views of the saturation point(s) before curve k"""
+        return self.sat_field[self.sat_offsets[k]:self.sat_offsets[k + 1]], self.sat_moment[self.sat_offsets[k]:self.sat_offsets[k + 1]]
+
+    def curve_number(self):
+        """Curve number (0 based) of every branch point"""
+        return np.repeat(np.arange(len(self)), self.curve_lengths)
+
+    def copy_with(self, **arrays):
+        """New dataset with the same metadata and some arrays replaced, e.g. copy_with(moment=new_moment)"""
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(arrays)
+        return FORCDataset(**values)
+
+def filter_FORC_dataset(dataset, keep):
+    """Keeps the branch points where keep is True, curve boundaries are updated
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        keep (np.ndarray): bool per branch point.
+
+    Returns:
+        FORCDataset: filtered dataset
+    """
+    keep = np.asarray(keep, dtype=bool)
+    counts = np.bincount(dataset.curve_number()[keep], minlength=len(dataset))
+    return dataset.copy_with(field=dataset.field[keep], moment=dataset.moment[keep], time=dataset.time[keep], offsets=np.concatenate(([0], np.cumsum(counts))))
+
+def drop_saturating_field(dataset, saturating_field = 500):
+    """Drops the branch and saturation points at saturating_field, the rows the generic FORCinel/doFORC files leave out
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        saturating_field (int): field in Oe, compared after rounding to 1 Oe. Defaults to 500 Oe.
+
+    Returns:
+        FORCDataset: filtered dataset
+    """
+    dataset = filter_FORC_dataset(dataset, ~(np.round(dataset.field*10**4, 0) == saturating_field))
+    keep_sat = ~(np.round(dataset.sat_field*10**4, 0) == saturating_field)
+    n_sat = np.bincount(np.repeat(np.arange(len(dataset)), np.diff(dataset.sat_offsets))[keep_sat], minlength=len(dataset))
+    return dataset.copy_with(sat_field=dataset.sat_field[keep_sat], sat_moment=dataset.sat_moment[keep_sat], sat_time=dataset.sat_time[keep_sat],\
+        sat_offsets=np.concatenate(([0], np.cumsum(n_sat))))
+
+def _grouped_mean(key, field, moment, time, reject_sigma = None):
+    # Mean field, moment and time of the points sharing a key, optionally dropping outliers of the moment once
+    unique_key, inverse = np.unique(key, return_inverse=True)
+    inverse = inverse.ravel()
+    valid = np.isfinite(moment)
+    for rejecting in ((False, True) if reject_sigma is not None else (False,)):
+        weight = valid.astype(np.float64)
+        count = np.bincount(inverse, weights=weight, minlength=len(unique_key))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.bincount(inverse, weights=np.where(valid, moment, 0), minlength=len(unique_key))/count
+            deviation = np.where(valid, moment - mean[inverse], 0)
+            std = np.sqrt(np.bincount(inverse, weights=deviation**2, minlength=len(unique_key))/(count - 1))
+        std[count < 2] = 0
+        if not rejecting and reject_sigma is not None:
+            valid &= ~((count[inverse] >= 3) & (np.abs(deviation) > reject_sigma*std[inverse]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_field = np.bincount(inverse, weights=np.where(valid, field, 0), minlength=len(unique_key))/count
+        mean_time = np.bincount(inverse, weights=np.where(valid, time, 0), minlength=len(unique_key))/count
+    return unique_key, mean_field, mean, mean_time, std
+
+def average_FORC_repeats(dataset, reject_sigma = None, return_std = False):
+    """Averages the repeats of every FORC (same FORC_number) into a single curve
+
+    Points are aligned by their field step from the reversal field of their own curve, so repeats with a
+    slightly different Ha or a missing last point still average point by point. Curves without repeat
+    label are kept as they are.
+
+    Args:
+        dataset (FORCDataset): the dataset with FORC_number/repeat labels from the START comments.
+        reject_sigma (float): drop points further than reject_sigma std from the mean of their field step
+            (with at least 3 repeats) and average again. Defaults to None (no rejection).
+        return_std (bool): also return the std of the moment of every averaged branch point. Defaults to False.
+
+    Returns:
+        FORCDataset: averaged dataset, ordered by FORC number (and the std in Am^2 per branch point if return_std)
+    """
+    labelled = dataset.FORC_number > 0
+    if not labelled.any() or len(np.unique(dataset.FORC_number[labelled])) == np.count_nonzero(labelled):
+        return (dataset, np.zeros(len(dataset.field))) if return_std else dataset
+    
+    # Group of every curve, unlabelled curves get their own group after the labelled ones
+    group_label = np.where(labelled, dataset.FORC_number, dataset.FORC_number.max() + 1 + np.arange(len(dataset)))
+    groups, group_of_curve = np.unique(group_label, return_inverse=True)
+    group_of_curve = group_of_curve.ravel()
+    step = dataset.step_size*10**-4
+    if not np.isfinite(step) or step <= 0:
+        step = float(np.nanmedian(np.abs(np.diff(dataset.field)))) or 1.0
+    
+    # Branch points keyed by (group, field step from Ha)
+    curve = dataset.curve_number()
+    position = np.rint((dataset.field - dataset.Ha[curve])/step).astype(np.int64)
+    position -= min(0, int(position.min(initial=0)))
+    n_positions = int(position.max(initial=0)) + 1
+    key, field, moment, time, std = _grouped_mean(group_of_curve[curve]*n_positions + position, dataset.field, dataset.moment, dataset.time,\
+        reject_sigma)
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(key//n_positions, minlength=len(groups)))))
+    
+    # Saturation points keyed by (group, position in the saturation segment)
+    n_sat = np.diff(dataset.sat_offsets)
+    sat_position = np.arange(len(dataset.sat_field)) - np.repeat(dataset.sat_offsets[:-1], n_sat)
+    n_sat_positions = int(n_sat.max(initial=0)) or 1
+    sat_key, sat_field, sat_moment, sat_time, _ = _grouped_mean(np.repeat(group_of_curve, n_sat)*n_sat_positions + sat_position,\
+        dataset.sat_field, dataset.sat_moment, dataset.sat_time, reject_sigma)
+    sat_offsets = np.concatenate(([0], np.cumsum(np.bincount(sat_key//n_sat_positions, minlength=len(groups)))))
+    
+    complete = np.bincount(group_of_curve, weights=dataset.complete, minlength=len(groups)) > 0
+    averaged = dataset.copy_with(field = field.astype(dataset.field.dtype), moment = moment.astype(dataset.field.dtype), offsets = offsets,\
+        sat_field = sat_field.astype(dataset.field.dtype), sat_moment = sat_moment.astype(dataset.field.dtype), sat_offsets = sat_offsets,\
+        complete = complete, FORC_number = np.where(groups <= dataset.FORC_number.max(), groups, 0), repeat = np.zeros(len(groups), dtype=np.int64),\
+        time = time, sat_time = sat_time)
+    return (averaged, std) if return_std else averaged
+
+def decimate_FORC_dataset(dataset, factor = None, method = 'mean', target_step = None, keep_reversal = True):
+    """Reduces the number of branch points of every curve independently, e.g. for fast previews in FORCinel
+
+    'mean' and 'median' reduce blocks of factor consecutive points of a curve, reshaped to a
+    (n_blocks, factor) array padded with NaN, 'bin' averages the points onto a field grid of target_step
+    Oe starting at the reversal field. The saturation points and the curve labels are kept as they are.
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        factor (int): points per block for 'mean' and 'median'. Defaults to None.
+        method (str): 'mean', 'median' or 'bin'. Defaults to 'mean'.
+        target_step (float): field step in Oe of the 'bin' grid. Defaults to None.
+        keep_reversal (bool): keep the reversal point (first point) of every curve exact and reduce the
+            points after it. Defaults to True.
+
+    Returns:
+        FORCDataset: decimated dataset
+    """
+    if method not in ('mean', 'median', 'bin'):
+        raise ValueError(f"Unknown method '{method}', use 'mean', 'median' or 'bin'")
+    if method == 'bin' and not target_step:
+        raise ValueError("method 'bin' needs a target_step in Oe")
+    if method != 'bin' and not factor:
+        raise ValueError(f"method '{method}' needs a factor")
+    n = len(dataset.field)
+    curve = dataset.curve_number()
+    position = np.arange(n) - dataset.offsets[:-1][curve]
+    
+    # Block of every point, numbered within its curve, the reversal point is block 0 on its own
+    if method == 'bin':
+        block = np.rint((dataset.field - dataset.Ha[curve])/(target_step*10**-4)).astype(np.int64)
+        block = np.maximum(block, 1) if keep_reversal else np.maximum(block, 0)
+        if keep_reversal:
+            block[position == 0] = 0
+        # Field noise at a bin edge must not split a bin, blocks never go back within a curve
+        n_blocks = int(block.max(initial=0)) + 1
+        block = np.maximum.accumulate(curve*n_blocks + block) - curve*n_blocks if n else block
+    elif keep_reversal:
+        block = np.where(position == 0, 0, (position - 1)//factor + 1)
+    else:
+        block = position//factor
+    # Blocks are increasing within a curve, so block starts are where the (curve, block) pair changes
+    new_block = np.ones(n, dtype=bool)
+    new_block[1:] = (curve[1:] != curve[:-1]) | (block[1:] != block[:-1])
+    block_start = np.flatnonzero(new_block)
+    block_id = np.cumsum(new_block) - 1
+    counts = np.diff(np.append(block_start, n))
+    
+    if method == 'median':
+        # Points of every block laid out as a row of a (n_blocks, factor) array padded with NaN
+        column = np.arange(n) - block_start[block_id]
+        reduced = []
+        for values in (dataset.field, dataset.moment, dataset.time):
+            blocks = np.full((len(block_start), int(counts.max(initial=1))), np.nan)
+            blocks[block_id, column] = values
+            reduced.append(np.nanmedian(blocks, axis=1) if n else values)
+        field, moment, time = reduced
+    else:
+        field = np.add.reduceat(dataset.field.astype(np.float64), block_start)/counts if n else dataset.field
+        moment = np.add.reduceat(dataset.moment.astype(np.float64), block_start)/counts if n else dataset.moment
+        time = np.add.reduceat(dataset.time, block_start)/counts if n else dataset.time
+    offsets = np.searchsorted(block_start, dataset.offsets)
+    step_size = target_step if method == 'bin' else dataset.step_size*factor
+    return dataset.copy_with(field = np.asarray(field, dtype=dataset.field.dtype), moment = np.asarray(moment, dtype=dataset.field.dtype),\
+        time = time, offsets = offsets, step_size = step_size)
+
+def correct_FORC_drift(dataset, against = 'time', degree = 1, mode = 'scale', return_fit = False):
+    """Corrects the drift of the moment with the saturation points measured before every FORC
+
+    The saturation moment of every curve (mean of its saturation points) is fitted with a polynomial of
+    the time stamp or of the curve number, and all branch and saturation points are corrected in one pass
+    to the value fitted for the first curve: scaled by Ms(first)/Ms(t) or shifted by Ms(t) - Ms(first).
+
+    Args:
+        dataset (FORCDataset): the dataset with saturation points.
+        against (str): 'time' (Time Stamp of the points) or 'curve' (curve number). Defaults to 'time'.
+        degree (int): degree of the drift polynomial. Defaults to 1 (linear drift).
+        mode (str): 'scale' for a drifting sensitivity, 'offset' for a drifting background. Defaults to 'scale'.
+        return_fit (bool): also return the np.polynomial.Polynomial fitted to the saturation moments. Defaults to False.
+
+    Returns:
+        FORCDataset: corrected dataset (and the fit if return_fit)
+    """
+    if against not in ('time', 'curve'):
+        raise ValueError(f"Unknown against '{against}', use 'time' or 'curve'")
+    if mode not in ('scale', 'offset'):
+        raise ValueError(f"Unknown mode '{mode}', use 'scale' or 'offset'")
+    n_sat = np.diff(dataset.sat_offsets)
+    sat_curve = np.repeat(np.arange(len(dataset)), n_sat)
+    
+    # Position of every point on the drift axis
+    if against == 'time':
+        x, sat_x = dataset.time, dataset.sat_time
+        if np.isnan(sat_x).all():
+            raise ValueError("The dataset has no time stamps, use against = 'curve'")
+    else:
+        x, sat_x = dataset.curve_number().astype(np.float64), sat_curve.astype(np.float64)
+    
+    # One saturation moment per curve
+    with np.errstate(invalid='ignore'):
+        Ms = np.bincount(sat_curve, weights=dataset.sat_moment, minlength=len(dataset))/n_sat
+        Ms_x = np.bincount(sat_curve, weights=sat_x, minlength=len(dataset))/n_sat
+    fitted = np.isfinite(Ms) & np.isfinite(Ms_x)
+    if np.count_nonzero(fitted) <= degree:
+        raise ValueError(f"{np.count_nonzero(fitted)} saturation points are too few for a degree {degree} drift fit")
+    fit = np.polynomial.Polynomial.fit(Ms_x[fitted], Ms[fitted], degree)
+    reference = fit(Ms_x[fitted][0])
+    
+    def corrected(moment, x):
+        drift = fit(x)
+        # Points without position (no time stamp) are left as they are
+        drift = np.where(np.isfinite(drift), drift, reference)
+        return (moment*(reference/drift) if mode == 'scale' else moment - (drift - reference)).astype(moment.dtype)
+    
+    corrected_dataset = dataset.copy_with(moment = corrected(dataset.moment, x), sat_moment = corrected(dataset.sat_moment, sat_x))
+    return (corrected_dataset, fit) if return_fit else corrected_dataset
+
+def FORC_dataset_rows(dataset, with_sat = True, sat_separator = True):
+    """Field/moment rows of a dataset in file order with NaN rows for the blank segment separators
+
+    With saturation points every curve gives [sat point(s), blank, branch, blank] like the PMC files,
+    the blank of the START comment is left out of the generic FORCinel/doFORC files
+    ([sat point(s), branch, blank]), without saturation points it is [branch, blank]. The last blank is
+    the END comment, curves of an aborted run (complete False) have none like in the .DAT file.
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        with_sat (bool): include the saturation points. Defaults to True.
+        sat_separator (bool): blank row between the saturation points and the branch. Defaults to True.
+
+    Returns:
+        field, moment (np.ndarray): rows to pass to write_FORC_data
+    """
+    n_branch = dataset.curve_lengths
+    n_sat = np.diff(dataset.sat_offsets) if with_sat else np.zeros(len(dataset), dtype=np.int64)
+    n_sep = 1 if with_sat and sat_separator else 0
+    # The blank after a branch is its END comment, aborted curves have none
+    n_end = dataset.complete.astype(np.int64)
+    block_start = np.concatenate(([0], np.cumsum(n_sat + n_sep + n_branch + n_end)))
+    
+    field = np.full(block_start[-1], np.nan)
+    moment = np.full(block_start[-1], np.nan)
+    # Branch k starts after its saturation points and their separator
+    branch_dest = np.arange(len(dataset.field)) - np.repeat(dataset.offsets[:-1], n_branch) + np.repeat(block_start[:-1] + n_sat + n_sep, n_branch)
+    field[branch_dest] = dataset.field
+    moment[branch_dest] = dataset.moment
+    if with_sat:
+        sat_dest = np.arange(len(dataset.sat_field)) - np.repeat(dataset.sat_offsets[:-1], n_sat) + np.repeat(block_start[:-1], n_sat)
+        field[sat_dest] = dataset.sat_field
+        moment[sat_dest] = dataset.sat_moment
+    return field, moment
+
+def write_FORC_dataset(f, dataset, file_type = 'FORCinel', path_PMC_header = None, avging_time = 0.5):
+    """Writes a dataset as PMC, FORCinel or doFORC file to an open text file
+
+    Args:
+        f (file): file opened for writing in text mode.
+        dataset (FORCDataset): the dataset.
+        file_type (str): 'PMC', 'FORCinel' or 'doFORC'. Defaults to 'FORCinel'.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+    """
+    if file_type not in FORC_END_LINES:
+        raise ValueError(f"Unknown file_type '{file_type}', use 'PMC', 'FORCinel' or 'doFORC'")
+    if file_type == 'PMC':
+        f.write(''.join(str(e) for e in gen_PMC_header_lines(path_PMC_header, len(dataset), dataset.n_points, avging_time)))
+    field, moment = FORC_dataset_rows(dataset, sat_separator = file_type == 'PMC')
+    write_FORC_data(f, field, moment, FORC_END_LINES[file_type])
+
+# FORC density from local second order polynomial fits on the regridded curves
+FORC_DENSITY_MIN_POINTS = 7
+
+def read_PMC_smoothing(path_PMC_header):
+    """Smoothing factor of a PMC file header, e.g. 'Smoothing    7' gives 7
+
+    Args:
+        path_PMC_header (str): path to the PMC FORC file.
+
+    Returns:
+        int: smoothing factor
+    """
+    header_lines = import_first_n_lines(path_PMC_header, 86)
+    return int(header_lines[find_substring_index(header_lines, 'Smoothing')].split()[-1])
+
+class FORCGrid:
+    """Curves of a dataset interpolated onto a regular Hb grid, rows ordered by Ha
+
+    Attributes:
+        Ha (np.ndarray): reversal field in T of every row (ascending).
+        Hb (np.ndarray): regular field grid in T of the columns.
+        moment (np.ndarray): (len(Ha), len(Hb)) moment in Am^2, NaN outside the measured part of a curve.
+    """
+    __slots__ = ('Ha', 'Hb', 'moment')
+
+    def __init__(self, Ha, Hb, moment):
+        self.Ha = Ha
+        self.Hb = Hb
+        self.moment = moment
+
+    def __repr__(self):
+        return f"FORCGrid(n_Ha={len(self.Ha)}, n_Hb={len(self.Hb)})"
+
+    @property
+    def nbytes(self):
+        return self.Ha.nbytes + self.Hb.nbytes + self.moment.nbytes
+
+def regrid_FORC_dataset(dataset, Hb_step = None, Hb = None):
+    """Interpolates every curve of a dataset onto a common regular Hb grid
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        Hb_step (float): grid step in Oe. Defaults to None (step_size of the dataset).
+        Hb (np.ndarray): grid in T, e.g. shared by several datasets, overrides Hb_step. Defaults to None
+            (Hb_step from the min to the max field of the dataset).
+
+    Returns:
+        FORCGrid: the regridded curves
+    """
+    field = dataset.field.astype(np.float64)
+    moment = dataset.moment.astype(np.float64)
+    has_points = dataset.curve_lengths > 1
+    if Hb is None:
+        if Hb_step is None:
+            Hb_step = dataset.step_size if np.isfinite(dataset.step_size) and dataset.step_size > 0 else np.nanmedian(np.abs(np.diff(field)))*10**4
+        step = Hb_step*10**-4
+        Hb = np.arange(np.nanmin(field), np.nanmax(field) + step/2, step)
+    
+    curves = np.flatnonzero(has_points)
+    curves = curves[np.argsort(dataset.Ha[curves], kind='stable')]
+    grid = np.full((len(curves), len(Hb)), np.nan)
+    for row, k in enumerate(curves):
+        x, y = field[dataset.offsets[k]:dataset.offsets[k + 1]], moment[dataset.offsets[k]:dataset.offsets[k + 1]]
+        order = np.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+        inside = (Hb >= x[0]) & (Hb <= x[-1])
+        grid[row, inside] = np.interp(Hb[inside], x, y)
+    return FORCGrid(dataset.Ha[curves], Hb, grid)
+
+def _FORC_density_rows(moment_pad, x_pad, SF, min_points = FORC_DENSITY_MIN_POINTS):
+    # Batched least squares of M = a0 + a1 x + a2 x^2 + a3 y + a4 y^2 + a5 x y over the (2SF+1)^2 window of every grid point,
+    # x and y in grid steps from the center. moment_pad holds the rows of the tile plus SF rows/cols of padding
+    w = 2*SF + 1
+    windows = np.lib.stride_tricks.sliding_window_view(moment_pad, (w, w))
+    n_rows, n_cols = windows.shape[:2]
+    windows = windows.reshape(n_rows, n_cols, w*w)
+    valid = np.isfinite(windows)
+    
+    # Features only depend on the row (Ha spacing) and the window position, not on the column
+    x = np.lib.stride_tricks.sliding_window_view(x_pad, w) - x_pad[SF:SF + n_rows, None]
+    x = np.broadcast_to(x[:, :, None], (n_rows, w, w)).reshape(n_rows, w*w)
+    y = np.broadcast_to(np.arange(-SF, SF + 1, dtype=np.float64), (n_rows, w, w)).reshape(n_rows, w*w)
+    features = np.stack([np.ones_like(x), x, x**2, y, y**2, x*y], axis=-1)
+    products = (features[:, :, :, None]*features[:, :, None, :]).reshape(n_rows, w*w, 36)
+    
+    ATA = np.matmul(valid.astype(np.float64), products).reshape(n_rows, n_cols, 6, 6)
+    ATy = np.matmul(np.where(valid, windows, 0), features)
+    count = valid.sum(axis=2)
+    fitted = (count >= min_points) & valid[:, :, (w*w)//2]
+    
+    # Poorly conditioned windows (e.g. a single Ha in reach) are solved with the pseudo inverse and dropped if singular
+    coeffs = np.full((n_rows, n_cols, 6), np.nan)
+    if fitted.any():
+        A, b = ATA[fitted], ATy[fitted]
+        try:
+            coeffs[fitted] = np.linalg.solve(A, b[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            coeffs[fitted] = np.matmul(np.linalg.pinv(A), b[..., None])[..., 0]
+            coeffs[fitted & (np.linalg.matrix_rank(ATA) < 6)] = np.nan
+    return -coeffs[:, :, 5]/2
+
+class FORCDensity:
+    """FORC density on the (Ha, Hb) grid of the regridded curves
+
+    Attributes:
+        Ha (np.ndarray): reversal field in T of every row.
+        Hb (np.ndarray): field in T of every column.
+        rho (np.ndarray): (len(Ha), len(Hb)) FORC density in Am^2/T^2, NaN where it was not fitted.
+        SF (int): smoothing factor.
+    """
+    __slots__ = ('Ha', 'Hb', 'rho', 'SF')
+
+    def __init__(self, Ha, Hb, rho, SF):
+        self.Ha = Ha
+        self.Hb = Hb
+        self.rho = rho
+        self.SF = SF
+
+    def __repr__(self):
+        return f"FORCDensity(SF={self.SF}, n_Ha={len(self.Ha)}, n_Hb={len(self.Hb)}, n_fitted={int(np.isfinite(self.rho).sum())})"
+
+    @property
+    def nbytes(self):
+        return self.Ha.nbytes + self.Hb.nbytes + self.rho.nbytes
+
+    @property
+    def Hc(self):
+        """Coercive field (Hb - Ha)/2 in T of every grid point"""
+        return (self.Hb[None, :] - self.Ha[:, None])/2
+
+    @property
+    def Hu(self):
+        """Interaction field (Hb + Ha)/2 in T of every grid point"""
+        return (self.Hb[None, :] + self.Ha[:, None])/2
+
+    def rotated(self, Hc_step = None, Hu_step = None):
+        """Bilinear resampling of rho onto a regular (Hc, Hu) grid
+
+        Args:
+            Hc_step (float): Hc grid step in T. Defaults to None (the Hb step).
+            Hu_step (float): Hu grid step in T. Defaults to None (the Hb step).
+
+        Returns:
+            Hc, Hu (np.ndarray): grid fields in T, rho (np.ndarray): (len(Hu), len(Hc)) density, NaN outside the data
+        """
+        Hb_step = self.Hb[1] - self.Hb[0] if len(self.Hb) > 1 else 1.0
+        Hc_step = Hb_step if Hc_step is None else Hc_step
+        Hu_step = Hb_step if Hu_step is None else Hu_step
+        Hc_all, Hu_all = self.Hc[np.isfinite(self.rho)], self.Hu[np.isfinite(self.rho)]
+        if not len(Hc_all):
+            return np.empty(0), np.empty(0), np.empty((0, 0))
+        Hc = np.arange(max(Hc_all.min(), 0), Hc_all.max() + Hc_step/2, Hc_step)
+        Hu = np.arange(Hu_all.min(), Hu_all.max() + Hu_step/2, Hu_step)
+        Ha = Hu[:, None] - Hc[None, :]
+        Hb = Hu[:, None] + Hc[None, :]
+        
+        # Fractional row and column of every rotated point
+        row = np.interp(Ha, self.Ha, np.arange(len(self.Ha)), left=np.nan, right=np.nan)
+        col = (Hb - self.Hb[0])/Hb_step
+        col[(col < 0) | (col > len(self.Hb) - 1)] = np.nan
+        inside = np.isfinite(row) & np.isfinite(col)
+        r0 = np.clip(np.floor(np.where(inside, row, 0)).astype(np.int64), 0, max(len(self.Ha) - 2, 0))
+        c0 = np.clip(np.floor(np.where(inside, col, 0)).astype(np.int64), 0, max(len(self.Hb) - 2, 0))
+        r1, c1 = np.minimum(r0 + 1, len(self.Ha) - 1), np.minimum(c0 + 1, len(self.Hb) - 1)
+        fr, fc = np.where(inside, row, 0) - r0, np.where(inside, col, 0) - c0
+        rho = (self.rho[r0, c0]*(1 - fr)*(1 - fc) + self.rho[r1, c0]*fr*(1 - fc) +\
+            self.rho[r0, c1]*(1 - fr)*fc + self.rho[r1, c1]*fr*fc)
+        rho[~inside] = np.nan
+        return Hc, Hu, rho
+
+def FORC_density_from_grid(grid, SF = 3, n_workers = 1, tile_rows = None):
+    """FORC density of regridded curves, see compute_FORC_density
+
+    Args:
+        grid (FORCGrid): regridded curves from regrid_FORC_dataset.
+        SF (int): smoothing factor, the fit window is (2SF+1)^2 grid points. Defaults to 3.
+        n_workers (int): worker processes for the tiles, 1 computes in this process. Defaults to 1.
+        tile_rows (int): grid rows per tile. Defaults to None (about 16 MB of window data per tile).
+
+    Returns:
+        FORCDensity: the FORC density
+    """
+    SF = int(SF)
+    n_rows, n_cols = grid.moment.shape
+    if n_rows == 0:
+        return FORCDensity(grid.Ha, grid.Hb, np.empty((0, n_cols)), SF)
+    moment_pad = np.pad(grid.moment, SF, constant_values=np.nan)
+    
+    # Ha in units of the median Ha spacing, padded with a linear continuation
+    dHa = float(np.median(np.diff(grid.Ha))) if n_rows > 1 else 1.0
+    dHa = dHa if dHa > 0 else 1.0
+    dHb = float(grid.Hb[1] - grid.Hb[0]) if n_cols > 1 else 1.0
+    x = (grid.Ha - grid.Ha[0])/dHa
+    x_pad = np.concatenate([x[0] - np.arange(SF, 0, -1), x, x[-1] + np.arange(1, SF + 1)])
+    
+    if tile_rows is None:
+        tile_rows = max(1, int(16*1024**2//(8*(n_cols + 2*SF)*(2*SF + 1)**2)))
+    tiles = [(start, min(start + tile_rows, n_rows)) for start in range(0, n_rows, tile_rows)]
+    args = [(moment_pad[start:stop + 2*SF], x_pad[start:stop + 2*SF], SF) for start, stop in tiles]
+    if n_workers == 1 or len(tiles) == 1:
+        rho_tiles = [_FORC_density_rows(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            rho_tiles = list(executor.map(_FORC_density_rows, *zip(*args)))
+    rho = np.concatenate(rho_tiles, axis=0)/(dHa*dHb)
+    return FORCDensity(grid.Ha, grid.Hb, rho, SF)
+
+def compute_FORC_density(dataset, SF = None, Hb_step = None, n_workers = None, tile_rows = None, path_PMC_header = None):
+    """FORC density rho(Ha, Hb) = -1/2 d2M/dHa dHb from local second order polynomial fits
+
+    The curves are interpolated onto a regular Hb grid (one row per curve) and
+    M = a0 + a1 Ha + a2 Ha^2 + a3 Hb + a4 Hb^2 + a5 Ha Hb is fitted by least squares over the
+    (2SF+1)^2 grid points around every point, rho = -a5/2. The rows are split in tiles over a process pool.
+
+    Args:
+        dataset (FORCDataset or str): the dataset or path to the .DAT data file.
+        SF (int): smoothing factor. Defaults to None (Smoothing of path_PMC_header, else 3).
+        Hb_step (float): Hb grid step in Oe. Defaults to None (step_size of the dataset).
+        n_workers (int): worker processes, 1 computes in this process. Defaults to None (number of cores).
+        tile_rows (int): grid rows per tile. Defaults to None (about 16 MB of window data per tile).
+        path_PMC_header (str): PMC file to read the smoothing factor from. Defaults to None.
+
+    Returns:
+        FORCDensity: the FORC density, with Hc/Hu arrays and rotated() resampling
+    """
+    if not isinstance(dataset, FORCDataset):
+        dataset = average_FORC_repeats(load_FORC_dataset(dataset))
+    if SF is None:
+        SF = read_PMC_smoothing(path_PMC_header) if path_PMC_header is not None else 3
+    return FORC_density_from_grid(regrid_FORC_dataset(dataset, Hb_step), SF = SF, n_workers = n_workers, tile_rows = tile_rows)
+
+def FORC_dataset_hash(dataset):
+    """blake2b hash of the arrays of a dataset, identical curves give the same hash whatever file they came from
+
+    Args:
+        dataset (FORCDataset): the dataset.
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in FORC_CACHE_ARRAYS:
+        array = np.ascontiguousarray(getattr(dataset, name))
+        digest.update(f'{name}:{array.dtype.str}:{array.shape}'.encode())
+        digest.update(array.data)
+    digest.update(repr(dataset.step_size).encode())
+    return digest.hexdigest()
+
+class FORCDensityCache:
+    """Memoized regridded curves and FORC densities for sweeps of the smoothing factor or the grid
+
+    Results are keyed on the content hash of the dataset plus the processing parameters. The regridded
+    curves only depend on the preprocessing and the Hb step, so a sweep over SF regrids once and only
+    fits again. Results live in an in-memory LRU limited to max_bytes and, with cache_dir, in .npz files
+    that survive the session (limited to max_disk_bytes, least recently used removed first).
+
+    Attributes:
+        max_bytes (int): size limit of the in-memory tier.
+        cache_dir (str): directory of the on-disk tier, None for memory only.
+        max_disk_bytes (int): size limit of the on-disk tier.
+        hits, misses (int): lookup statistics.
+    """
+    def __init__(self, max_bytes = 512*1024**2, cache_dir = None, max_disk_bytes = 2*1024**3):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f"FORCDensityCache(entries={len(self._entries)}, nbytes={self._nbytes}, max_bytes={self.max_bytes}, "
+                f"cache_dir={self.cache_dir!r}, hits={self.hits}, misses={self.misses})")
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @staticmethod
+    def key(kind, dataset_hash, **params):
+        """Cache key of a result, e.g. key('density', hash, SF=3, Hb_step=None)"""
+        return hashlib.blake2b(json.dumps([kind, dataset_hash, params], sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+    def get(self, key):
+        """Cached result or None, a disk hit is moved into memory"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        result = self._load(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if result is not None:
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """Stores a FORCGrid or FORCDensity in memory (and on disk with cache_dir)"""
+        self._remember(key, result)
+        if self.cache_dir is not None:
+            self._save(key, result)
+        return result
+
+    def clear(self, disk = False):
+        """Empties the in-memory tier, and the on-disk tier if disk"""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+        if disk and self.cache_dir is not None:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _remember(self, key, result):
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = result
+            self._nbytes += result.nbytes
+            # Evicting the least recently used results, the newest one stays even if it is larger than max_bytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+    def _save(self, key, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {name: getattr(result, name) for name in result.__slots__}
+        path_tmp = os.path.join(self.cache_dir, f'{key}.{os.getpid()}.tmp.npz')
+        np.savez(path_tmp, kind=type(result).__name__, **arrays)
+        os.replace(path_tmp, os.path.join(self.cache_dir, key + '.npz'))
+        
+        # Evicting the least recently used files above max_disk_bytes
+        files = sorted((entry.stat().st_atime, entry.stat().st_size, entry.path) for entry in os.scandir(self.cache_dir) if entry.name.endswith('.npz'))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files[:-1]:
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, key + '.npz')
+        try:
+            with np.load(path) as arrays:
+                kind = {'FORCGrid': FORCGrid, 'FORCDensity': FORCDensity}[str(arrays['kind'])]
+                values = {name: arrays[name] for name in kind.__slots__}
+        except (OSError, KeyError, ValueError):
+            return None
+        if 'SF' in values:
+            values['SF'] = int(values['SF'])
+        os.utime(path)
+        return kind(**values)
+
+# Shared cache used by cached_FORC_density when no cache is given
+FORC_DENSITY_CACHE = FORCDensityCache()
+
+def cached_FORC_density(dataset, SF = 3, Hb_step = None, decimate = None, drift_correction = None, n_workers = None, cache = None):
+    """compute_FORC_density with memoized results, for interactive sweeps of SF, Hb_step or decimation
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        SF (int): smoothing factor. Defaults to 3.
+        Hb_step (float): Hb grid step in Oe. Defaults to None (step_size of the dataset).
+        decimate (dict): arguments of decimate_FORC_dataset applied before regridding. Defaults to None.
+        drift_correction (dict): arguments of correct_FORC_drift applied before decimating. Defaults to None.
+        n_workers (int): worker processes of the fits. Defaults to None (number of cores).
+        cache (FORCDensityCache): cache to use. Defaults to None (FORC_DENSITY_CACHE).
+
+    Returns:
+        FORCDensity: the FORC density
+    """
+    cache = FORC_DENSITY_CACHE if cache is None else cache
+    dataset_hash = FORC_dataset_hash(dataset)
+    grid_params = {'Hb_step': Hb_step, 'decimate': decimate, 'drift_correction': drift_correction}
+    density_key = cache.key('density', dataset_hash, SF = int(SF), **grid_params)
+    density = cache.get(density_key)
+    if density is not None:
+        return density
+    
+    # The regridded curves are shared by every SF
+    grid_key = cache.key('grid', dataset_hash, **grid_params)
+    grid = cache.get(grid_key)
+    if grid is None:
+        corrected = correct_FORC_drift(dataset, **drift_correction) if drift_correction is not None else dataset
+        grid = regrid_FORC_dataset(decimate_FORC_dataset(corrected, **decimate) if decimate else corrected, Hb_step)
+        cache.put(grid_key, grid)
+    return cache.put(density_key, FORC_density_from_grid(grid, SF = SF, n_workers = n_workers))
+
+# Persistent cache of parsed .DAT files, one directory of .npy arrays per .DAT file
+FORC_CACHE_DIR = os.environ.get('FORC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'FORC_functions_RJ'))
+FORC_CACHE_MAX_BYTES = int(os.environ.get('FORC_CACHE_MAX_BYTES', 2*1024**3))
+FORC_CACHE_VERSION = 3
+FORC_CACHE_ARRAYS = ('field', 'moment', 'offsets', 'sat_field', 'sat_moment', 'sat_offsets', 'complete', 'FORC_number', 'repeat', 'time', 'sat_time')
+
+def file_content_hash(path, block_size = 1 << 20):
+    """blake2b hash of the content of a file
+
+    Args:
+        path (str): path to the file.
+        block_size (int): bytes read at once. Defaults to 1 MB.
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def FORC_cache_entry_dir(path_data_file, cache_dir = None):
+    """Cache directory of a .DAT file, named after the hash of its absolute path"""
+    key = hashlib.blake2b(os.path.abspath(path_data_file).encode(), digest_size=16).hexdigest()
+    return os.path.join(FORC_CACHE_DIR if cache_dir is None else cache_dir, key)
+
+def _read_cache_meta(entry_dir):
+    try:
+        with open(os.path.join(entry_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache_meta(entry_dir, meta):
+    # Replacing the file so a reader never sees half a json
+    path_tmp = os.path.join(entry_dir, f'meta.json.{os.getpid()}.tmp')
+    with open(path_tmp, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(path_tmp, os.path.join(entry_dir, 'meta.json'))
+
+def load_FORC_dataset(path_data_file, use_cache = True, cache_dir = None, max_bytes = None, return_metadata = False):
+    """Reads a .DAT file as FORCDataset, memory-mapping the arrays from the cache when the file was parsed before
+
+    A cache entry is valid for the same path, size and mtime; if only the mtime changed the content hash decides.
+    New entries are stored after parsing and the least recently used entries are evicted above max_bytes.
+    A cache that cannot be written (read-only, full disk) is logged as a warning and the parsed dataset is returned.
+
+    Args:
+        path_data_file (str): path to the .DAT data file.
+        use_cache (bool): use the persistent cache. Defaults to True.
+        cache_dir (str): cache directory. Defaults to FORC_CACHE_DIR ($FORC_CACHE_DIR or ~/.cache/FORC_functions_RJ).
+        max_bytes (int): size limit of the cache. Defaults to FORC_CACHE_MAX_BYTES (2 GB).
+        return_metadata (bool): also return the DATMetadata of the file. Defaults to False.
+
+    Returns:
+        FORCDataset: the dataset (and DATMetadata if return_metadata)
+    """
+    if not use_cache:
+        data, metadata = read_DAT_FORC_columns(path_data_file)
+        dataset = FORCDataset.from_DAT_data(data, metadata = metadata, name = DAT_file_stem(path_data_file))
+        return (dataset, metadata) if return_metadata else dataset
+    
+    entry_dir = FORC_cache_entry_dir(path_data_file, cache_dir)
+    stat = os.stat(path_data_file)
+    meta = _read_cache_meta(entry_dir)
+    hit = meta is not None and meta['version'] == FORC_CACHE_VERSION and meta['size'] == stat.st_size
+    if hit and meta['mtime_ns'] != stat.st_mtime_ns:
+        hit = meta['content_hash'] == file_content_hash(path_data_file)
+        meta['mtime_ns'] = stat.st_mtime_ns
     
-    # Parameters to plot
-    x_param = 'Magnetic Field (Oe)'
-    y_param = 'Moment (emu)'
+    if hit:
+        with FORC_stage('load_cache', entry_dir, bytes_read = meta['nbytes']) as stage:
+            arrays = {name: np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode='r') for name in FORC_CACHE_ARRAYS}
+            dataset = FORCDataset(**arrays, **meta['dataset'])
+            metadata = DATMetadata(**meta['metadata'])
+            meta['last_used'] = time.time()
+            stage.rows = dataset.n_points
+        try:
+            _write_cache_meta(entry_dir, meta)
+        except OSError as error:
+            FORC_LOGGER.warning("Could not update the cache entry %s: %s", entry_dir, error)
+    else:
+        data, metadata = read_DAT_FORC_columns(path_data_file)
+        dataset = FORCDataset.from_DAT_data(data, metadata = metadata, name = DAT_file_stem(path_data_file))
+        try:
+            with FORC_stage('store_cache', entry_dir, rows = dataset.n_points) as stage:
+                store_FORC_cache_entry(path_data_file, dataset, metadata, stat, cache_dir = cache_dir)
+                evict_FORC_cache(max_bytes = max_bytes, cache_dir = cache_dir)
+                stage.bytes_written = dataset.nbytes
+        except OSError as error:
+            FORC_LOGGER.warning("Could not cache %s in %s: %s", path_data_file, entry_dir, error)
+    return (dataset, metadata) if return_metadata else dataset
+
+def store_FORC_cache_entry(path_data_file, dataset, metadata, stat = None, cache_dir = None):
+    """Saves the arrays and metadata of a parsed .DAT file in the cache
+
+    Args:
+        path_data_file (str): path to the .DAT data file.
+        dataset (FORCDataset): parsed dataset.
+        metadata (DATMetadata): metadata of the file.
+        stat (os.stat_result): stat of the file when it was parsed. Defaults to None (stat now).
+        cache_dir (str): cache directory. Defaults to FORC_CACHE_DIR.
+
+    Returns:
+        str: entry directory
+    """
+    entry_dir = FORC_cache_entry_dir(path_data_file, cache_dir)
+    stat = os.stat(path_data_file) if stat is None else stat
     
-    # # Empty row at the end of each dataset
-    # empty_row = pd.Series([None, None], index=['Field', 'Moment'])
+    # Writing into a temporary dir first so concurrent workers never see a partial entry
+    tmp_dir = f'{entry_dir}.{os.getpid()}.tmp'
+    meta = {'version': FORC_CACHE_VERSION,
+            'path': os.path.abspath(path_data_file),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_hash': file_content_hash(path_data_file),
+            'nbytes': dataset.nbytes,
+            'created': time.time(),
+            'last_used': time.time(),
+            'dataset': {name: getattr(dataset, name) for name in ('temperature', 'avging_time', 'H_sat', 'step_size', 'name')},
+            'metadata': {name: getattr(metadata, name) for name in DATMetadata.__slots__}}
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in FORC_CACHE_ARRAYS:
+            np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(getattr(dataset, name)))
+        _write_cache_meta(tmp_dir, meta)
+    except OSError:
+        # No partial entry is left behind on a full disk
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another worker stored the same file meanwhile
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return entry_dir
+
+def inspect_FORC_cache(cache_dir = None):
+    """Lists the entries of the cache, most recently used first
+
+    Args:
+        cache_dir (str): cache directory. Defaults to FORC_CACHE_DIR.
+
+    Returns:
+        list: one dict per entry with 'dir', 'path', 'bytes' (on disk), 'last_used' and 'valid' (source file unchanged)
+    """
+    cache_dir = FORC_CACHE_DIR if cache_dir is None else cache_dir
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        meta = _read_cache_meta(entry_dir)
+        if meta is None or name.endswith('.tmp'):
+            continue
+        disk_bytes = sum(os.path.getsize(os.path.join(entry_dir, file)) for file in os.listdir(entry_dir))
+        try:
+            stat = os.stat(meta['path'])
+            valid = stat.st_size == meta['size'] and stat.st_mtime_ns == meta['mtime_ns']
+        except OSError:
+            valid = False
+        entries.append({'dir': entry_dir, 'path': meta['path'], 'bytes': disk_bytes, 'last_used': meta['last_used'], 'valid': valid})
+    return sorted(entries, key=lambda entry: entry['last_used'], reverse=True)
+
+def evict_FORC_cache(max_bytes = None, cache_dir = None):
+    """Removes the least recently used entries until the cache is below max_bytes
+
+    Args:
+        max_bytes (int): size limit. Defaults to FORC_CACHE_MAX_BYTES.
+        cache_dir (str): cache directory. Defaults to FORC_CACHE_DIR.
+
+    Returns:
+        int: number of removed entries
+    """
+    max_bytes = FORC_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = inspect_FORC_cache(cache_dir)
+    total = sum(entry['bytes'] for entry in entries)
+    removed = 0
+    while entries and total > max_bytes:
+        entry = entries.pop()
+        shutil.rmtree(entry['dir'], ignore_errors=True)
+        total -= entry['bytes']
+        removed += 1
+    return removed
+
+def clear_FORC_cache(cache_dir = None):
+    """Removes all entries of the cache
+
+    Args:
+        cache_dir (str): cache directory. Defaults to FORC_CACHE_DIR.
+
+    Returns:
+        int: number of removed entries
+    """
+    return evict_FORC_cache(max_bytes = -1, cache_dir = cache_dir)
 
-    # Adding "END" in the last line
-    end_line = pd.Series(['MicroMag 2900/3900 Data File ends', np.NAN], index=['Field', 'Moment'])
+def stream_DAT_to_FORC_file(path_data_file, path_final_PMC_file, file_type = 'PMC', path_PMC_header = None, avging_time = 0.5, saturating_field = 500,\
+    chunk_size = 100000, average_repeats = True, reject_sigma = None):
+    """Converts a .DAT file from VSM chunk by chunk so the memory use stays flat for any file size.
+    The output is byte-identical to gen_PMC_FORC_file and gen_generic_FORC_file_from_PMC_data.
 
-    # Creating the pd.DataFrame
-    df = pd.DataFrame(columns=['Field', 'Moment'])
+    Repeated FORCs are averaged on the field step of the whole file and the PMC header holds the counts
+    after averaging, neither is known chunk by chunk, so files with repeats are converted in memory.
 
-    # Changing to SI units
-    x = ((data[x_param]*10**-4).tolist())
-    y = ((data[y_param]*10**-3).tolist())
+    Args:
+        path_data_file (str): path to the .DAT data file.
+        path_final_PMC_file (str): path and name of the final file. example: "path/NN9_FORCs_PMC_try_6_1.forc"
+        file_type (str): 'PMC', 'FORCinel' or 'doFORC'. Defaults to 'PMC'.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for file_type = 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+        saturating_field (int): rows at this field (Oe) are also dropped from the generic files, None keeps them. Defaults to 500 Oe.
+        chunk_size (int): number of .DAT rows parsed at once. Defaults to 100000.
+        average_repeats (bool): convert files with repeated FORCs in memory to average them, False streams
+            the repeats as they are. Defaults to True.
+        reject_sigma (float): outlier rejection of the repeat averaging, see average_FORC_repeats. Defaults to None.
+    """
+    # Parameters to export
+    x_param = DAT_FIELD_COLUMN
+    y_param = DAT_MOMENT_COLUMN
+    metadata = read_DAT_header(path_data_file)
+    if file_type not in FORC_END_LINES:
+        raise ValueError(f"Unknown file_type '{file_type}', use 'PMC', 'FORCinel' or 'doFORC'")
+    
+    # First pass only reads the comments and fields to build the segment index
+    start_rows, end_rows, repeats = [], [], []
+    num_rows = 0
+    num_data_points = 0
+    with FORC_stage('stream_index', path_data_file, bytes_read = _file_size(path_data_file)) as stage:
+        chunks, _ = read_DAT_file(path_data_file, columns=[DAT_COMMENT_COLUMN, x_param], chunk_size=chunk_size, metadata=metadata)
+        for chunk in chunks:
+            chunk_start_rows = find_marker_rows(chunk[DAT_COMMENT_COLUMN], FORC_START_MARKER)
+            repeats.append(find_FORC_repeat_labels(chunk[DAT_COMMENT_COLUMN], chunk_start_rows)[1])
+            start_rows.append(chunk_start_rows + num_rows)
+            end_rows.append(find_marker_rows(chunk[DAT_COMMENT_COLUMN], FORC_END_MARKER) + num_rows)
+            num_rows += len(chunk)
+            num_data_points += len(chunk) - chunk[x_param].isna().sum()
+        index = FORCSegmentIndex(np.concatenate(start_rows or [[]]), np.concatenate(end_rows or [[]]), num_rows, n_points = num_data_points)
+        stage.rows = num_rows
+    if average_repeats and (np.concatenate(repeats or [[]]) > 1).any():
+        FORC_LOGGER.info("%s has repeated FORCs, converting it in memory to average them", path_data_file)
+        export_FORC_files(path_data_file, {file_type: path_final_PMC_file}, path_PMC_header = path_PMC_header, avging_time = avging_time,\
+            saturating_field = saturating_field, use_cache = False, reject_sigma = reject_sigma)
+        return
+    
+    header_lines = []
+    if file_type == 'PMC':
+        header_lines = gen_PMC_header_lines(path_PMC_header, index.n_FORCs, index.n_points, avging_time)
+    end_lines = FORC_END_LINES[file_type]
+    
+    with FORC_stage(f'stream_write_{file_type}', path_final_PMC_file, rows = num_rows, bytes_read = _file_size(path_data_file)) as stage:
+        with open_FORC_file(Path.cwd().joinpath(path_final_PMC_file), "w", encoding=FORC_FILE_ENCODINGS[file_type], buffering=FORC_WRITE_BUFFER) as f:
+            f.write(''.join(str(e) for e in header_lines))
+            
+            # Second pass filters, changes to SI units and writes the data lines
+            writer = FORCDataWriter(f, end_lines)
+            chunks, _ = read_DAT_file(path_data_file, chunk_size=chunk_size, metadata=metadata)
+            first_row = 0
+            for chunk in chunks:
+                x = chunk[x_param].to_numpy()
+                y = chunk[y_param].to_numpy()
+                if file_type != 'PMC':
+                    mask = index.generic_mask(len(x), first_row)
+                    if saturating_field is not None:
+                        mask &= ~(np.round(x, 0) == saturating_field)
+                    x, y = x[mask], y[mask]
+                first_row += len(chunk)
+                writer.write(x*10**-4, y*10**-3)
+            writer.close()
+        stage.bytes_written = _file_size(path_final_PMC_file)
+
+def export_FORC_files(path_data_file, outputs, path_PMC_header = None, avging_time = 0.5, saturating_field = 500, use_cache = True,\
+    average_repeats = True, reject_sigma = None, decimate = None, SF = None, n_workers = None, drift_correction = None):
+    """Parses a .DAT file from VSM once and writes any subset of PMC, FORCinel, doFORC, csv, npz and FORC density files from the same arrays
+
+    The PMC file keeps every row, the generic FORCinel/doFORC files drop the START_DATA_FORC rows and the
+    points at saturating_field (the saturation points when H_sat equals it), csv/npz only hold the
+    branches. csv/npz hold one row per branch point with the
+    FORC number, field in T and moment in Am^2, plus the std of the moment when repeats were averaged.
+    The density npz holds Ha, Hb, rho, and the rotated Hc, Hu, rho_HcHu from compute_FORC_density.
 
-    # Creating a temp dataframe
-    temp_df = pd.DataFrame(list(zip(x, y)), columns = ['Field', 'Moment'])
+    Args:
+        path_data_file (str or FORCDataset): path to the .DAT data file or an already parsed dataset.
+        outputs (dict): path of the final file for each format, e.g. {'PMC': 'S23_1.forc', 'FORCinel': 'S23_1.frc'}.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+        saturating_field (int): branch and saturation points at this field (Oe) are dropped from the generic files, None keeps them. Defaults to 500 Oe.
+        use_cache (bool): memory-map the parsed arrays from the persistent cache, see load_FORC_dataset. Defaults to True.
+        average_repeats (bool): average the repeats of repeated FORCs, see average_FORC_repeats. Defaults to True.
+        reject_sigma (float): outlier rejection of the repeat averaging. Defaults to None (no rejection).
+        decimate (dict): arguments of decimate_FORC_dataset applied to every format before writing,
+            e.g. {'factor': 4} or {'method': 'bin', 'target_step': 2}. Defaults to None (all points).
+        SF (int): smoothing factor of the FORC density. Defaults to None (Smoothing of path_PMC_header, else 3).
+        n_workers (int): worker processes of the FORC density. Defaults to None (number of cores).
+        drift_correction (dict): arguments of correct_FORC_drift applied before the other steps, e.g. {'against': 'time'}.
+            Defaults to None (no correction).
 
-    # # Appending the data and the last line
-    # df = df.append(temp_df, ignore_index=True)
-    # df = df.append(end_line, ignore_index=True)
+    Returns:
+        dict: path of the exported file for each format
+    """
+    unknown = [file_type for file_type in outputs if file_type not in FORC_FILE_EXTENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown formats {unknown}, use {list(FORC_FILE_EXTENSIONS)}")
+    
+    # Importing data and changing to SI units once for all formats
+    dataset = path_data_file if isinstance(path_data_file, FORCDataset) else load_FORC_dataset(path_data_file, use_cache = use_cache)
+    std = None
+    if drift_correction is not None:
+        with FORC_stage('drift_correction', rows = dataset.n_points):
+            dataset = correct_FORC_drift(dataset, **drift_correction)
+    if average_repeats and (dataset.repeat > 1).any():
+        with FORC_stage('average_repeats', rows = dataset.n_points):
+            dataset, std = average_FORC_repeats(dataset, reject_sigma = reject_sigma, return_std = True)
+    generic_dataset = dataset
+    if saturating_field is not None:
+        with FORC_stage('filter_generic', rows = dataset.n_points):
+            generic_dataset = drop_saturating_field(dataset, saturating_field)
+            std = None if std is None else std[~(np.round(dataset.field*10**4, 0) == saturating_field)]
+    if decimate:
+        # The points at the saturating field are dropped before they can be averaged into the generic curves
+        with FORC_stage('decimate', rows = dataset.n_points + generic_dataset.n_points):
+            dataset = decimate_FORC_dataset(dataset, **decimate)
+            generic_dataset = decimate_FORC_dataset(generic_dataset, **decimate)
+            std = None
+    
+    def write_text(file_type, path_final_file):
+        with open_FORC_file(Path.cwd().joinpath(path_final_file), "w", encoding=FORC_FILE_ENCODINGS[file_type], buffering=FORC_WRITE_BUFFER) as f:
+            write_FORC_dataset(f, dataset if file_type == 'PMC' else generic_dataset, file_type, path_PMC_header, avging_time)
+    
+    def write_table(file_type, path_final_file):
+        # One row per branch point with the FORC number (1 based)
+        keep = ~np.isnan(generic_dataset.field) & ~np.isnan(generic_dataset.moment)
+        FORC_number = generic_dataset.curve_number()[keep] + 1
+        x, y = generic_dataset.field[keep], generic_dataset.moment[keep]
+        columns = {'FORC': FORC_number, 'field': x, 'moment': y}
+        if std is not None:
+            columns['moment_std'] = std[keep]
+        if file_type == 'npz':
+            save_npz(path_final_file, **columns)
+        else:
+            names = {'field': 'Field (T)', 'moment': 'Moment (Am2)', 'moment_std': 'Moment std (Am2)'}
+            table = pd.DataFrame({names.get(name, name): values for name, values in columns.items()})
+            table.to_csv(path_final_file, index=False, float_format='%.15f')
+    
+    def write_density(file_type, path_final_file):
+        density = compute_FORC_density(generic_dataset, SF = SF, n_workers = n_workers, path_PMC_header = path_PMC_header)
+        Hc, Hu, rho_HcHu = density.rotated()
+        save_npz(path_final_file, Ha=density.Ha, Hb=density.Hb, rho=density.rho, SF=density.SF, Hc=Hc, Hu=Hu, rho_HcHu=rho_HcHu)
     
-    # Appending the data and the last line
-    df = pd.concat([df, temp_df])
-    df = pd.concat([df, end_line])
+    def write_stage(file_type, path_final_file):
+        writer = {'csv': write_table, 'npz': write_table, 'density': write_density}.get(file_type, write_text)
+        rows = dataset.n_points if file_type == 'PMC' else generic_dataset.n_points
+        with FORC_stage(f'write_{file_type}', path_final_file, rows = rows) as stage:
+            writer(file_type, path_final_file)
+            stage.bytes_written = _file_size(path_final_file)
     
-    # Exporting the pd dataframe as .forc
-    with open(Path.cwd().joinpath(path_final_PMC_file), "w", encoding='cp1252') as f:
-        f.write(''.join(str(e) for e in header_lines))
+    # Running the writers together
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(outputs) or 1) as executor:
+        futures = [executor.submit(write_stage, file_type, path_final_file) for file_type, path_final_file in outputs.items()]
+        for future in futures:
+            future.result()
+    return dict(outputs)
+
+class FORCFollower:
+    """Converts a .DAT file that is still being written by the VersaLab, one completed FORC at a time
+
+    Every update() reads only the bytes appended since the last call, detects completed curves by
+    their end_data_FORC comment and appends them to the output file. Only the trailer and, for PMC
+    files, the header counts (padded to a fixed width) are rewritten, so an update costs O(new rows).
+
+    Args:
+        path_data_file (str): path to the growing .DAT data file.
+        path_final_file (str): path of the output file.
+        file_type (str): 'PMC', 'FORCinel' or 'doFORC'. Defaults to 'FORCinel'.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+        saturating_field (int): branch and saturation points at this field (Oe) are dropped from the generic files, None keeps them. Defaults to 500 Oe.
+    """
+    def __init__(self, path_data_file, path_final_file, file_type = 'FORCinel', path_PMC_header = None, avging_time = 0.5, saturating_field = 500):
+        if file_type not in FORC_END_LINES:
+            raise ValueError(f"Unknown file_type '{file_type}', use 'PMC', 'FORCinel' or 'doFORC'")
+        if FORC_compression(path_data_file) or FORC_compression(path_final_file):
+            raise ValueError("A running measurement is followed in plain files, compress the files after the run")
+        self.path_data_file = path_data_file
+        self.path_final_file = path_final_file
+        self.file_type = file_type
+        self.path_PMC_header = path_PMC_header
+        self.avging_time = avging_time
+        self.saturating_field = saturating_field
+        self.reset()
+
+    def reset(self):
+        """Starts over from the beginning of the .DAT file"""
+        self.offset = 0
+        self.columns = None
+        self.n_FORCs = 0
+        self.n_points = 0
+        self._sat = []
+        self._branch = []
+        self._in_branch = False
+        self._trimmed = 0
+        self.data_end = len(self._header_bytes())
+        with open(self.path_final_file, 'wb') as f:
+            f.write(self._header_bytes())
+            f.write('\n'.join(FORC_END_LINES[self.file_type]).encode())
+
+    def _header_bytes(self):
+        if self.file_type != 'PMC':
+            return b''
+        header_lines = gen_PMC_header_lines(self.path_PMC_header, self.n_FORCs, self.n_points, self.avging_time, count_width = 10)
+        return ''.join(header_lines).encode('cp1252')
+
+    def _read_new_lines(self):
+        """Complete lines appended to the .DAT file since the last call"""
+        if os.path.getsize(self.path_data_file) < self.offset:
+            # The file was replaced, converting it again
+            self.reset()
+        with open(self.path_data_file, 'rb') as f:
+            f.seek(self.offset)
+            new_bytes = f.read()
+        end = new_bytes.rfind(b'\n') + 1
+        lines = new_bytes[:end].decode('utf-8', errors='replace').splitlines()
+        if self.columns is None:
+            # Waiting for the [Data] section and the column names
+            if '[Data]' not in [line.strip() for line in lines]:
+                return []
+            idx_data = [line.strip() for line in lines].index('[Data]')
+            if idx_data + 1 >= len(lines):
+                return []
+            self.columns = next(csv.reader([lines[idx_data + 1]]))
+            self._cols = [self.columns.index(name) for name in DAT_COLUMNS]
+            lines = lines[idx_data + 2:]
+        self.offset += end
+        return lines
+
+    def update(self):
+        """Parses the newly appended rows and appends the completed curves to the output file
+
+        Returns:
+            int: number of curves added
+        """
+        lines = self._read_new_lines()
+        if self.columns is None:
+            return 0
+        idx_comment, idx_field, idx_moment = self._cols
+        new_rows = []
+        for row in csv.reader(lines):
+            if len(row) <= max(self._cols):
+                continue
+            comment = row[idx_comment].upper()
+            if FORC_START_MARKER in comment:
+                self._in_branch = True
+            elif FORC_END_MARKER in comment:
+                new_rows.append((self._sat, self._branch))
+                self._sat, self._branch, self._in_branch = [], [], False
+            elif row[idx_field].strip():
+                point = (float(row[idx_field])*10**-4, float(row[idx_moment])*10**-3 if row[idx_moment].strip() else np.nan)
+                (self._branch if self._in_branch else self._sat).append(point)
+        if not new_rows:
+            return 0
+        
+        # Curves in the layout of FORC_dataset_rows: [sat, blank, branch, blank] or [sat, branch, blank]
+        blank = [(np.nan, np.nan)]
+        rows = []
+        for sat, branch in new_rows:
+            if self.saturating_field is not None and self.file_type != 'PMC':
+                sat = [point for point in sat if np.round(point[0]*10**4, 0) != self.saturating_field]
+                branch = [point for point in branch if np.round(point[0]*10**4, 0) != self.saturating_field]
+            rows += (sat + blank + branch + blank) if self.file_type == 'PMC' else (sat + branch + blank)
+            self.n_points += len(sat) + len(branch)
+        self.n_FORCs += len(new_rows)
+        rows = np.array(rows, dtype=np.float64).reshape(-1, 2)
+        text = format_FORC_data_block(rows[:, 0], rows[:, 1]).encode()
         
-    # Appending the data to created file with headers. Exporting the pd dataframe as .forc
-    with open(Path.cwd().joinpath(path_final_PMC_file), "a", encoding='cp1252') as f:
-        f.write("\n".join([l.strip(",\n") for l in df.to_csv(index=False, header=None, float_format='%.15f', line_terminator = '\n').split("\n")]))
+        with open(self.path_final_file, 'r+b') as f:
+            if self.file_type == 'PMC':
+                f.write(self._header_bytes())
+            # Overwriting the trailer with the new rows and writing it again
+            f.seek(self.data_end - self._trimmed)
+            f.write(b'\n'*self._trimmed + text)
+            self.data_end += len(text)
+            end_lines = FORC_END_LINES[self.file_type]
+            if end_lines:
+                f.write('\n'.join(end_lines).encode())
+                self._trimmed = 0
+            else:
+                # doFORC files have no trailer and no newline after the last line
+                f.seek(self.data_end - 1)
+                self._trimmed = 1
+            f.truncate()
+        return len(new_rows)
+
+def follow_DAT_file(path_data_file, path_final_file, file_type = 'FORCinel', path_PMC_header = None, avging_time = 0.5, saturating_field = 500,\
+    poll_interval = 30, timeout = 3600):
+    """Follows a .DAT file during the measurement and keeps the output file up to date, see FORCFollower
+
+    Args:
+        path_data_file (str): path to the growing .DAT data file.
+        path_final_file (str): path of the output file.
+        file_type (str): 'PMC', 'FORCinel' or 'doFORC'. Defaults to 'FORCinel'.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+        saturating_field (int): branch and saturation points at this field (Oe) are dropped from the generic files, None keeps them. Defaults to 500 Oe.
+        poll_interval (float): seconds between checks of the .DAT file. Defaults to 30 sec.
+        timeout (float): stops when no curve was completed for this many seconds, None follows until interrupted. Defaults to 3600 sec.
+
+    Returns:
+        FORCFollower: the follower with the final counts
+    """
+    follower = FORCFollower(path_data_file, path_final_file, file_type, path_PMC_header, avging_time, saturating_field)
+    last_curve = time.time()
+    try:
+        while True:
+            n_new = follower.update()
+            if n_new:
+                last_curve = time.time()
+                print(f"Added {n_new} FORCs, {follower.n_FORCs} FORCs in {path_final_file}")
+            elif timeout is not None and time.time() - last_curve > timeout:
+                break
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        pass
+    print(f"Stopped following {path_data_file} after {follower.n_FORCs} FORCs")
+    return follower
+
+def gen_PMC_FORC_file(path_PMC_header, path_data_file_dir, path_final_PMC_file, avging_time = 0.5, stream = False, chunk_size = 100000, use_cache = False,\
+    average_repeats = True):
+    """Generates a PMC .forc file from single .DAT file from VSM  
+
+    Args:
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from.
+        path_data_file_dir (str): path to the dir storing the single .DAT data file.
+        path_final_PMC_file (str): path and name of the final file. example: "path/NN9_FORCs_PMC_try_6_1.forc"
+        stream (bool): convert the .DAT in chunks with bounded memory. Defaults to False.
+        chunk_size (int): number of .DAT rows parsed at once when streaming. Defaults to 100000.
+        use_cache (bool): memory-map the parsed arrays from the persistent cache, see load_FORC_dataset. Defaults to False.
+        average_repeats (bool): average the repeats of repeated FORCs, see average_FORC_repeats. Streaming converts
+            files with repeats in memory. Defaults to True.
+    """
+    # Getting all files from the dir
+    path_data_file = get_files_from_dir(path_data_file_dir, ".DAT")[0][1]
+    
+    if stream:
+        stream_DAT_to_FORC_file(path_data_file, path_final_PMC_file, file_type = 'PMC', path_PMC_header = path_PMC_header,\
+            avging_time = avging_time, chunk_size = chunk_size, average_repeats = average_repeats)
+        print('Done generating a PMC file from the VSM measurement file!!')
+        return
+    
+    # Importing data as FORCDataset, changing to SI units, repeated FORCs are averaged
+    dataset = load_FORC_dataset(path_data_file, use_cache = use_cache)
+    if average_repeats:
+        with FORC_stage('average_repeats', rows = dataset.n_points):
+            dataset = average_FORC_repeats(dataset)
+    
+    # Exporting the header, the data and the "MicroMag ... ends" line as .forc
+    with FORC_stage('write_PMC', path_final_PMC_file, rows = dataset.n_points) as stage:
+        with open_FORC_file(Path.cwd().joinpath(path_final_PMC_file), "w", encoding='cp1252', buffering=FORC_WRITE_BUFFER) as f:
+            write_FORC_dataset(f, dataset, 'PMC', path_PMC_header, avging_time)
+        stage.bytes_written = _file_size(path_final_PMC_file)
         
     print('Done generating a PMC file from the VSM measurement file!!')
     
 
-def gen_generic_FORC_file_from_PMC_data(path_data_file_dir, path_final_PMC_file, generic_type = 'FORCinel', saturating_field = 500):
+def gen_generic_FORC_file_from_PMC_data(path_data_file_dir, path_final_PMC_file, generic_type = 'FORCinel', saturating_field = 500, stream = False, chunk_size = 100000, use_cache = False,\
+    drift_correction = None, average_repeats = True):
     """Generates a generic forc file from PMC type single .DAT file from VSM  
 
     Args:
         path_PMC_header (str): path to the sample PMC FORC file to steal headers from.
         path_data_file_dir (str): path to the dir storing the single .DAT data file.
         path_final_PMC_file (str): path and name of the final file. example: "path/NN9_FORCs_PMC_try_6_1.forc"
+        stream (bool): convert the .DAT in chunks with bounded memory. Defaults to False.
+        chunk_size (int): number of .DAT rows parsed at once when streaming. Defaults to 100000.
+        use_cache (bool): memory-map the parsed arrays from the persistent cache, see load_FORC_dataset. Defaults to False.
+        drift_correction (dict): arguments of correct_FORC_drift, the saturation points correct the drift of the curves
+            before they are dropped, e.g. {'against': 'time'}. Not applied when streaming. Defaults to None.
+        average_repeats (bool): average the repeats of repeated FORCs, see average_FORC_repeats. Streaming converts
+            files with repeats in memory. Defaults to True.
     """
     # Getting all files from the dir
     path_data_file = get_files_from_dir(path_data_file_dir, ".DAT")[0][1]
     
-    # Importing data
-    data = pd.read_csv(path_data_file, skiprows=30)
+    if stream:
+        stream_DAT_to_FORC_file(path_data_file, path_final_PMC_file, file_type = generic_type,\
+            saturating_field = saturating_field, chunk_size = chunk_size, average_repeats = average_repeats)
+        print(f'Done generating a {generic_type} file from the VSM measurement file!!')
+        return
+    
+    # Importing data as FORCDataset, the START_DATA_FORC rows and saturation points are not part of the branches
+    dataset = load_FORC_dataset(path_data_file, use_cache = use_cache)
+    if drift_correction is not None:
+        with FORC_stage('drift_correction', rows = dataset.n_points):
+            dataset = correct_FORC_drift(dataset, **drift_correction)
+    if average_repeats:
+        with FORC_stage('average_repeats', rows = dataset.n_points):
+            dataset = average_FORC_repeats(dataset)
+    if saturating_field is not None:
+        with FORC_stage('filter_generic', rows = dataset.n_points):
+            dataset = drop_saturating_field(dataset, saturating_field)
     
-    # Delete rows that contain the substring 'de' in the 'col1' column of the dataframe
-    data = delete_rows_with_substring(data, 'Comment', 'START_DATA_FORC')
-    data = delete_rows_with_number(data, 'Magnetic Field (Oe)', saturating_field)
+    if generic_type not in ('FORCinel', 'doFORC'):
+        raise ValueError(f"Unknown generic_type '{generic_type}', use 'FORCinel' or 'doFORC'")
     
-    # Parameters to plot
-    x_param = 'Magnetic Field (Oe)'
-    y_param = 'Moment (emu)'
+    # Exporting the data, FORCinel files end with an "END" line
+    with FORC_stage(f'write_{generic_type}', path_final_PMC_file, rows = dataset.n_points) as stage:
+        with open_FORC_file(Path.cwd().joinpath(path_final_PMC_file), "w", buffering=FORC_WRITE_BUFFER) as f:
+            write_FORC_dataset(f, dataset, generic_type)
+        stage.bytes_written = _file_size(path_final_PMC_file)
+    print(f'Done generating a {generic_type} file from the VSM measurement file!!')
+        
+# Data file parts written by seqns_FORC_measurements_V1 with N_FORCs_per_file, e.g. NN9_FORC_part002.DAT,
+# and data files of resumed runs written by seqns_resume_FORC_measurements, e.g. NN9_FORC_resume.DAT
+DAT_PART_PATTERN = re.compile(r'^(?P<stem>.*)_part(?P<part>\d{3,})$')
+DAT_RESUME_PATTERN = re.compile(r'^(?P<stem>.*)_resume(?P<resume>\d*)$')
+
+def _DAT_part_key(path):
+    # (stem, resume number, part number) of a data file, 0 for the original run and unsplit files
+    stem, part, resume = DAT_file_stem(path), 0, 0
+    match = DAT_PART_PATTERN.match(stem)
+    if match:
+        stem, part = match['stem'], int(match['part'])
+    match = DAT_RESUME_PATTERN.match(stem)
+    if match:
+        stem, resume = match['stem'], int(match['resume'] or 1)
+    return stem, resume, part
+
+def group_DAT_parts(paths_data_files):
+    """Groups the parts of rotated data files and the data files of resumed runs with their original run
+
+    Args:
+        paths_data_files (list): paths to .DAT files.
+
+    Returns:
+        list: (stem, [paths ordered by resume and part number]) per logical dataset
+    """
+    groups = {}
+    for path in paths_data_files:
+        stem, resume, part = _DAT_part_key(path)
+        groups.setdefault((os.path.dirname(path), stem), []).append((resume, part, path))
+    return [(key[1], [path for _, _, path in sorted(parts)]) for key, parts in groups.items()]
+
+def concatenate_FORC_datasets(datasets, name = None):
+    """Concatenates datasets curve by curve in the given order, the metadata is taken from the first one
+
+    Args:
+        datasets (list): FORCDataset objects.
+        name (str): name of the combined dataset. Defaults to the name of the first dataset.
+
+    Returns:
+        FORCDataset: combined dataset
+    """
+    first = datasets[0]
+    def stack_offsets(name_offsets):
+        shifts = np.cumsum([0] + [getattr(dataset, name_offsets)[-1] for dataset in datasets[:-1]])
+        return np.concatenate([[0]] + [getattr(dataset, name_offsets)[1:] + shift for dataset, shift in zip(datasets, shifts)])
+    return first.copy_with(field = np.concatenate([dataset.field for dataset in datasets]),
+                           moment = np.concatenate([dataset.moment for dataset in datasets]),
+                           offsets = stack_offsets('offsets'),
+                           sat_field = np.concatenate([dataset.sat_field for dataset in datasets]),
+                           sat_moment = np.concatenate([dataset.sat_moment for dataset in datasets]),
+                           sat_offsets = stack_offsets('sat_offsets'),
+                           complete = np.concatenate([dataset.complete for dataset in datasets]),
+                           FORC_number = np.concatenate([dataset.FORC_number for dataset in datasets]),
+                           repeat = np.concatenate([dataset.repeat for dataset in datasets]),
+                           time = np.concatenate([dataset.time for dataset in datasets]),
+                           sat_time = np.concatenate([dataset.sat_time for dataset in datasets]),
+                           name = first.name if name is None else name)
+
+def select_FORC_curves(dataset, curves):
+    """Dataset of the given curves in the given order
+
+    Args:
+        dataset (FORCDataset): the dataset.
+        curves (np.ndarray): curve numbers (0 based).
+
+    Returns:
+        FORCDataset: the selected curves
+    """
+    curves = np.asarray(curves, dtype=np.int64)
+    def gather(offsets):
+        lengths = np.diff(offsets)[curves]
+        new_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return np.repeat(offsets[:-1][curves] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1]), new_offsets
+    rows, offsets = gather(dataset.offsets)
+    sat_rows, sat_offsets = gather(dataset.sat_offsets)
+    return dataset.copy_with(field = dataset.field[rows], moment = dataset.moment[rows], time = dataset.time[rows], offsets = offsets,\
+        sat_field = dataset.sat_field[sat_rows], sat_moment = dataset.sat_moment[sat_rows], sat_time = dataset.sat_time[sat_rows],\
+        sat_offsets = sat_offsets, complete = dataset.complete[curves], FORC_number = dataset.FORC_number[curves], repeat = dataset.repeat[curves])
+
+def merge_FORC_datasets(datasets, tolerance = None, name = None):
+    """Merges an aborted run with its resumed runs into one dataset ordered by reversal field
+
+    Curves with the same reversal field (within tolerance) and repeat number are measured once: a complete
+    curve wins over a truncated one, and the later measurement over the earlier one.
+
+    Args:
+        datasets (list): FORCDataset objects in measurement order (original run first).
+        tolerance (float): max Ha difference in Oe of the same FORC. Defaults to None (half the step size).
+        name (str): name of the merged dataset. Defaults to the name of the first dataset.
+
+    Returns:
+        FORCDataset: the merged dataset, curves from the highest to the lowest Ha
+    """
+    combined = concatenate_FORC_datasets(datasets, name = name)
+    if tolerance is None:
+        tolerance = combined.step_size/2 if np.isfinite(combined.step_size) and combined.step_size > 0 else 0.5
+    measured = np.flatnonzero(np.isfinite(combined.Ha))
+    Ha_bin = np.rint(combined.Ha[measured]*10**4/(2*tolerance)).astype(np.int64)
     
-    # # Empty row at the end of each dataset
-    # empty_row = pd.Series([None, None], index=['Field', 'Moment'])
+    # Best curve per (Ha, repeat): sorted by key then priority, the last of every key wins
+    priority = combined.complete[measured].astype(np.int64)*len(combined) + measured
+    order = np.lexsort((priority, combined.repeat[measured], Ha_bin))
+    key = np.stack([Ha_bin, combined.repeat[measured]])[:, order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (key[:, 1:] != key[:, :-1]).any(axis=0)
+    best = measured[order[last]]
+    best = best[np.lexsort((combined.repeat[best], -combined.Ha[best]))]
+    return select_FORC_curves(combined, best)
 
-    # Adding "END" in the last line
-    end_line = pd.Series(['END', np.NAN], index=['Field', 'Moment'])
+def load_FORC_dataset_parts(paths_data_files, n_workers = None, use_cache = True):
+    """Parses the parts of a rotated data file concurrently and stitches them into one dataset
 
-    # Creating the pd.DataFrame
-    df = pd.DataFrame(columns=['Field', 'Moment'])
+    Data files of resumed runs (_resume) are merged with the original run by merge_FORC_datasets.
+
+    Args:
+        paths_data_files (list): paths to the .DAT parts, stitched in the order of their part number.
+        n_workers (int): number of worker processes, 1 parses in this process. Defaults to None (number of cores).
+        use_cache (bool): use the persistent cache of parsed .DAT files. Defaults to True.
 
-    # Changing to SI units
-    x = ((data[x_param]*10**-4).tolist())
-    y = ((data[y_param]*10**-3).tolist())
+    Returns:
+        FORCDataset: the stitched dataset, named after the file name without _partNNN
+    """
+    (stem, paths), *others = group_DAT_parts(paths_data_files)
+    if others:
+        raise ValueError(f"{paths_data_files} are not parts of a single data file")
+    if n_workers == 1 or len(paths) == 1:
+        datasets = [load_FORC_dataset(path, use_cache = use_cache) for path in paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            datasets = list(executor.map(load_FORC_dataset, paths, [use_cache]*len(paths)))
+    if any(_DAT_part_key(path)[1] for path in paths):
+        return merge_FORC_datasets(datasets, name = stem)
+    return concatenate_FORC_datasets(datasets, name = stem)
 
-    # Creating a temp dataframe
-    temp_df = pd.DataFrame(list(zip(x, y)), columns = ['Field', 'Moment'])
+def convert_DAT_file(path_data_file, save_file_dir, formats = ('PMC', 'FORCinel', 'doFORC'), path_PMC_header = None, avging_time = 0.5,\
+    saturating_field = 500, stream = False, chunk_size = 100000, name_suffix = '_1', use_cache = True, average_repeats = True, reject_sigma = None,\
+    decimate = None, SF = None, drift_correction = None, compression = None):
+    """Converts a single .DAT file from VSM to the chosen formats
 
-    # # Appending the data and the last line
-    # df = df.append(temp_df, ignore_index=True)
-    # df = df.append(end_line, ignore_index=True)
+    Args:
+        path_data_file (str or list): path to the .DAT data file, or the paths of the parts of a rotated data file
+            and of the resumed runs.
+        save_file_dir (str): dir to save the converted files in.
+        formats (list): any of 'PMC', 'FORCinel', 'doFORC', 'csv', 'npz' and 'density'. Defaults to PMC, FORCinel and doFORC.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        avging_time (float): Avging time written in the PMC header. Defaults to 0.5 sec.
+        saturating_field (int): rows at this field (Oe) are also dropped from the generic files, None keeps them. Defaults to 500 Oe.
+        stream (bool): convert each format with the bounded-memory streaming converter instead of parsing once. Defaults to False.
+        chunk_size (int): number of .DAT rows parsed at once when streaming. Defaults to 100000.
+        name_suffix (str): added to the .DAT file name for the exported files. Defaults to '_1'.
+        use_cache (bool): memory-map the parsed arrays from the persistent cache, see load_FORC_dataset. Defaults to True.
+        average_repeats (bool): average the repeats of repeated FORCs, streaming converts files with repeats in memory.
+            Defaults to True.
+        reject_sigma (float): outlier rejection of the repeat averaging, see average_FORC_repeats. Defaults to None.
+        decimate (dict): arguments of decimate_FORC_dataset for a decimated copy (not when streaming), e.g. {'factor': 4}. Defaults to None.
+        SF (int): smoothing factor of the 'density' format. Defaults to None (Smoothing of path_PMC_header, else 3).
+        drift_correction (dict): arguments of correct_FORC_drift (not when streaming), e.g. {'against': 'time'}. Defaults to None.
+        compression (str): 'gz', 'bz2', 'xz' or 'zst' to write compressed files, e.g. S23_200K_1.frc.gz. Defaults to None.
+
+    Returns:
+        dict: path of the exported file for each format
+    """
+    os.makedirs(save_file_dir, exist_ok=True)
+    extension_suffix = '' if compression is None else '.' + compression.lstrip('.')
+    if extension_suffix and extension_suffix not in FORC_COMPRESSION_MODULES:
+        raise ValueError(f"Unknown compression '{compression}', use {[suffix[1:] for suffix in FORC_COMPRESSION_MODULES]}")
+    if not isinstance(path_data_file, (str, os.PathLike)):
+        # Parts of a rotated data file are stitched into one dataset
+        path_data_file = load_FORC_dataset_parts(path_data_file, n_workers = 1, use_cache = use_cache)
+        stream = False
+    stem = path_data_file.name if isinstance(path_data_file, FORCDataset) else DAT_file_stem(path_data_file)
+    outputs = {file_type: os.path.join(save_file_dir, stem + name_suffix + FORC_FILE_EXTENSIONS[file_type] + extension_suffix) for file_type in formats}
+    if not stream:
+        # The FORC density runs in this process, batch_convert_DAT_files already converts the files in parallel
+        return export_FORC_files(path_data_file, outputs, path_PMC_header = path_PMC_header, avging_time = avging_time,\
+            saturating_field = saturating_field, use_cache = use_cache, average_repeats = average_repeats, reject_sigma = reject_sigma,\
+            decimate = decimate, SF = SF, n_workers = 1, drift_correction = drift_correction)
+    for file_type, path_final_file in outputs.items():
+        stream_DAT_to_FORC_file(path_data_file, path_final_file, file_type = file_type, path_PMC_header = path_PMC_header,\
+            avging_time = avging_time, saturating_field = saturating_field, chunk_size = chunk_size, average_repeats = average_repeats,\
+            reject_sigma = reject_sigma)
+    return outputs
+
+def _convert_DAT_file_isolated(path_data_file, save_file_dir, kwargs, instrumentation = None):
+    """Runs convert_DAT_file in a worker and returns a result record instead of raising"""
+    start = time.perf_counter()
+    result = {'path': path_data_file, 'ok': True, 'outputs': {}, 'error': None}
+    with contextlib.nullcontext() if instrumentation is None else FORCInstrumentation(**instrumentation) as stages:
+        try:
+            result['outputs'] = convert_DAT_file(path_data_file, save_file_dir, **kwargs)
+        except Exception as error:
+            result['ok'] = False
+            result['error'] = f"{type(error).__name__}: {error}"
+    result['time'] = time.perf_counter() - start
+    if stages is not None:
+        result['stages'] = [record.to_dict() for record in stages.records]
+    return result
+
+def batch_convert_DAT_files(path_data_dir, save_file_dir, formats = ('PMC', 'FORCinel', 'doFORC'), path_PMC_header = None, n_workers = None,\
+    recursive = True, extension = '.DAT', path_report = None, stitch_parts = True, instrumentation = None, **kwargs):
+    """Converts every .DAT file under a directory tree concurrently on a process pool.
+    A failing file does not stop the batch; it is listed in the summary report.
+
+    Args:
+        path_data_dir (str): dir to search for .DAT files.
+        save_file_dir (str): dir to save the converted files in. Sub directories of path_data_dir are kept.
+        formats (list): any of 'PMC', 'FORCinel', 'doFORC', 'csv', 'npz' and 'density'. Defaults to PMC, FORCinel and doFORC.
+        path_PMC_header (str): path to the sample PMC FORC file to steal headers from. Needed for 'PMC'.
+        n_workers (int): number of worker processes, 1 converts in this process. Defaults to None (number of cores).
+        recursive (bool): also search all sub directories. Defaults to True.
+        extension (str): extension of the data files. Defaults to '.DAT'.
+        path_report (str): if given, the summary report is also saved as json. Defaults to None.
+        stitch_parts (bool): convert the _partNNN files of rotated data files and the _resume files of resumed runs
+            as one dataset with their original run. Defaults to True.
+        instrumentation (dict): arguments of FORCInstrumentation (trace_memory, profile, profile_dir) each file is converted
+            with, the stage records are added to the results and their totals to 'stages'. Defaults to None (not measured).
+        **kwargs: passed on to convert_DAT_file (avging_time, saturating_field, stream, chunk_size, name_suffix, use_cache, compression).
+
+    Returns:
+        dict: summary report with 'n_files', 'n_ok', 'n_failed', 'time' and one record per file in 'results'
+    """
+    start = time.perf_counter()
+    kwargs = dict(kwargs, formats = tuple(formats), path_PMC_header = path_PMC_header)
     
-    # # Appending the data and the last line
-    # df = pd.concat([df, temp_df])
-    # df = pd.concat([df, end_line])
+    # Keeping the sub directory structure in the save dir
+    paths_data_files = []
+    for _, path_data_file in get_files_from_dir(path_data_dir, extension, recursive = recursive):
+        # Skipping doFORC files exported by an earlier batch into the searched tree
+        if Path(save_file_dir).resolve() not in Path(path_data_file).resolve().parents:
+            paths_data_files.append(path_data_file)
+    if stitch_parts:
+        groups = [paths[0] if len(paths) == 1 and _DAT_part_key(paths[0])[1:] == (0, 0) else paths\
+            for _, paths in group_DAT_parts(paths_data_files)]
+    else:
+        groups = paths_data_files
+    jobs = []
+    for path_data_file in groups:
+        first_path = path_data_file if isinstance(path_data_file, str) else path_data_file[0]
+        sub_dir = os.path.dirname(os.path.relpath(first_path, path_data_dir))
+        jobs.append((path_data_file, os.path.join(save_file_dir, sub_dir)))
     
-    if generic_type == 'FORCinel':
-        # Appending the data and the last line
-        df = pd.concat([df, temp_df])
-        df = pd.concat([df, end_line])
-        
-        with open(Path.cwd().joinpath(path_final_PMC_file), "w") as f:
-            f.write("\n".join([l.strip(",\n") for l in df.to_csv(index=False, header=None, float_format='%.15f', line_terminator = '\n').split("\n")]))
-            
-        # Removing the empty last line
-        with open(path_final_PMC_file) as f:
-            lines = f.readlines()
-            last = len(lines) - 1
-            lines[last] = lines[last].replace('\r','').replace('\n','')
-        with open(path_final_PMC_file, 'w') as wr:
-            wr.writelines(lines)
-        print('Done generating a FORCinel file from the VSM measurement file!!')
-        
-    elif generic_type == 'doFORC':
-        # Appending the data and the last line
-        df = pd.concat([df, temp_df])
-        
-        with open(Path.cwd().joinpath(path_final_PMC_file), "w") as f:
-            f.write("\n".join([l.strip(",\n") for l in df.to_csv(index=False, header=None, float_format='%.15f', line_terminator = '\n').split("\n")]))
-            
-        # Removing the empty last line
-        with open(path_final_PMC_file) as f:
-            lines = f.readlines()
-            last = len(lines) - 1
-            lines[last] = lines[last].replace('\r','').replace('\n','')
-        with open(path_final_PMC_file, 'w') as wr:
-            wr.writelines(lines)
-        print('Done generating a doFORC file from the VSM measurement file!!')
-        
\ No newline at end of file
+    if n_workers == 1:
+        results = [_convert_DAT_file_isolated(path_data_file, save_dir, kwargs, instrumentation) for path_data_file, save_dir in jobs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_convert_DAT_file_isolated, path_data_file, save_dir, kwargs, instrumentation)\
+                for path_data_file, save_dir in jobs]
+            results = [future.result() for future in futures]
+    
+    report = {'n_files': len(results),
+              'n_ok': sum(result['ok'] for result in results),
+              'n_failed': sum(not result['ok'] for result in results),
+              'time': time.perf_counter() - start,
+              'results': results}
+    if instrumentation is not None:
+        report['stages'] = summarize_FORC_stages(record for result in results for record in result.get('stages', []))
+    if path_report is not None:
+        with open(path_report, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    print(f"Converted {report['n_ok']} of {report['n_files']} .DAT files in {report['time']:.1f} s")
+    for result in results:
+        if not result['ok']:
+            print(f"  FAILED {result['path']}: {result['error']}")
+    for name, total in report.get('stages', {}).items():
+        rows_per_sec = '' if total['rows_per_sec'] is None else f"{total['rows_per_sec']:12.0f} rows/s"
+        print(f"  {name:<22} {total['runs']:5d} runs {total['wall_sec']:9.3f} s {rows_per_sec:>19} {total['peak_bytes']/1024**2:9.1f} MB peak")
+    return report
+
+def FORC_file_info(path_data_file, use_cache = True):
+    """Summary of a .DAT file: header metadata and the FORCs it holds
+
+    Args:
+        path_data_file (str): path to the .DAT data file.
+        use_cache (bool): use the persistent cache of parsed .DAT files. Defaults to True.
+
+    Returns:
+        dict: title, temperature (K), avging time (sec), number of FORCs, completed FORCs, points, repeats,
+            H_sat, step size and reversal field range (Oe) and duration (h, NaN without Time Stamp column)
+    """
+    dataset, metadata = load_FORC_dataset(path_data_file, use_cache = use_cache, return_metadata = True)
+    Ha = dataset.Ha[np.isfinite(dataset.Ha)]*10**4
+    times = np.concatenate([dataset.time, dataset.sat_time])
+    times = times[np.isfinite(times)]
+    return {'path': str(path_data_file),
+            'title': metadata.title,
+            'file_open_time': metadata.file_open_time,
+            'temperature': metadata.temperature,
+            'avging_time': metadata.avging_time,
+            'n_FORCs': len(dataset),
+            'n_complete': int(np.count_nonzero(dataset.complete)),
+            'n_points': dataset.n_points,
+            'n_repeats': int(dataset.repeat.max(initial=0)),
+            'H_sat': dataset.H_sat,
+            'step_size': dataset.step_size,
+            'Ha_max': float(Ha.max()) if len(Ha) else float('nan'),
+            'Ha_min': float(Ha.min()) if len(Ha) else float('nan'),
+            'hours': float(times.max() - times.min())/3600 if len(times) else float('nan')}
+
+if __name__ == '__main__':
+    # The command line lives in FORC_cli, python FORC_functions_RJ.py <command> keeps working
+    from FORC_cli import main
+    sys.exit(main())
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+'''Multi-temperature store of FORC datasets
+    FORCStore keeps the datasets of temperature series in one dir of memory-mapped arrays, build_FORC_store fills it
+    from .DAT files. The .DAT files are read with FORC_functions_RJ.
+'''
+import concurrent.futures
+import time
+import json
+import re
+import os
+
+import numpy as np
+
+import FORC_functions_RJ as FORC
+
+# One raw binary file per array shared by all datasets plus a manifest.json
+FORC_STORE_VERSION = 1
+FORC_STORE_ARRAYS = {'field': 'float64', 'moment': 'float64', 'time': 'float64',               # branch points
+                     'sat_field': 'float64', 'sat_moment': 'float64', 'sat_time': 'float64',   # saturation points
+                     'offsets': 'int64', 'sat_offsets': 'int64', 'complete': 'bool',           # curves, offsets are global
+                     'FORC_number': 'int64', 'repeat': 'int64',
+                     'grid_Ha': 'float64', 'grid_moment': 'float64'}                           # curves on the Hb grid of the store
+# Sample and set temperature in data file names, e.g. S23_200K or S23_200K_FORC
+FORC_STORE_NAME_PATTERN = re.compile(r'^(?P<sample>.+?)_(?P<temperature>\d+(?:\.\d+)?)K(?:_|$)')
+
+def parse_sample_temperature(name):
+    """Sample and temperature of a data file name like S23_200K, (name, None) if it has no temperature"""
+    match = FORC_STORE_NAME_PATTERN.match(name)
+    return (match['sample'], float(match['temperature'])) if match else (name, None)
+
+class FORCStore:
+    """On-disk container of the FORC datasets of temperature series, grouped by sample and temperature
+
+    Every array of all datasets is appended to one raw binary file (field.bin, moment.bin, ...) that is
+    memory-mapped for queries, so a series of 40 temperatures is never loaded into RAM as a whole. The
+    curve offsets are global, the shared segment index of all datasets, and manifest.json keeps the
+    sample, set temperature and the ranges of every dataset in the arrays. Every dataset is also stored
+    regridded (see regrid_FORC_dataset, repeats averaged) onto the Hb grid of the store, one grid for all
+    datasets so the curves compare column by column across temperatures.
+
+        store = FORCStore('S23_store', Hb_step = 1)
+        store.add_DAT_file('S23_200K.DAT')
+        grid = store.grid('S23', 200)   # FORCGrid of memory-mapped views
+
+    Args:
+        path_store (str): dir of the store, created if missing.
+        Hb_step (float): Hb step of the grid in Oe, fixed when the store is created. Defaults to None (step_size of the
+            first dataset added, to 2 significant digits).
+        Hb_range (tuple): (min, max) Hb of the grid in Oe, fixed when the store is created, points outside are not on the
+            grid. Defaults to None (field range of the first dataset added, rounded out to Hb_step).
+    """
+    def __init__(self, path_store, Hb_step = None, Hb_range = None):
+        self.path_store = str(path_store)
+        os.makedirs(self.path_store, exist_ok=True)
+        self._maps = {}
+        self.manifest = self._read_manifest()
+        # The grid is fixed by the first store that sets it, the rest is fixed by the first dataset
+        grid = dict(self.manifest['grid'])
+        if Hb_step is not None:
+            self._check_Hb_step(Hb_step)
+            grid['Hb_step'] = float(Hb_step)
+        if Hb_range is not None:
+            Hb_range = [float(min(Hb_range)), float(max(Hb_range))]
+            if grid['Hb_min'] is not None and Hb_range != [grid['Hb_min'], grid['Hb_max']]:
+                raise ValueError(f"{self.path_store} has a grid of Hb {grid['Hb_min']} to {grid['Hb_max']} Oe, not {Hb_range[0]} to {Hb_range[1]} Oe")
+            grid['Hb_min'], grid['Hb_max'] = Hb_range
+        if grid != self.manifest['grid'] or not os.path.exists(os.path.join(self.path_store, 'manifest.json')):
+            self.manifest['grid'] = grid
+            self._write_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path_store, 'manifest.json')) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {'version': FORC_STORE_VERSION, 'grid': {'Hb_step': None, 'Hb_min': None, 'Hb_max': None},\
+                'lengths': {name: 0 for name in FORC_STORE_ARRAYS}, 'entries': []}
+        if manifest['version'] != FORC_STORE_VERSION:
+            raise ValueError(f"{self.path_store} is a version {manifest['version']} store, expected {FORC_STORE_VERSION}")
+        return manifest
+
+    def _check_Hb_step(self, Hb_step):
+        if self.manifest['grid']['Hb_step'] is not None and float(Hb_step) != self.manifest['grid']['Hb_step']:
+            raise ValueError(f"{self.path_store} has a grid of Hb_step {self.manifest['grid']['Hb_step']} Oe, not {Hb_step} Oe")
+
+    def _fix_grid(self, dataset):
+        # Grid of a new store from its first dataset, a round step on multiples of the step
+        grid = self.manifest['grid']
+        if grid['Hb_step'] is None:
+            step = dataset.step_size if np.isfinite(dataset.step_size) and dataset.step_size > 0 else np.nanmedian(np.abs(np.diff(dataset.field)))*10**4
+            grid['Hb_step'] = float(f'{step:.2g}')
+        if grid['Hb_min'] is None:
+            grid['Hb_min'] = float(np.floor(np.nanmin(dataset.field)*10**4/grid['Hb_step'])*grid['Hb_step'])
+            grid['Hb_max'] = float(np.ceil(np.nanmax(dataset.field)*10**4/grid['Hb_step'])*grid['Hb_step'])
+
+    @property
+    def Hb(self):
+        """Hb grid in T shared by the regridded curves of all datasets"""
+        grid = self.manifest['grid']
+        if grid['Hb_min'] is None:
+            return np.empty(0)
+        first, last = round(grid['Hb_min']/grid['Hb_step']), round(grid['Hb_max']/grid['Hb_step'])
+        return np.arange(first, last + 1)*grid['Hb_step']*10**-4
+
+    def _write_manifest(self):
+        # Replacing the file so a reader never sees half a json
+        path_tmp = os.path.join(self.path_store, f'manifest.json.{os.getpid()}.tmp')
+        with open(path_tmp, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(path_tmp, os.path.join(self.path_store, 'manifest.json'))
+
+    def __len__(self):
+        return len(self.manifest['entries'])
+
+    def __repr__(self):
+        return f"FORCStore(path_store={self.path_store!r}, samples={self.samples()}, datasets={len(self)})"
+
+    @property
+    def entries(self):
+        """Manifest record of every dataset"""
+        return list(self.manifest['entries'])
+
+    @property
+    def nbytes(self):
+        """Size of the arrays on disk in bytes"""
+        return sum(self.manifest['lengths'][name]*np.dtype(dtype).itemsize for name, dtype in FORC_STORE_ARRAYS.items())
+
+    def samples(self):
+        """Names of the samples in the store"""
+        return sorted({entry['sample'] for entry in self.manifest['entries']})
+
+    def temperatures(self, sample):
+        """Sorted temperatures in K of the datasets of a sample"""
+        return sorted(entry['temperature'] for entry in self.manifest['entries'] if entry['sample'] == sample)
+
+    def array(self, name):
+        """Memory-mapped (read only) array of all datasets, e.g. array('field')"""
+        length = self.manifest['lengths'][name]
+        if self._maps.get(name, (None, -1))[1] != length:
+            if length:
+                values = np.memmap(os.path.join(self.path_store, name + '.bin'), dtype=FORC_STORE_ARRAYS[name], mode='r', shape=(length,))
+            else:
+                values = np.empty(0, dtype=FORC_STORE_ARRAYS[name])
+            self._maps[name] = (values, length)
+        return self._maps[name][0]
+
+    def find(self, sample, temperature, tolerance = 1):
+        """Manifest record of the dataset of a sample nearest to a temperature
+
+        Args:
+            sample (str): sample name.
+            temperature (float): temperature in K.
+            tolerance (float): max distance in K to the stored temperature. Defaults to 1 K.
+
+        Returns:
+            dict: the manifest record
+        """
+        candidates = [entry for entry in self.manifest['entries'] if entry['sample'] == sample]
+        if candidates:
+            entry = min(candidates, key=lambda entry: abs(entry['temperature'] - temperature))
+            if abs(entry['temperature'] - temperature) <= tolerance:
+                return entry
+        raise KeyError(f"No dataset of {sample!r} within {tolerance} K of {temperature} K in {self.path_store}")
+
+    def add(self, dataset, sample = None, temperature = None, Hb_step = None, source = None, replace = False):
+        """Appends a dataset and its regridded curves to the store
+
+        Args:
+            dataset (FORCDataset): the dataset.
+            sample (str): sample name. Defaults to None (from the dataset name, e.g. S23 for S23_200K).
+            temperature (float): set temperature in K. Defaults to None (from the dataset name, else the measured
+                temperature of the dataset to the nearest K).
+            Hb_step (float): Hb step in Oe, raises a ValueError if the grid of the store has another step. Defaults to None.
+            source (str): path of the data file, kept in the manifest. Defaults to None.
+            replace (bool): replace a dataset of the same sample and temperature, its space is not reclaimed. Defaults to False.
+
+        Returns:
+            dict: manifest record of the dataset
+        """
+        name_sample, name_temperature = parse_sample_temperature(dataset.name)
+        sample = name_sample if sample is None else sample
+        if temperature is None:
+            # The set temperature of seqns_set_temp, the measured one drifts around it
+            temperature = name_temperature if name_temperature is not None or not np.isfinite(dataset.temperature) else round(dataset.temperature)
+        if temperature is None:
+            raise ValueError(f"No temperature for {dataset.name!r}, pass temperature")
+        temperature = round(float(temperature), 2)
+        duplicates = [entry for entry in self.manifest['entries'] if entry['sample'] == sample and abs(entry['temperature'] - temperature) < 0.01]
+        if duplicates and not replace:
+            raise ValueError(f"{sample!r} at {temperature} K is already in {self.path_store}, pass replace = True")
+        if Hb_step is not None:
+            self._check_Hb_step(Hb_step)
+            self.manifest['grid']['Hb_step'] = float(Hb_step)
+        self._fix_grid(dataset)
+        
+        # Offsets are stored global, they index the shared arrays directly
+        lengths = self.manifest['lengths']
+        grid = FORC.regrid_FORC_dataset(FORC.average_FORC_repeats(dataset), Hb = self.Hb)
+        arrays = {'field': dataset.field, 'moment': dataset.moment, 'time': dataset.time,
+                  'sat_field': dataset.sat_field, 'sat_moment': dataset.sat_moment, 'sat_time': dataset.sat_time,
+                  'offsets': dataset.offsets[:-1] + lengths['field'], 'sat_offsets': dataset.sat_offsets[:-1] + lengths['sat_field'],
+                  'complete': dataset.complete, 'FORC_number': dataset.FORC_number, 'repeat': dataset.repeat,
+                  'grid_Ha': grid.Ha, 'grid_moment': grid.moment.ravel()}
+        entry = {'sample': sample, 'temperature': temperature, 'name': dataset.name, 'source': None if source is None else str(source),
+                 'H_sat': dataset.H_sat, 'step_size': dataset.step_size, 'avging_time': dataset.avging_time, 'measured_temperature': dataset.temperature,
+                 'added': time.time()}
+        entry['ranges'] = {name: [lengths[name], lengths[name] + len(values)] for name, values in arrays.items()}
+        
+        # Cutting off what an interrupted add wrote past the manifest, then appending
+        self._maps.clear()
+        for name, values in arrays.items():
+            path_array = os.path.join(self.path_store, name + '.bin')
+            with open(path_array, 'ab') as f:
+                f.truncate(lengths[name]*np.dtype(FORC_STORE_ARRAYS[name]).itemsize)
+                f.write(np.ascontiguousarray(values, dtype=FORC_STORE_ARRAYS[name]).tobytes())
+        for name, values in arrays.items():
+            lengths[name] += len(values)
+        self.manifest['entries'] = [entry for entry in self.manifest['entries'] if not any(entry is duplicate for duplicate in duplicates)] + [entry]
+        self.manifest['entries'].sort(key=lambda entry: (entry['sample'], entry['temperature']))
+        self._write_manifest()
+        return entry
+
+    def add_DAT_file(self, path_data_file, sample = None, temperature = None, Hb_step = None, use_cache = True, replace = False):
+        """Parses a .DAT file (or the parts of a rotated data file) and appends it, see add
+
+        Returns:
+            dict: manifest record of the dataset
+        """
+        if isinstance(path_data_file, (str, os.PathLike)):
+            dataset = FORC.load_FORC_dataset(path_data_file, use_cache = use_cache)
+            source = path_data_file
+        else:
+            dataset = FORC.load_FORC_dataset_parts(path_data_file, n_workers = 1, use_cache = use_cache)
+            source = path_data_file[0]
+        return self.add(dataset, sample = sample, temperature = temperature, Hb_step = Hb_step, source = source, replace = replace)
+
+    def _entry(self, sample, temperature, tolerance):
+        return sample if isinstance(sample, dict) else self.find(sample, temperature, tolerance)
+
+    def dataset(self, sample, temperature = None, tolerance = 1):
+        """Dataset of a sample at a temperature, the point arrays are views of the memory-mapped store
+
+        Args:
+            sample (str or dict): sample name, or a manifest record.
+            temperature (float): temperature in K. Defaults to None (for a manifest record).
+            tolerance (float): max distance in K to the stored temperature. Defaults to 1 K.
+
+        Returns:
+            FORCDataset: the dataset
+        """
+        entry = self._entry(sample, temperature, tolerance)
+        ranges = entry['ranges']
+        view = lambda name: self.array(name)[ranges[name][0]:ranges[name][1]]
+        point_start, point_stop = ranges['field']
+        sat_start, sat_stop = ranges['sat_field']
+        return FORC.FORCDataset(view('field'), view('moment'), np.append(view('offsets'), point_stop) - point_start,\
+            view('sat_field'), view('sat_moment'), np.append(view('sat_offsets'), sat_stop) - sat_start, complete = view('complete'),\
+            FORC_number = view('FORC_number'), repeat = view('repeat'), time = view('time'), sat_time = view('sat_time'),\
+            temperature = entry['measured_temperature'], avging_time = entry['avging_time'], H_sat = entry['H_sat'],\
+            step_size = entry['step_size'], name = entry['name'])
+
+    def curve(self, sample, temperature, k, tolerance = 1):
+        """Field and moment views of the branch of curve k of a sample at a temperature"""
+        entry = self._entry(sample, temperature, tolerance)
+        curve_start = entry['ranges']['offsets'][0]
+        if not 0 <= k < entry['ranges']['offsets'][1] - curve_start:
+            raise IndexError(f"Curve {k} out of range of {entry['name']!r}")
+        start = self.array('offsets')[curve_start + k]
+        stop = self.array('offsets')[curve_start + k + 1] if curve_start + k + 1 < entry['ranges']['offsets'][1] else entry['ranges']['field'][1]
+        return self.array('field')[start:stop], self.array('moment')[start:stop]
+
+    def grid(self, sample, temperature = None, tolerance = 1):
+        """Regridded curves of a sample at a temperature, the moment matrix is a view of the memory-mapped store
+
+        Returns:
+            FORCGrid: Ha, the Hb grid of the store and the (len(Ha), len(Hb)) moment matrix
+        """
+        entry = self._entry(sample, temperature, tolerance)
+        ranges = entry['ranges']
+        Ha = self.array('grid_Ha')[ranges['grid_Ha'][0]:ranges['grid_Ha'][1]]
+        Hb = self.Hb
+        moment = self.array('grid_moment')[ranges['grid_moment'][0]:ranges['grid_moment'][1]].reshape(len(Ha), len(Hb))
+        return FORC.FORCGrid(Ha, Hb, moment)
+
+    def series(self, sample, T_min = None, T_max = None, grids = False):
+        """Iterates over the datasets (or regridded curves) of a sample in temperature order, one at a time
+
+        Args:
+            sample (str): sample name.
+            T_min, T_max (float): temperature range in K. Default to None (all).
+            grids (bool): yield FORCGrid instead of FORCDataset. Defaults to False.
+
+        Yields:
+            tuple: (temperature, FORCDataset or FORCGrid)
+        """
+        for entry in self.manifest['entries']:
+            if entry['sample'] != sample or (T_min is not None and entry['temperature'] < T_min) or (T_max is not None and entry['temperature'] > T_max):
+                continue
+            yield entry['temperature'], (self.grid(entry) if grids else self.dataset(entry))
+
+def build_FORC_store(path_store, paths_data_files, Hb_step = None, Hb_range = None, use_cache = True, n_workers = None, replace = False):
+    """Adds .DAT files of temperature series to a FORCStore, parsing them concurrently
+
+    Args:
+        path_store (str): dir of the store, created if missing.
+        paths_data_files (str or list): dir searched recursively for .DAT files, or paths of .DAT files. Parts of rotated
+            data files and resumed runs are added as one dataset.
+        Hb_step (float): Hb step of the grid of the store in Oe, see FORCStore. Defaults to None (fixed by the first dataset).
+        Hb_range (tuple): (min, max) Hb of the grid in Oe, see FORCStore. Defaults to None (fixed by the first dataset).
+        use_cache (bool): use the persistent cache of parsed .DAT files. Defaults to True.
+        n_workers (int): worker processes parsing the files, 1 parses in this process. Defaults to None (number of cores).
+        replace (bool): replace datasets of the same sample and temperature. Defaults to False.
+
+    Returns:
+        FORCStore: the store
+    """
+    if isinstance(paths_data_files, (str, os.PathLike)) and os.path.isdir(paths_data_files):
+        paths_data_files = [path for _, path in FORC.get_files_from_dir(paths_data_files, '.DAT', recursive = True)]
+    elif isinstance(paths_data_files, (str, os.PathLike)):
+        paths_data_files = [paths_data_files]
+    groups = [paths for _, paths in FORC.group_DAT_parts(paths_data_files)]
+    store = FORCStore(path_store, Hb_step = Hb_step, Hb_range = Hb_range)
+    if n_workers == 1 or len(groups) == 1:
+        datasets = [FORC.load_FORC_dataset_parts(paths, n_workers = 1, use_cache = use_cache) for paths in groups]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+            datasets = list(executor.map(FORC.load_FORC_dataset_parts, groups, [1]*len(groups), [use_cache]*len(groups)))
+    for paths, dataset in zip(groups, datasets):
+        entry = store.add(dataset, source = paths[0], replace = replace)
+        print(f"Added {entry['sample']} at {entry['temperature']} K from {paths[0]}")
+    return store
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+'''Fixtures of the FORC_functions_RJ tests
+    data/ holds small .DAT files in the VersaLab export format, data/expected/ the files the original
+    pandas converters (gen_PMC_FORC_file, gen_generic_FORC_file_from_PMC_data) wrote for them
+'''
+from pathlib import Path
+import shutil
+
+import pytest
+
+import FORC_functions_RJ as FORC
+
+DATA_DIR = Path(__file__).parent/'data'
+PATH_PMC_HEADER = Path(__file__).resolve().parents[1]/'cube24.txt'
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Every test gets its own persistent cache, nothing is written to ~/.cache"""
+    path_cache = tmp_path/'cache'
+    monkeypatch.setattr(FORC, 'FORC_CACHE_DIR', str(path_cache))
+    return path_cache
+
+@pytest.fixture
+def copy_DAT(tmp_path):
+    """Copies a fixture .DAT file alone into a new dir (the gen_* converters take the dir), returns the path"""
+    def copy(name, dir_name = None, file_name = None):
+        data_dir = tmp_path/(dir_name or Path(name).stem)
+        data_dir.mkdir(exist_ok=True)
+        return Path(shutil.copy(DATA_DIR/name, data_dir/(file_name or name)))
+    return copy
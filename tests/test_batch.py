@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+'''Batch conversion of a directory tree on a process pool'''
+import json
+import shutil
+
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+@pytest.fixture
+def data_tree(tmp_path):
+    """data/sweep_Hsat500.DAT, data/run2/aborted.DAT, data/run2/old/broken.DAT (no [Data] section)"""
+    data_dir = tmp_path/'data'
+    (data_dir/'run2'/'old').mkdir(parents=True)
+    shutil.copy(DATA_DIR/'sweep_Hsat500.DAT', data_dir)
+    shutil.copy(DATA_DIR/'aborted.DAT', data_dir/'run2')
+    (data_dir/'run2'/'old'/'broken.DAT').write_text('[Header]\nTITLE,broken\n')
+    return data_dir
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_batch_keeps_the_tree_and_reports_failures(data_tree, tmp_path, n_workers):
+    report = FORC.batch_convert_DAT_files(data_tree, tmp_path/'out', path_PMC_header = PATH_PMC_HEADER, n_workers = n_workers,\
+        path_report = tmp_path/'report.json')
+    assert (report['n_files'], report['n_ok'], report['n_failed']) == (3, 2, 1)
+    failed = [result for result in report['results'] if not result['ok']]
+    assert failed[0]['path'].endswith('broken.DAT') and failed[0]['error'].startswith('ValueError')
+    assert json.loads((tmp_path/'report.json').read_text())['n_failed'] == 1
+    # Same bytes as converting the files one by one
+    for name, sub_dir in (('sweep_Hsat500', ''), ('aborted', 'run2')):
+        assert (tmp_path/'out'/sub_dir/f'{name}_1.frc').read_bytes() == (DATA_DIR/'expected'/f'{name}.frc').read_bytes()
+        assert (tmp_path/'out'/sub_dir/f'{name}_1.forc').read_bytes() == (DATA_DIR/'expected'/f'{name}.forc').read_bytes()
+    assert not any((tmp_path/'out'/'run2'/'old').iterdir())
+
+def test_batch_skips_its_own_doFORC_files(data_tree):
+    # doFORC files have the .DAT extension, a save dir inside the data dir must not be converted again
+    save_dir = data_tree/'converted'
+    first = FORC.batch_convert_DAT_files(data_tree, save_dir, formats = ['doFORC'], n_workers = 1)
+    second = FORC.batch_convert_DAT_files(data_tree, save_dir, formats = ['doFORC'], n_workers = 1)
+    assert first['n_files'] == second['n_files'] == 3
+    assert (save_dir/'sweep_Hsat500_1.DAT').read_bytes() == (DATA_DIR/'expected'/'sweep_Hsat500_doFORC.txt').read_bytes()
+
+def test_batch_without_recursion_only_converts_the_top_dir(data_tree, tmp_path):
+    report = FORC.batch_convert_DAT_files(data_tree, tmp_path/'out', formats = ['FORCinel'], n_workers = 1, recursive = False)
+    assert [result['path'] for result in report['results']] == [str(data_tree/'sweep_Hsat500.DAT')]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+'''Persistent cache of parsed .DAT files, conftest points FORC_CACHE_DIR to a fresh dir for every test'''
+import logging
+import os
+
+import numpy as np
+
+import FORC_functions_RJ as FORC
+
+def load(path_DAT, **kwargs):
+    """Loads a dataset, returns it and whether it came from the cache (load_cache stage) instead of being parsed"""
+    with FORC.FORCInstrumentation() as instrumentation:
+        dataset = FORC.load_FORC_dataset(path_DAT, **kwargs)
+    stages = [record.name for record in instrumentation.records]
+    assert ('load_cache' in stages) != ('read_csv' in stages), stages
+    return dataset, 'load_cache' in stages
+
+def assert_same_dataset(dataset, expected):
+    for name in FORC.FORC_CACHE_ARRAYS:
+        np.testing.assert_array_equal(getattr(dataset, name), getattr(expected, name), err_msg=name)
+
+def test_second_load_is_a_cache_hit(copy_DAT, cache_dir):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    parsed, hit = load(path_DAT)
+    assert not hit
+    assert [entry['path'] for entry in FORC.inspect_FORC_cache()] == [str(path_DAT)]
+    cached, hit = load(path_DAT)
+    assert hit
+    assert_same_dataset(cached, parsed)
+    assert cached.H_sat == parsed.H_sat and cached.name == parsed.name
+
+def test_size_change_invalidates_the_entry(copy_DAT):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    before = FORC.load_FORC_dataset(path_DAT)
+    # The run went on, the start of one more FORC was appended
+    with open(path_DAT, 'a') as f:
+        f.write(',3700009990.00,300.0,500,1.0E-03,1.0E-07,1,1,39.7,2\n'
+                'START_DATA_FORC,3700009991.00,,,,,,,,\n'
+                ',3700009992.00,300.0,-300,-1.0E-03,1.0E-07,1,1,39.7,2\n')
+    after, hit = load(path_DAT)
+    assert not hit
+    # Its saturation point and reversal point
+    assert (len(after), after.n_points) == (len(before) + 1, before.n_points + 2)
+    assert_same_dataset(after, FORC.load_FORC_dataset(path_DAT, use_cache = False))
+    assert load(path_DAT)[1]
+
+def test_mtime_change_with_the_same_content_stays_a_hit(copy_DAT):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    FORC.load_FORC_dataset(path_DAT)
+    stat = os.stat(path_DAT)
+    os.utime(path_DAT, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load(path_DAT)[1]
+    assert FORC.inspect_FORC_cache()[0]['valid']
+
+def test_mtime_change_with_new_content_invalidates_the_entry(copy_DAT):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    before = FORC.load_FORC_dataset(path_DAT)
+    # Same size, one digit of the last moment changed
+    text = path_DAT.read_text()
+    last_moment = text.rstrip('\n').split('\n')[-2].split(',')[4]
+    changed = last_moment[:-1] + ('1' if last_moment[-1] != '1' else '2')
+    path_DAT.write_text(text[::-1].replace(last_moment[::-1], changed[::-1], 1)[::-1])
+    after, hit = load(path_DAT)
+    assert not hit
+    assert not np.array_equal(after.moment, before.moment)
+    assert_same_dataset(after, FORC.load_FORC_dataset(path_DAT, use_cache = False))
+
+def test_unwritable_cache_parses_the_file(copy_DAT, tmp_path, caplog):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    # A file where the cache dir should be, makedirs fails like on a read-only mount
+    (tmp_path/'not_a_dir').write_text('')
+    with caplog.at_level(logging.WARNING, logger='FORC_functions_RJ'):
+        dataset = FORC.load_FORC_dataset(path_DAT, cache_dir = str(tmp_path/'not_a_dir'/'cache'))
+    assert 'Could not cache' in caplog.text
+    assert_same_dataset(dataset, FORC.load_FORC_dataset(path_DAT, use_cache = False))
+
+def test_read_only_entry_is_still_used(copy_DAT, monkeypatch, caplog):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    FORC.load_FORC_dataset(path_DAT)
+    def read_only(entry_dir, meta):
+        raise PermissionError(13, 'Permission denied', entry_dir)
+    monkeypatch.setattr(FORC, '_write_cache_meta', read_only)
+    with caplog.at_level(logging.WARNING, logger='FORC_functions_RJ'):
+        assert load(path_DAT)[1]
+    assert 'Could not update' in caplog.text
+
+def test_original_converters_do_not_use_the_cache(copy_DAT, cache_dir, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, tmp_path/'out.frc')
+    assert not cache_dir.exists()
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, tmp_path/'out.frc', use_cache = True)
+    assert len(FORC.inspect_FORC_cache()) == 1
+
+def test_eviction_keeps_the_recently_used_entries(copy_DAT):
+    paths = [copy_DAT(name) for name in ('sweep_Hsat500.DAT', 'sweep_Hsat1000.DAT', 'aborted.DAT')]
+    for path in paths:
+        FORC.load_FORC_dataset(path)
+    FORC.load_FORC_dataset(paths[0])
+    entry_bytes = max(entry['bytes'] for entry in FORC.inspect_FORC_cache())
+    assert FORC.evict_FORC_cache(max_bytes = 2*entry_bytes) >= 1
+    assert FORC.inspect_FORC_cache()[0]['path'] == str(paths[0])
+    n_entries = len(FORC.inspect_FORC_cache())
+    assert FORC.clear_FORC_cache() == n_entries
+    assert FORC.inspect_FORC_cache() == []
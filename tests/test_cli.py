@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+'''Subcommands of the forc command line and their exit codes'''
+import json
+import subprocess
+import sys
+
+import pytest
+
+import FORC_cli
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+def test_seq_writes_the_sequence(tmp_path, capsys):
+    assert FORC_cli.main(['seq', str(tmp_path/'FORC.seq'), '--data-dir', 'C:\\Data', '--N-FORCs', '5', '--step-size', '2', '--estimate']) == 0
+    assert (tmp_path/'FORC.seq').read_text().count('VSMMH') == 4
+    assert 'Estimated' in capsys.readouterr().out.splitlines()[-1]
+
+def test_convert_exit_codes(copy_DAT, tmp_path, capsys):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    assert FORC_cli.main(['convert', str(path_DAT), '--save-dir', str(tmp_path/'out'), '--pmc-header', str(PATH_PMC_HEADER)]) == 0
+    assert sorted(path.name for path in (tmp_path/'out').iterdir()) == ['sweep_Hsat500_1.DAT', 'sweep_Hsat500_1.forc', 'sweep_Hsat500_1.frc']
+    # A missing file is reported and gives exit code 1, the other file is still converted
+    argv = ['convert', str(tmp_path/'missing.DAT'), str(path_DAT), '--save-dir', str(tmp_path/'out2'), '--formats', 'FORCinel']
+    assert FORC_cli.main(argv) == 1
+    assert 'FAILED' in capsys.readouterr().out
+    assert (tmp_path/'out2'/'sweep_Hsat500_1.frc').exists()
+
+def test_batch_exit_codes(copy_DAT, tmp_path):
+    copy_DAT('sweep_Hsat500.DAT', dir_name = 'data')
+    copy_DAT('aborted.DAT', dir_name = 'data')
+    argv = ['batch', str(tmp_path/'data'), str(tmp_path/'out'), '--formats', 'FORCinel', '--workers', '1', '--report', str(tmp_path/'report.json')]
+    assert FORC_cli.main(argv) == 0
+    assert json.loads((tmp_path/'report.json').read_text())['n_failed'] == 0
+    (tmp_path/'data'/'broken.DAT').write_text('not a data file\n')
+    assert FORC_cli.main(argv) == 1
+
+def test_info_prints_one_json_record_per_file(copy_DAT, capsys):
+    argv = ['info', str(copy_DAT('sweep_Hsat500.DAT')), str(copy_DAT('aborted.DAT')), '--json']
+    assert FORC_cli.main(argv) == 0
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(record['n_FORCs'], record['n_complete']) for record in records] == [(9, 9), (9, 7)]
+
+def test_estimate_and_cache(tmp_path, copy_DAT, capsys):
+    FORC_cli.main(['seq', str(tmp_path/'FORC.seq'), '--data-dir', 'C:\\Data', '--N-FORCs', '5'])
+    assert FORC_cli.main(['estimate', str(tmp_path/'FORC.seq'), '--per-FORC']) == 0
+    assert 'FORC_004' in capsys.readouterr().out
+    FORC.load_FORC_dataset(copy_DAT('sweep_Hsat500.DAT'))
+    assert FORC_cli.main(['cache', 'info']) == 0
+    assert '1 entries' in capsys.readouterr().out
+    assert FORC_cli.main(['cache', 'clear']) == 0
+    assert FORC.inspect_FORC_cache() == []
+
+def test_store_add_and_info(copy_DAT, tmp_path, capsys):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT', file_name = 'S1_200K.DAT')
+    assert FORC_cli.main(['store', 'add', str(tmp_path/'store'), str(path_DAT.parent), '--Hb-step', '20', '--workers', '1']) == 0
+    assert 'Added S1 at 200.0 K' in capsys.readouterr().out
+    assert FORC_cli.main(['store', 'info', str(tmp_path/'store')]) == 0
+    assert capsys.readouterr().out.startswith('S1 ')
+
+def test_usage_errors_exit_with_2(capsys):
+    for argv in ([], ['convert'], ['unknown'], ['seq', 'FORC.seq']):
+        with pytest.raises(SystemExit) as error:
+            FORC_cli.main(argv)
+        assert error.value.code == 2
+
+def test_module_runs_the_command_line(tmp_path):
+    # python FORC_functions_RJ.py <command> delegates to FORC_cli without importing NumPy or pandas for --help
+    code = "import runpy, sys; sys.argv = ['FORC_functions_RJ.py', '--help']\n"\
+        "try:\n    runpy.run_path(sys.argv[0], run_name='__main__')\nexcept SystemExit as error:\n    print(error.code, 'numpy' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], cwd = DATA_DIR.parents[1], capture_output = True, text = True)
+    assert result.stdout.split()[-2:] == ['0', 'False']
+    assert 'usage: forc' in result.stdout
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''Compressed data and exported files, streamed through the codec picked from the file extension'''
+import bz2
+import gzip
+import importlib.util
+import lzma
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+CODECS = {'gz': gzip, 'bz2': bz2, 'xz': lzma}
+MAGIC = {'gz': b'\x1f\x8b', 'bz2': b'BZh', 'xz': b'\xfd7zXZ\x00'}
+EXPECTED = {'PMC': '{}.forc', 'FORCinel': '{}.frc', 'doFORC': '{}_doFORC.txt'}
+
+def compressed_copy(path, data_dir, compression):
+    data_dir.mkdir(exist_ok=True)
+    path_compressed = data_dir/(path.name + '.' + compression)
+    path_compressed.write_bytes(CODECS[compression].compress(path.read_bytes()))
+    return path_compressed
+
+def test_suffixes():
+    assert FORC.FORC_compression('S23_200K.DAT.GZ') == '.gz'
+    assert FORC.FORC_compression('S23_200K.DAT') is None
+    assert FORC.strip_compression_suffix('out/S23_200K_1.frc.xz') == 'out/S23_200K_1.frc'
+    assert FORC.DAT_file_stem('data/S23_200K.DAT.bz2') == 'S23_200K'
+
+@pytest.mark.parametrize('compression', list(CODECS))
+def test_text_round_trip(compression, tmp_path):
+    path = tmp_path/f'file.txt.{compression}'
+    text = 'Field,Moment\n' + ''.join(f'{idx},{idx*1e-7:.6E}\n' for idx in range(1000))
+    with FORC.open_FORC_file(path, 'w') as f:
+        f.write(text)
+    assert path.read_bytes().startswith(MAGIC[compression])
+    with FORC.open_FORC_file(path, 'r') as f:
+        assert f.read() == text
+    assert CODECS[compression].decompress(path.read_bytes()).decode() == text
+
+@pytest.mark.parametrize('compression', list(CODECS))
+def test_compressed_DAT_reads_the_same_dataset(compression, tmp_path):
+    plain = FORC.load_FORC_dataset(DATA_DIR/'aborted.DAT', use_cache = False)
+    dataset = FORC.load_FORC_dataset(compressed_copy(DATA_DIR/'aborted.DAT', tmp_path/'data', compression), use_cache = False)
+    assert dataset.name == 'aborted'
+    for name in FORC.FORC_CACHE_ARRAYS:
+        np.testing.assert_array_equal(getattr(dataset, name), getattr(plain, name), err_msg=name)
+    path_compressed = tmp_path/'data'/f'aborted.DAT.{compression}'
+    assert FORC.import_first_n_lines(path_compressed, 3) == FORC.import_first_n_lines(DATA_DIR/'aborted.DAT', 3)
+
+@pytest.mark.parametrize('stream', [False, True], ids=['in_memory', 'stream'])
+def test_gen_functions_read_compressed_DAT(stream, tmp_path):
+    data_dir = tmp_path/'data'
+    compressed_copy(DATA_DIR/'sweep_Hsat500.DAT', data_dir, 'xz')
+    # Compressed outputs decompress to the files of the original converters
+    FORC.gen_PMC_FORC_file(PATH_PMC_HEADER, data_dir, tmp_path/'out.forc.gz', stream = stream, chunk_size = 37)
+    FORC.gen_generic_FORC_file_from_PMC_data(data_dir, tmp_path/'out.frc.bz2', 'FORCinel', stream = stream, chunk_size = 37)
+    expected = DATA_DIR/'expected'
+    assert gzip.decompress((tmp_path/'out.forc.gz').read_bytes()) == (expected/'sweep_Hsat500.forc').read_bytes()
+    assert bz2.decompress((tmp_path/'out.frc.bz2').read_bytes()) == (expected/'sweep_Hsat500.frc').read_bytes()
+
+@pytest.mark.parametrize('stream', [False, True], ids=['single_parse', 'stream'])
+def test_convert_DAT_file_writes_compressed_outputs(stream, copy_DAT, tmp_path):
+    outputs = FORC.convert_DAT_file(copy_DAT('aborted.DAT'), tmp_path/'out', path_PMC_header = PATH_PMC_HEADER, stream = stream,\
+        compression = 'gz')
+    for file_type, path_output in outputs.items():
+        assert str(path_output).endswith('.gz')
+        expected = (DATA_DIR/'expected'/EXPECTED[file_type].format('aborted')).read_bytes()
+        assert gzip.decompress(Path(path_output).read_bytes()) == expected, file_type
+
+def test_unknown_compression(copy_DAT, tmp_path):
+    with pytest.raises(ValueError, match='Unknown compression'):
+        FORC.convert_DAT_file(copy_DAT('aborted.DAT'), tmp_path/'out', compression = 'zip')
+
+def test_compressed_npz(tmp_path):
+    path = tmp_path/'arrays.npz.xz'
+    FORC.save_npz(path, field = np.arange(5.0), FORC = np.arange(5))
+    # np.savez would have written arrays.npz.xz.npz
+    assert [file.name for file in tmp_path.iterdir()] == ['arrays.npz.xz']
+    with FORC.open_FORC_file(path, 'rb') as f:
+        arrays = np.load(f)
+        np.testing.assert_array_equal(arrays['field'], np.arange(5.0))
+
+def test_get_files_from_dir_finds_compressed_files(tmp_path):
+    for name in ('a.DAT', 'b.DAT.gz', 'c.DAT.xz', 'd.txt.gz'):
+        (tmp_path/name).write_bytes(b'')
+    assert sorted(name for name, _ in FORC.get_files_from_dir(tmp_path, '.DAT')) == ['a.DAT', 'b.DAT.gz', 'c.DAT.xz']
+    assert [name for name, _ in FORC.get_files_from_dir(tmp_path, '.DAT', compressed = False)] == ['a.DAT']
+
+@pytest.mark.skipif(importlib.util.find_spec('zstandard') is not None, reason='zstandard is installed')
+def test_zst_needs_zstandard(tmp_path):
+    with pytest.raises(ImportError, match='zstandard'):
+        FORC.open_FORC_file(tmp_path/'S23_200K.DAT.zst', 'w')
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''Ragged-array FORCDataset built from the .DAT files'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+def curves_from_comments(name):
+    """Branches and saturation points in SI units, walking the rows of the file one by one"""
+    data, _ = FORC.read_DAT_FORC_columns(DATA_DIR/name)
+    curves, sats, sat, branch = [], [], [], None
+    for comment, field, moment in zip(data['Comment'].fillna(''), data['Magnetic Field (Oe)'], data['Moment (emu)']):
+        if 'START' in comment.upper():
+            if branch is not None:
+                curves.append(branch)
+            sats.append(sat)
+            branch, sat = [], []
+        elif 'END' in comment.upper():
+            curves.append(branch)
+            branch = None
+        elif branch is not None:
+            branch.append((field*1e-4, moment*1e-3))
+        else:
+            sat.append((field*1e-4, moment*1e-3))
+    if branch is not None:
+        curves.append(branch)
+    return curves, sats
+
+@pytest.mark.parametrize('name', ['sweep_Hsat500.DAT', 'long_header.DAT'])
+def test_curves_match_the_rows_of_the_file(name):
+    dataset = FORC.FORCDataset.from_DAT_file(DATA_DIR/name)
+    curves, sats = curves_from_comments(name)
+    assert len(dataset) == dataset.n_curves == len(curves)
+    for k, (curve, sat) in enumerate(zip(curves, sats)):
+        np.testing.assert_allclose(np.column_stack(dataset.curve(k)), np.array(curve), rtol=1e-15)
+        np.testing.assert_allclose(np.column_stack(dataset.sat(k)), np.array(sat), rtol=1e-15)
+    assert dataset.n_points == sum(map(len, curves)) + sum(map(len, sats))
+    np.testing.assert_array_equal(dataset.curve_lengths, [len(curve) for curve in curves])
+    np.testing.assert_array_equal(dataset.Ha, [curve[0][0] for curve in curves])
+
+def test_metadata_and_views():
+    dataset = FORC.FORCDataset.from_DAT_file(DATA_DIR/'sweep_Hsat1000.DAT')
+    assert dataset.name == 'sweep_Hsat1000'
+    assert dataset.H_sat == pytest.approx(1000, abs=0.1) and dataset.step_size == pytest.approx(20, abs=0.1)
+    assert dataset.temperature == pytest.approx(300, abs=0.1) and dataset.avging_time == 1
+    assert np.shares_memory(dataset.curve(3)[0], dataset.field)
+    np.testing.assert_array_equal(dataset.curve_number(), np.repeat(np.arange(9), dataset.curve_lengths))
+    assert np.all(np.diff(dataset.time) > 0)
+
+def test_float32_halves_the_memory():
+    dataset = FORC.FORCDataset.from_DAT_file(DATA_DIR/'sweep_Hsat500.DAT')
+    compact = FORC.FORCDataset.from_DAT_file(DATA_DIR/'sweep_Hsat500.DAT', dtype = 'float32')
+    assert compact.field.dtype == compact.sat_moment.dtype == np.float32
+    np.testing.assert_allclose(compact.moment, dataset.moment, rtol=1e-6)
+    assert compact.field.nbytes*2 == dataset.field.nbytes
+
+def test_aborted_curves_are_incomplete():
+    dataset = FORC.load_FORC_dataset(DATA_DIR/'aborted.DAT', use_cache = False)
+    np.testing.assert_array_equal(dataset.complete, [True]*3 + [False] + [True]*4 + [False])
+    # The saturation point after FORC 4 without END comment belongs to its branch
+    assert dataset.curve(3)[0][-1] == pytest.approx(0.1, abs=1e-5)
+    assert len(dataset.sat(4)[0]) == 0
+
+@pytest.mark.parametrize('name, n_sat', [('sweep_Hsat500.DAT', 0), ('sweep_Hsat1000.DAT', 9)])
+def test_drop_saturating_field(name, n_sat):
+    dataset = FORC.load_FORC_dataset(DATA_DIR/name, use_cache = False)
+    dropped = FORC.drop_saturating_field(dataset, 500)
+    assert len(dropped.sat_field) == n_sat
+    np.testing.assert_array_equal(dropped.field, dataset.field)
+    np.testing.assert_array_equal(np.diff(dropped.sat_offsets), n_sat//9)
+
+def test_filter_keeps_the_curve_boundaries():
+    dataset = FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+    positive = FORC.filter_FORC_dataset(dataset, dataset.field > 0)
+    assert len(positive) == len(dataset)
+    np.testing.assert_array_equal(positive.curve_lengths, [np.count_nonzero(dataset.curve(k)[0] > 0) for k in range(len(dataset))])
+    assert (positive.field > 0).all() and len(positive.time) == len(positive.field)
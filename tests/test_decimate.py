@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''Decimated copies of the curves, every curve reduced on its own'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+@pytest.fixture
+def dataset():
+    # 9 FORCs of 13 to 29 points, 20 Oe steps
+    return FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+
+def reference(dataset, factor, reduce, keep_reversal = True):
+    # Blocks of factor points of every curve after its reversal point, reduced one by one
+    field, moment, offsets = [], [], [0]
+    for curve in range(len(dataset)):
+        rows = np.arange(dataset.offsets[curve], dataset.offsets[curve + 1])
+        blocks = ([rows[:1]] + [rows[1:][idx:idx + factor] for idx in range(0, len(rows) - 1, factor)]) if keep_reversal else\
+            [rows[idx:idx + factor] for idx in range(0, len(rows), factor)]
+        field += [reduce(dataset.field[block]) for block in blocks]
+        moment += [reduce(dataset.moment[block]) for block in blocks]
+        offsets.append(offsets[-1] + len(blocks))
+    return np.array(field), np.array(moment), np.array(offsets)
+
+def assert_labels_kept(decimated, dataset):
+    for name in ['sat_field', 'sat_moment', 'sat_offsets', 'complete', 'FORC_number']:
+        np.testing.assert_array_equal(getattr(decimated, name), getattr(dataset, name), err_msg=name)
+
+@pytest.mark.parametrize('method, reduce', [('mean', np.mean), ('median', np.median)])
+@pytest.mark.parametrize('keep_reversal', [True, False])
+def test_blocks(dataset, method, reduce, keep_reversal):
+    decimated = FORC.decimate_FORC_dataset(dataset, factor = 3, method = method, keep_reversal = keep_reversal)
+    field, moment, offsets = reference(dataset, 3, reduce, keep_reversal)
+    np.testing.assert_array_equal(decimated.offsets, offsets)
+    np.testing.assert_allclose(decimated.field, field, rtol=1e-12)
+    np.testing.assert_allclose(decimated.moment, moment, rtol=1e-12)
+    assert decimated.step_size == pytest.approx(3*dataset.step_size)
+    assert_labels_kept(decimated, dataset)
+
+def test_reversal_point_stays_exact(dataset):
+    decimated = FORC.decimate_FORC_dataset(dataset, factor = 4)
+    np.testing.assert_array_equal(decimated.Ha, dataset.Ha)
+    np.testing.assert_array_equal(decimated.moment[decimated.offsets[:-1]], dataset.moment[dataset.offsets[:-1]])
+    # The time of a point is the mean time of its block
+    np.testing.assert_allclose(decimated.time[1], dataset.time[1:5].mean())
+
+def test_bin_onto_a_field_grid(dataset):
+    decimated = FORC.decimate_FORC_dataset(dataset, method = 'bin', target_step = 60)
+    assert decimated.step_size == 60
+    np.testing.assert_array_equal(decimated.Ha, dataset.Ha)
+    for curve in range(len(decimated)):
+        field = decimated.field[decimated.offsets[curve]:decimated.offsets[curve + 1]]*10**4
+        # Ha, then the bins around Ha + 60, Ha + 120, ... holding the 20 Oe steps 1-4, 5-7, 8-10, ...
+        assert field[1] == pytest.approx(field[0] + 50, abs=0.5)
+        np.testing.assert_allclose(np.diff(field[2:-1]), 60, atol=0.5)
+    assert_labels_kept(decimated, dataset)
+
+def test_invalid_arguments(dataset):
+    with pytest.raises(ValueError, match='Unknown method'):
+        FORC.decimate_FORC_dataset(dataset, factor = 2, method = 'max')
+    with pytest.raises(ValueError, match='target_step'):
+        FORC.decimate_FORC_dataset(dataset, method = 'bin')
+    with pytest.raises(ValueError, match='needs a factor'):
+        FORC.decimate_FORC_dataset(dataset, method = 'median')
+
+def test_decimated_export(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    full = FORC.convert_DAT_file(path_DAT, tmp_path/'full', formats = ['csv'])
+    preview = FORC.convert_DAT_file(path_DAT, tmp_path/'preview', formats = ['csv'], decimate = {'factor': 4}, name_suffix = '_preview')
+    assert preview['csv'].endswith('_preview.csv')
+    n_full = len(open(full['csv']).readlines()) - 1
+    n_preview = len(open(preview['csv']).readlines()) - 1
+    # 1 + ceil((n - 1)/4) points per curve
+    n_points = np.diff(FORC.load_FORC_dataset(path_DAT).offsets)
+    assert (n_full, n_preview) == (n_points.sum(), (1 + -(-(n_points - 1)//4)).sum())
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+'''FORC density of a Preisach model with a single hysteron
+    The hysteron switches down at beta = -40 Oe and up at alpha = 60 Oe, its density is a peak of
+    integral Ms at Ha = beta, Hb = alpha, i.e. Hc = 50 Oe, Hu = 10 Oe
+'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import PATH_PMC_HEADER
+
+ALPHA, BETA, STEP = 60.0, -40.0, 5.0
+MS = 1e-3*10**-3
+
+@pytest.fixture(scope='module')
+def hysteron():
+    # FORCs from Ha = 100 Oe down to -150 Oe swept to 200 Oe, in 5 Oe steps
+    fields, moments, offsets = [], [], [0]
+    for Ha in np.arange(100, -150 - STEP/2, -STEP):
+        Hb = np.arange(Ha, 200 + STEP/2, STEP)
+        fields.append(Hb*10**-4)
+        moments.append(FORC.preisach_FORC_moment(Ha, Hb, np.array([ALPHA]), np.array([BETA]))*10**-3)
+        offsets.append(offsets[-1] + len(Hb))
+    return FORC.FORCDataset(np.concatenate(fields), np.concatenate(moments), offsets, step_size = STEP)
+
+def peak(rho):
+    return np.unravel_index(np.argmax(np.nan_to_num(rho, nan=-np.inf)), rho.shape)
+
+def test_peak_at_the_switching_fields(hysteron):
+    density = FORC.compute_FORC_density(hysteron, SF = 3, n_workers = 1)
+    row, col = peak(density.rho)
+    # M steps between Ha = beta and beta + 5 Oe and between Hb = alpha - 5 Oe and alpha
+    assert density.Ha[row]*10**4 == pytest.approx(BETA, abs=STEP)
+    assert density.Hb[col]*10**4 == pytest.approx(ALPHA, abs=STEP)
+    assert density.rho[row, col] > 0
+
+def test_density_integrates_to_the_switched_moment(hysteron):
+    density = FORC.compute_FORC_density(hysteron, SF = 3, n_workers = 1)
+    cell = (STEP*10**-4)**2
+    assert np.nansum(density.rho)*cell == pytest.approx(MS, rel=1e-6)
+    # Almost all of it within 20 Oe of the peak
+    near = (np.abs(density.Ha*10**4 - BETA)[:, None] <= 20) & (np.abs(density.Hb*10**4 - ALPHA)[None, :] <= 20)
+    assert np.nansum(np.where(near, density.rho, 0))*cell == pytest.approx(MS, rel=0.01)
+
+def test_rotated_peak(hysteron):
+    Hc, Hu, rho = FORC.compute_FORC_density(hysteron, SF = 3, n_workers = 1).rotated()
+    row, col = peak(rho)
+    assert Hc[col]*10**4 == pytest.approx((ALPHA - BETA)/2, abs=STEP)
+    assert Hu[row]*10**4 == pytest.approx((ALPHA + BETA)/2, abs=STEP)
+
+def test_tiles_on_a_process_pool(hysteron):
+    serial = FORC.compute_FORC_density(hysteron, SF = 2, n_workers = 1)
+    tiled = FORC.compute_FORC_density(hysteron, SF = 2, n_workers = 2, tile_rows = 7)
+    np.testing.assert_array_equal(tiled.rho, serial.rho)
+
+def test_smoothing_factor_of_the_PMC_header(hysteron):
+    assert FORC.compute_FORC_density(hysteron, n_workers = 1, path_PMC_header = PATH_PMC_HEADER).SF == 7
+    assert FORC.compute_FORC_density(hysteron, n_workers = 1).SF == 3
+
+def test_density_export(copy_DAT, tmp_path):
+    outputs = FORC.convert_DAT_file(copy_DAT('sweep_Hsat500.DAT'), tmp_path/'out', formats = ['density'], SF = 2)
+    arrays = np.load(outputs['density'])
+    assert int(arrays['SF']) == 2
+    assert arrays['rho'].shape == (len(arrays['Ha']), len(arrays['Hb']))
+    assert arrays['rho_HcHu'].shape == (len(arrays['Hu']), len(arrays['Hc']))
+    assert np.isfinite(arrays['rho']).any()
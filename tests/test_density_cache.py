@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+'''Memoized FORC densities: keyed on the dataset content and the parameters, in memory and on disk'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+@pytest.fixture
+def dataset():
+    return FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+
+@pytest.fixture
+def regrids(monkeypatch):
+    # Counts the regridding of the curves
+    calls = []
+    regrid = FORC.regrid_FORC_dataset
+    def counting_regrid(*args, **kwargs):
+        calls.append(args)
+        return regrid(*args, **kwargs)
+    monkeypatch.setattr(FORC, 'regrid_FORC_dataset', counting_regrid)
+    return calls
+
+def test_repeated_call_is_a_lookup(dataset):
+    cache = FORC.FORCDensityCache()
+    density = FORC.cached_FORC_density(dataset, SF = 2, n_workers = 1, cache = cache)
+    assert FORC.cached_FORC_density(dataset, SF = 2, n_workers = 1, cache = cache) is density
+    assert cache.hits == 1
+    np.testing.assert_array_equal(density.rho, FORC.compute_FORC_density(dataset, SF = 2, n_workers = 1).rho)
+
+def test_SF_sweep_regrids_once(dataset, regrids):
+    cache = FORC.FORCDensityCache()
+    densities = [FORC.cached_FORC_density(dataset, SF = SF, n_workers = 1, cache = cache) for SF in (2, 3, 4)]
+    assert len(regrids) == 1
+    assert [density.SF for density in densities] == [2, 3, 4]
+    # One grid and three densities
+    assert len(cache) == 4
+    # Another Hb step or decimation is another grid
+    FORC.cached_FORC_density(dataset, SF = 2, Hb_step = 10, n_workers = 1, cache = cache)
+    FORC.cached_FORC_density(dataset, SF = 2, decimate = {'factor': 2}, n_workers = 1, cache = cache)
+    assert len(regrids) == 3
+
+def test_key_is_the_content(dataset, copy_DAT):
+    # The same curves from another file are the same entry, changed moments are not
+    same = FORC.load_FORC_dataset(copy_DAT('sweep_Hsat500.DAT', file_name = 'other.DAT'), use_cache = False)
+    assert FORC.FORC_dataset_hash(same) == FORC.FORC_dataset_hash(dataset)
+    changed = dataset.copy_with(moment = dataset.moment*1.01)
+    assert FORC.FORC_dataset_hash(changed) != FORC.FORC_dataset_hash(dataset)
+    cache = FORC.FORCDensityCache()
+    density = FORC.cached_FORC_density(dataset, SF = 2, n_workers = 1, cache = cache)
+    assert FORC.cached_FORC_density(same, SF = 2, n_workers = 1, cache = cache) is density
+    assert FORC.cached_FORC_density(changed, SF = 2, n_workers = 1, cache = cache) is not density
+
+def test_memory_limit(dataset):
+    density = FORC.compute_FORC_density(dataset, SF = 2, n_workers = 1)
+    cache = FORC.FORCDensityCache(max_bytes = 2*density.nbytes)
+    for SF in (2, 3, 4):
+        cache.put(cache.key('density', 'x', SF = SF), density)
+    # The least recently used entry is evicted
+    assert len(cache) == 2 and cache.nbytes <= cache.max_bytes
+    assert cache.get(cache.key('density', 'x', SF = 2)) is None
+    assert cache.get(cache.key('density', 'x', SF = 4)) is density
+
+def test_disk_tier(dataset, tmp_path, regrids):
+    cache_dir = tmp_path/'density_cache'
+    density = FORC.cached_FORC_density(dataset, SF = 2, n_workers = 1, cache = FORC.FORCDensityCache(cache_dir = cache_dir))
+    assert len(list(cache_dir.glob('*.npz'))) == 2
+    
+    # A new session loads the density from disk without regridding or fitting
+    cache = FORC.FORCDensityCache(cache_dir = cache_dir)
+    loaded = FORC.cached_FORC_density(dataset, SF = 2, n_workers = 1, cache = cache)
+    assert isinstance(loaded, FORC.FORCDensity) and loaded.SF == 2
+    np.testing.assert_array_equal(loaded.rho, density.rho)
+    assert (cache.hits, cache.misses, len(regrids)) == (1, 0, 1)
+    # Another SF reuses the grid on disk
+    FORC.cached_FORC_density(dataset, SF = 3, n_workers = 1, cache = cache)
+    assert len(regrids) == 1
+    
+    cache.clear(disk = True)
+    assert len(cache) == 0 and not cache_dir.exists()
+
+def test_unreadable_disk_entry_is_a_miss(dataset, tmp_path):
+    cache = FORC.FORCDensityCache(cache_dir = tmp_path/'density_cache')
+    key = cache.key('density', FORC.FORC_dataset_hash(dataset), SF = 2)
+    (tmp_path/'density_cache').mkdir()
+    (tmp_path/'density_cache'/(key + '.npz')).write_bytes(b'not an npz file')
+    assert cache.get(key) is None and cache.misses == 1
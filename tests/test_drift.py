@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+'''Drift correction with the saturation points measured before every FORC
+    The curves of sweep_Hsat500.DAT get a constant saturation moment and a known drift, the correction
+    recovers them and the fit is the drift
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+MS = 1e-6
+
+@pytest.fixture
+def dataset():
+    dataset = FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+    return dataset.copy_with(sat_moment = np.full(len(dataset.sat_moment), MS))
+
+def drifted(dataset, drift, mode = 'scale', against = 'time'):
+    # Drift of every point from its time stamp or curve number
+    if against == 'time':
+        x, sat_x = dataset.time, dataset.sat_time
+    else:
+        x = dataset.curve_number().astype(np.float64)
+        sat_x = np.repeat(np.arange(len(dataset)), np.diff(dataset.sat_offsets)).astype(np.float64)
+    if mode == 'scale':
+        return dataset.copy_with(moment = dataset.moment*drift(x), sat_moment = dataset.sat_moment*drift(sat_x))
+    return dataset.copy_with(moment = dataset.moment + drift(x), sat_moment = dataset.sat_moment + drift(sat_x))
+
+def test_linear_sensitivity_drift_against_time(dataset):
+    t0 = dataset.sat_time[0]
+    # 1 % per minute from the first saturation point
+    k = 0.01/60
+    corrected, fit = FORC.correct_FORC_drift(drifted(dataset, lambda t: 1 + k*(t - t0)), return_fit = True)
+    np.testing.assert_allclose(corrected.moment, dataset.moment, rtol=1e-9)
+    np.testing.assert_allclose(corrected.sat_moment, MS, rtol=1e-9)
+    intercept, slope = fit.convert().coef
+    assert slope == pytest.approx(k*MS, rel=1e-6)
+    assert intercept + slope*t0 == pytest.approx(MS, rel=1e-9)
+
+def test_background_drift_against_curve(dataset):
+    c = 2e-9
+    corrected = FORC.correct_FORC_drift(drifted(dataset, lambda curve: c*curve, 'offset', 'curve'), against = 'curve', mode = 'offset')
+    np.testing.assert_allclose(corrected.moment, dataset.moment, rtol=0, atol=1e-18)
+    np.testing.assert_allclose(corrected.sat_moment, MS, rtol=0, atol=1e-18)
+
+def test_quadratic_drift(dataset):
+    t0 = dataset.sat_time[0]
+    drift = lambda t: 1 + 1e-4*(t - t0) - 5e-7*(t - t0)**2
+    # A linear fit leaves a residual, a degree 2 fit does not
+    linear = FORC.correct_FORC_drift(drifted(dataset, drift))
+    quadratic = FORC.correct_FORC_drift(drifted(dataset, drift), degree = 2)
+    np.testing.assert_allclose(quadratic.moment, dataset.moment, rtol=1e-9)
+    assert not np.allclose(linear.moment, dataset.moment, rtol=1e-6, atol=0)
+
+def test_drift_free_dataset_is_unchanged(dataset):
+    corrected = FORC.correct_FORC_drift(dataset)
+    np.testing.assert_allclose(corrected.moment, dataset.moment, rtol=1e-12)
+
+def test_invalid_arguments(dataset):
+    with pytest.raises(ValueError, match="Unknown against"):
+        FORC.correct_FORC_drift(dataset, against = 'field')
+    with pytest.raises(ValueError, match="Unknown mode"):
+        FORC.correct_FORC_drift(dataset, mode = 'ratio')
+    with pytest.raises(ValueError, match='too few'):
+        FORC.correct_FORC_drift(FORC.select_FORC_curves(dataset, [0, 1]), degree = 2)
+
+def test_no_time_stamps():
+    # long_header.DAT has no Time Stamp column
+    dataset = FORC.load_FORC_dataset(DATA_DIR/'long_header.DAT', use_cache = False)
+    with pytest.raises(ValueError, match='no time stamps'):
+        FORC.correct_FORC_drift(dataset)
+    assert len(FORC.correct_FORC_drift(dataset, against = 'curve')) == 2
+
+def test_converter_corrects_the_drift(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    outputs = FORC.convert_DAT_file(path_DAT, tmp_path/'out', formats = ['csv'], drift_correction = {'against': 'curve'})
+    expected = FORC.correct_FORC_drift(FORC.load_FORC_dataset(path_DAT), against = 'curve')
+    table = pd.read_csv(outputs['csv'])
+    np.testing.assert_allclose(table['Moment (Am2)'], expected.moment, rtol=1e-6)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+'''Single-parse export of several formats with export_FORC_files'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+def outputs_in(directory, formats):
+    return {file_type: str(directory/('out' + FORC.FORC_FILE_EXTENSIONS[file_type])) for file_type in formats}
+
+def test_all_formats_from_one_parse(copy_DAT, tmp_path):
+    outputs = outputs_in(tmp_path, ['PMC', 'FORCinel', 'doFORC', 'csv', 'npz'])
+    with FORC.FORCInstrumentation() as instrumentation:
+        assert FORC.export_FORC_files(copy_DAT('sweep_Hsat1000.DAT'), outputs, path_PMC_header = PATH_PMC_HEADER, use_cache = False) == outputs
+    stages = [record.name for record in instrumentation.records]
+    assert stages.count('read_csv') == 1
+    assert sorted(name for name in stages if name.startswith('write_')) == ['write_FORCinel', 'write_PMC', 'write_csv', 'write_doFORC', 'write_npz']
+    expected = {'PMC': 'sweep_Hsat1000.forc', 'FORCinel': 'sweep_Hsat1000.frc', 'doFORC': 'sweep_Hsat1000_doFORC.txt'}
+    for file_type, name in expected.items():
+        with open(outputs[file_type], 'rb') as f:
+            assert f.read() == (DATA_DIR/'expected'/name).read_bytes(), file_type
+
+def test_tables_hold_the_branch_points_in_SI_units(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    outputs = outputs_in(tmp_path, ['csv', 'npz'])
+    FORC.export_FORC_files(path_DAT, outputs)
+    # Without the saturation points and the branch points at saturating_field
+    dataset = FORC.drop_saturating_field(FORC.load_FORC_dataset(path_DAT), 500)
+    table = pd.read_csv(outputs['csv'])
+    assert list(table.columns) == ['FORC', 'Field (T)', 'Moment (Am2)']
+    np.testing.assert_array_equal(table['FORC'], dataset.curve_number() + 1)
+    np.testing.assert_allclose(table['Field (T)'], dataset.field, atol=1e-15)
+    np.testing.assert_allclose(table['Moment (Am2)'], dataset.moment, atol=1e-15)
+    with np.load(outputs['npz']) as npz:
+        assert sorted(npz.files) == ['FORC', 'field', 'moment']
+        np.testing.assert_array_equal(npz['field'], dataset.field)
+    # 20 Oe steps from Ha up to 300 Oe
+    assert np.all(np.abs(np.diff(table['Field (T)'])[np.diff(table['FORC']) == 0] - 20e-4) < 1e-4)
+
+def test_parsed_datasets_are_exported_as_they_are(copy_DAT, tmp_path):
+    dataset = FORC.load_FORC_dataset(copy_DAT('aborted.DAT'))
+    outputs = outputs_in(tmp_path, ['FORCinel'])
+    FORC.export_FORC_files(dataset, outputs)
+    assert (tmp_path/'out.frc').read_bytes() == (DATA_DIR/'expected'/'aborted.frc').read_bytes()
+
+def test_unknown_format_raises_before_parsing(tmp_path):
+    with pytest.raises(ValueError, match='Unknown formats'):
+        FORC.export_FORC_files(tmp_path/'missing.DAT', {'FORCinel': 'out.frc', 'xlsx': 'out.xlsx'})
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''Conversion of a .DAT file that is still being written'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+def grow(path_source, path_growing, follower, block_size = 1500):
+    """Appends the source file in blocks that end mid-line and updates the follower after each one
+
+    Returns:
+        list: (completed END comments written so far, curves the follower has) after every update
+    """
+    content = path_source.read_bytes()
+    counts = []
+    for stop in range(block_size, len(content) + block_size, block_size):
+        path_growing.write_bytes(content[:stop])
+        follower.update()
+        counts.append((content[:stop].count(b'\nEND_DATA_FORC'), follower.n_FORCs))
+    return counts
+
+@pytest.mark.parametrize('file_type, expected', [('FORCinel', '{}.frc'), ('doFORC', '{}_doFORC.txt')])
+@pytest.mark.parametrize('name', ['sweep_Hsat500', 'sweep_Hsat1000'])
+def test_followed_file_ends_as_the_converted_file(name, file_type, expected, tmp_path):
+    path_growing = tmp_path/'running.DAT'
+    path_growing.write_bytes(b'')
+    follower = FORC.FORCFollower(path_growing, tmp_path/'out', file_type = file_type)
+    counts = grow(DATA_DIR/(name + '.DAT'), path_growing, follower)
+    # Every completed curve is in the output as soon as its END comment is written
+    assert all(n_completed == n_FORCs for n_completed, n_FORCs in counts)
+    assert (tmp_path/'out').read_bytes() == (DATA_DIR/'expected'/expected.format(name)).read_bytes()
+
+def test_partial_output_is_a_valid_file(tmp_path):
+    path_growing = tmp_path/'running.DAT'
+    content = (DATA_DIR/'sweep_Hsat500.DAT').read_bytes()
+    # Up to the middle of the branch of FORC 4
+    start_FORC_4 = [k for k in range(len(content)) if content.startswith(b'START_DATA_FORC', k)][3]
+    path_growing.write_bytes(content[:start_FORC_4 + 200])
+    follower = FORC.FORCFollower(path_growing, tmp_path/'out.frc')
+    assert follower.update() == 3 and follower.update() == 0
+    text = (tmp_path/'out.frc').read_text()
+    assert text.endswith('\nEND\n') and text.count('\n\n') == 3
+
+def test_PMC_header_counts_follow_the_curves(tmp_path):
+    path_growing = tmp_path/'running.DAT'
+    follower = FORC.FORCFollower(path_growing, tmp_path/'out.forc', file_type = 'PMC', path_PMC_header = PATH_PMC_HEADER)
+    path_growing.write_bytes(b'')
+    grow(DATA_DIR/'sweep_Hsat500.DAT', path_growing, follower, block_size = 4000)
+    lines = (tmp_path/'out.forc').read_text(encoding='cp1252').split('\n')
+    expected = (DATA_DIR/'expected'/'sweep_Hsat500.forc').read_text(encoding='cp1252').split('\n')
+    # The counts are padded to 10 characters so the header keeps its length
+    assert 'NForc                           9         ' in lines
+    assert f'Number of data                  {follower.n_points:<10}' in lines
+    assert lines[86:] == expected[86:]
+
+def test_replaced_data_file_is_converted_again(tmp_path):
+    path_growing = tmp_path/'running.DAT'
+    path_growing.write_bytes((DATA_DIR/'sweep_Hsat1000.DAT').read_bytes())
+    follower = FORC.FORCFollower(path_growing, tmp_path/'out.frc')
+    assert follower.update() == 9
+    path_growing.write_bytes((DATA_DIR/'long_header.DAT').read_bytes())
+    assert follower.update() == 2 and follower.n_FORCs == 2
+    fields = [float(line.split(',')[0]) for line in (tmp_path/'out.frc').read_text().splitlines() if ',' in line]
+    np.testing.assert_allclose(fields, np.array([1000, 0, 50, 100, 1000, -100, -50, 0, 50, 100])*1e-4)
+
+def test_compressed_files_are_not_followed(tmp_path):
+    with pytest.raises(ValueError, match='plain files'):
+        FORC.FORCFollower(tmp_path/'running.DAT.gz', tmp_path/'out.frc')
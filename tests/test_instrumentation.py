@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''Stage records of the converters and the sequence generator'''
+import json
+import logging
+import os
+import tracemalloc
+
+import FORC_functions_RJ as FORC
+from conftest import PATH_PMC_HEADER
+
+def convert(path_DAT, save_dir):
+    return FORC.convert_DAT_file(path_DAT, save_dir, formats = ['PMC', 'FORCinel'], path_PMC_header = PATH_PMC_HEADER, use_cache = False)
+
+def test_conversion_stages(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    seen = []
+    with FORC.FORCInstrumentation(callback = seen.append) as instrumentation:
+        outputs = convert(path_DAT, tmp_path/'out')
+    records = {record.name: record for record in instrumentation.records}
+    assert seen == instrumentation.records
+    assert list(records)[:3] == ['read_header', 'read_csv', 'segment_FORCs']
+    assert {'filter_generic', 'write_PMC', 'write_FORCinel'} <= set(records)
+    # 216 rows below the column names, 198 branch points
+    assert records['read_csv'].rows == 216 and records['read_csv'].bytes_read > 0
+    assert records['segment_FORCs'].rows == 216
+    assert records['write_PMC'].rows == 198
+    for file_type in ('PMC', 'FORCinel'):
+        assert records[f'write_{file_type}'].bytes_written == os.path.getsize(outputs[file_type])
+        assert records[f'write_{file_type}'].path == str(outputs[file_type])
+    assert all(record.wall_sec >= 0 for record in instrumentation.records)
+    assert instrumentation.wall_sec >= sum(record.wall_sec for record in instrumentation.records if record.name.startswith('read'))
+
+def test_cache_hit_stages(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('sweep_Hsat500.DAT')
+    FORC.load_FORC_dataset(path_DAT)
+    with FORC.FORCInstrumentation() as instrumentation:
+        FORC.load_FORC_dataset(path_DAT)
+    names = [record.name for record in instrumentation.records]
+    assert 'load_cache' in names and 'read_csv' not in names
+
+def test_sequence_stage(tmp_path):
+    with FORC.FORCInstrumentation() as instrumentation:
+        FORC.seqns_FORC_measurements_V1(seq_file_path_n_name = tmp_path/'FORC.seq', data_file_path = 'C:\\Data', data_file_name = 'S1.DAT', N_FORCs = 5)
+    record, = [record for record in instrumentation.records if record.name == 'write_seq']
+    assert record.rows == len((tmp_path/'FORC.seq').read_text().splitlines())
+    assert record.bytes_written == os.path.getsize(tmp_path/'FORC.seq')
+
+def test_report(copy_DAT, tmp_path):
+    path_report = tmp_path/'run.json'
+    with FORC.FORCInstrumentation(path_report = path_report) as instrumentation:
+        convert(copy_DAT('sweep_Hsat500.DAT'), tmp_path/'out')
+        convert(copy_DAT('sweep_Hsat1000.DAT'), tmp_path/'out')
+    report = json.loads(path_report.read_text())
+    assert {'python', 'numpy', 'pandas', 'wall_sec', 'summary', 'stages'} <= set(report)
+    assert len(report['stages']) == len(instrumentation.records)
+    assert report['summary']['read_csv']['runs'] == 2
+    assert report['summary']['read_csv']['rows'] == 2*216
+    # The summary of the saved records is the summary of the run
+    assert FORC.summarize_FORC_stages(report['stages']) == instrumentation.summary()
+
+def test_summarize():
+    records = [{'name': 'read_csv', 'wall_sec': 1.0, 'rows': 100, 'bytes_read': 10, 'bytes_written': 0, 'peak_bytes': 5},
+               {'name': 'write_PMC', 'wall_sec': 0.5, 'rows': None, 'bytes_read': 0, 'bytes_written': 7, 'peak_bytes': 3},
+               {'name': 'read_csv', 'wall_sec': 3.0, 'rows': 300, 'bytes_read': 30, 'bytes_written': 0, 'peak_bytes': 4}]
+    summary = FORC.summarize_FORC_stages(records)
+    assert list(summary) == ['read_csv', 'write_PMC']
+    assert summary['read_csv'] == {'runs': 2, 'wall_sec': 4.0, 'rows': 400, 'bytes_read': 40, 'bytes_written': 0, 'peak_bytes': 5,\
+        'rows_per_sec': 100.0}
+    assert summary['write_PMC']['rows_per_sec'] is None
+
+def test_profile_selected_stages(copy_DAT, tmp_path):
+    with FORC.FORCInstrumentation(profile = ['read_csv'], profile_dir = tmp_path/'prof') as instrumentation:
+        convert(copy_DAT('sweep_Hsat500.DAT'), tmp_path/'out')
+    profiled = [record for record in instrumentation.records if record.profile is not None]
+    assert [record.name for record in profiled] == ['read_csv']
+    assert 'cumulative' in profiled[0].profile
+    prof_files = os.listdir(tmp_path/'prof')
+    assert len(prof_files) == 1 and prof_files[0].startswith('read_csv_')
+
+def test_trace_memory(copy_DAT, tmp_path):
+    assert not tracemalloc.is_tracing()
+    with FORC.FORCInstrumentation(trace_memory = True) as instrumentation:
+        convert(copy_DAT('sweep_Hsat500.DAT'), tmp_path/'out')
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+    assert all(record.peak_bytes > 0 for record in instrumentation.records)
+
+def test_stages_are_logged_without_instrumentation(copy_DAT, tmp_path, caplog):
+    with caplog.at_level(logging.DEBUG, logger = 'FORC_functions_RJ'):
+        convert(copy_DAT('sweep_Hsat500.DAT'), tmp_path/'out')
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith('read_csv ') for message in messages)
+    assert any(message.startswith('write_PMC ') for message in messages)
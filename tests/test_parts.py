@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''Rotated data files: the sequence opens a new _partNNN data file every N_FORCs_per_file FORCs and the
+    parts are stitched back into one dataset
+'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+def split_DAT(path_DAT, data_dir, stem, N_FORCs_per_file):
+    """Writes the FORCs of path_DAT into stem_part001.DAT, ... with the header repeated, returns the paths"""
+    lines = path_DAT.read_text().splitlines(keepends=True)
+    first_data = lines.index('[Data]\n') + 2
+    # Every FORC starts at its saturation point, the line before START_DATA_FORC
+    starts = [idx - 1 for idx, line in enumerate(lines) if line.startswith('START_DATA_FORC')]
+    bounds = starts[::N_FORCs_per_file] + [len(lines)]
+    paths = []
+    for part, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]), 1):
+        path = data_dir/FORC.seqns_data_file_name(stem + '.DAT', part)
+        path.write_text(''.join(lines[:first_data] + lines[start:stop]))
+        paths.append(path)
+    return paths
+
+@pytest.fixture
+def parts(tmp_path):
+    data_dir = tmp_path/'parts'
+    data_dir.mkdir()
+    return split_DAT(DATA_DIR/'sweep_Hsat500.DAT', data_dir, 'S1_300K', 4)
+
+def test_part_file_names():
+    assert FORC.seqns_data_file_name('NN9_FORC.DAT', 2) == 'NN9_FORC_part002.DAT'
+    assert FORC.seqns_data_file_name('NN9_FORC.DAT', 12) == 'NN9_FORC_part012.DAT'
+
+def test_sequence_rotates_data_files():
+    lines = FORC.seqns_FORC_measurement_lines(N_FORCs = 10, N_FORCs_per_file = 4, data_file_path = 'C:\\Data', data_file_name = 'NN9.DAT')
+    data_files = [line for line in lines if line.startswith('VSMDF')]
+    assert len(data_files) == 3
+    for part, line in enumerate(data_files, 1):
+        assert f'NN9_part{part:03d}.DAT' in line
+    # The new data file is opened inside the FORC, after its comment and before its saturation point
+    first = lines.index(data_files[1])
+    assert lines[first - 1].startswith('REM') and 'FORC_005' in lines[first - 1]
+
+def test_sequence_without_rotation_has_one_data_file():
+    lines = FORC.seqns_FORC_measurement_lines(N_FORCs = 10, data_file_path = 'C:\\Data', data_file_name = 'NN9.DAT')
+    data_files = [line for line in lines if line.startswith('VSMDF')]
+    assert len(data_files) == 1 and 'NN9.DAT' in data_files[0]
+
+def test_group_DAT_parts(parts, tmp_path):
+    other = tmp_path/'parts'/'S2_300K.DAT'
+    # Unordered input, the parts are sorted by part number
+    groups = dict(FORC.group_DAT_parts([parts[2], other, parts[0], parts[1]]))
+    assert groups == {'S1_300K': parts, 'S2_300K': [other]}
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_stitched_parts_equal_the_whole_file(parts, n_workers):
+    assert len(parts) == 3
+    whole = FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+    stitched = FORC.load_FORC_dataset_parts(parts[::-1], n_workers = n_workers)
+    assert stitched.name == 'S1_300K'
+    np.testing.assert_array_equal(stitched.offsets, whole.offsets)
+    np.testing.assert_array_equal(stitched.sat_offsets, whole.sat_offsets)
+    for name in ['field', 'moment', 'time', 'sat_field', 'sat_moment', 'complete', 'Ha']:
+        np.testing.assert_array_equal(getattr(stitched, name), getattr(whole, name), err_msg=name)
+
+def test_parts_of_different_files_are_rejected(parts, tmp_path):
+    with pytest.raises(ValueError, match='single data file'):
+        FORC.load_FORC_dataset_parts([parts[0], tmp_path/'parts'/'S2_300K.DAT'])
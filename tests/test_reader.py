@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''.DAT header discovery and column projection
+    long_header.DAT: older export with 33 header lines, a quoted INFO value and no Time Stamp column
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+def test_header_of_a_VersaLab_export():
+    metadata = FORC.read_DAT_header(DATA_DIR/'sweep_Hsat500.DAT')
+    assert metadata.title == 'Synthetic FORC'
+    assert metadata.header_lines == 30
+    assert metadata.info['HW_PLATFORM'] == 'VersaLab' and metadata.info['SAMPLE_MASS'] == ''
+    assert metadata.file_open_time.startswith('3700000001.30')
+    assert metadata.columns[:5] == ['Comment', 'Time Stamp (sec)', 'Temperature (K)', 'Magnetic Field (Oe)', 'Moment (emu)']
+    assert metadata.temperature == pytest.approx(300, abs=0.1)
+    assert metadata.avging_time == 1
+
+def test_header_length_and_quoted_entries_are_discovered():
+    metadata = FORC.read_DAT_header(DATA_DIR/'long_header.DAT')
+    assert metadata.header_lines == 33
+    assert metadata.info['SAMPLE_MATERIAL'] == 'Co/Pt, 5 nm' and metadata.info['OPERATOR'] == 'Rahul'
+    assert metadata.columns == ['Comment', 'Temperature (K)', 'Magnetic Field (Oe)', 'Moment (emu)', 'Averaging Time (sec)']
+    assert metadata.temperature == pytest.approx(10.01, abs=0.01) and metadata.avging_time == 2
+
+def test_columns_come_in_the_requested_order_and_dtype():
+    columns = [FORC.DAT_MOMENT_COLUMN, FORC.DAT_COMMENT_COLUMN, FORC.DAT_FIELD_COLUMN]
+    data, metadata = FORC.read_DAT_file(DATA_DIR/'long_header.DAT', columns = columns)
+    assert list(data.columns) == columns
+    assert data[FORC.DAT_FIELD_COLUMN].dtype == np.float64 and data[FORC.DAT_MOMENT_COLUMN].dtype == np.float64
+    assert data[FORC.DAT_COMMENT_COLUMN].dropna().tolist() == ['START_DATA_FORC', 'END_DATA_FORC']*2
+    np.testing.assert_array_equal(data[FORC.DAT_FIELD_COLUMN].dropna(), [1000, 0, 50, 100, 1000, -100, -50, 0, 50, 100])
+
+def test_engines_and_chunks_read_the_same_values():
+    path_DAT = DATA_DIR/'sweep_Hsat1000.DAT'
+    data, metadata = FORC.read_DAT_file(path_DAT, engine = 'c')
+    python_data, _ = FORC.read_DAT_file(path_DAT, engine = 'python', metadata = metadata)
+    pd.testing.assert_frame_equal(python_data, data)
+    chunks, _ = FORC.read_DAT_file(path_DAT, chunk_size = 25, metadata = metadata)
+    pd.testing.assert_frame_equal(pd.concat(list(chunks), ignore_index=True)[list(FORC.DAT_COLUMNS)], data)
+
+def test_time_column_is_only_read_when_present():
+    data, _ = FORC.read_DAT_FORC_columns(DATA_DIR/'sweep_Hsat500.DAT')
+    assert FORC.DAT_TIME_COLUMN in data.columns
+    data, _ = FORC.read_DAT_FORC_columns(DATA_DIR/'long_header.DAT')
+    assert list(data.columns) == list(FORC.DAT_COLUMNS)
+    dataset = FORC.load_FORC_dataset(DATA_DIR/'long_header.DAT', use_cache = False)
+    assert np.isnan(dataset.time).all() and dataset.n_points == 10
+
+def test_missing_columns_and_sections_raise(tmp_path):
+    with pytest.raises(KeyError, match='Time Stamp'):
+        FORC.read_DAT_file(DATA_DIR/'long_header.DAT', columns = [FORC.DAT_TIME_COLUMN])
+    (tmp_path/'no_data.DAT').write_text('[Header]\nTITLE,empty\n')
+    with pytest.raises(ValueError, match='No \\[Data\\] section'):
+        FORC.read_DAT_header(tmp_path/'no_data.DAT')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+'''Repeated FORCs
+    repeats.DAT: 3 FORCs (Ha = 100, 0, -100 Oe) measured 4 times each, interleaved, on a 50 Oe step up to 300 Oe.
+    Repeat r is offset by (-2, -1, 1, 2)e-7 emu, so the mean of every point is the noiseless curve, and repeat 3
+    of FORC 2 has a 5e-5 emu outlier at 100 Oe.
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+HA = [100, 0, -100]
+# Branch point of the outlier in the averaged curves: FORC 1 has 5 points, 100 Oe is the 3rd of FORC 2
+OUTLIER = 5 + 2
+
+def noiseless_moment(Ha, H):
+    # Moment in Am^2 of the curve every repeat was offset from
+    return (1e-4*np.tanh((H - 20)/60) + 1e-5*np.tanh(Ha/50))*10**-3
+
+def expected_curves(outlier = 0.0):
+    # Field in Oe and moment in Am^2 of the 3 averaged curves, outlier in emu at FORC 2, 100 Oe
+    field = np.concatenate([np.arange(Ha, 301, 50) for Ha in HA])
+    moment = np.concatenate([noiseless_moment(Ha, np.arange(Ha, 301, 50)) for Ha in HA])
+    moment[OUTLIER] += outlier*10**-3
+    return field, moment
+
+@pytest.fixture
+def dataset():
+    return FORC.load_FORC_dataset(DATA_DIR/'repeats.DAT', use_cache = False)
+
+@pytest.mark.parametrize('file_type', ['PMC', 'FORCinel', 'doFORC'])
+def test_stream_averages_repeats_in_memory(file_type, copy_DAT, tmp_path):
+    path_DAT = copy_DAT('repeats.DAT')
+    in_memory = FORC.convert_DAT_file(path_DAT, tmp_path/'in_memory', formats = [file_type], path_PMC_header = PATH_PMC_HEADER)
+    streamed = FORC.convert_DAT_file(path_DAT, tmp_path/'stream', formats = [file_type], path_PMC_header = PATH_PMC_HEADER, stream = True,\
+        chunk_size = 20)
+    with open(in_memory[file_type], 'rb') as f_in_memory, open(streamed[file_type], 'rb') as f_streamed:
+        assert f_streamed.read() == f_in_memory.read()
+
+def test_stream_keeps_repeats_without_averaging(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('repeats.DAT')
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, tmp_path/'out.frc', stream = True, average_repeats = False)
+    # 12 curves, every one followed by a blank line
+    assert (tmp_path/'out.frc').read_text().split('\n').count('') == 12 + 1
+
+def test_repeat_labels(dataset):
+    assert len(dataset) == 12
+    np.testing.assert_array_equal(dataset.FORC_number, np.repeat([1, 2, 3], 4))
+    np.testing.assert_array_equal(dataset.repeat, np.tile([1, 2, 3, 4], 3))
+
+def test_average_cancels_the_offsets(dataset):
+    averaged = FORC.average_FORC_repeats(dataset)
+    assert len(averaged) == 3 and averaged.complete.all()
+    np.testing.assert_array_equal(averaged.FORC_number, [1, 2, 3])
+    np.testing.assert_allclose(averaged.Ha*10**4, HA, atol=1e-9)
+    field, moment = expected_curves(outlier = 5e-5/4)
+    np.testing.assert_allclose(averaged.field*10**4, field, atol=1e-9)
+    # Without rejection the outlier shifts the mean of its point by a quarter of it
+    np.testing.assert_allclose(averaged.moment, moment, rtol=1e-8, atol=1e-16)
+    # One averaged saturation point per FORC
+    np.testing.assert_allclose(averaged.sat_moment, 1e-7)
+
+def test_outlier_rejection(dataset):
+    # The outlier is 1.5 sample std from the mean of its 4 points, the other points at most 1.1
+    averaged, std = FORC.average_FORC_repeats(dataset, reject_sigma = 1.4, return_std = True)
+    field, moment = expected_curves()
+    # The mean of the 3 points left at the outlier is off by the mean of their offsets (-2, -1, 2)e-7 emu
+    moment[OUTLIER] += -1e-7/3*10**-3
+    np.testing.assert_allclose(averaged.moment, moment, rtol=1e-8, atol=1e-16)
+    # Sample std of the offsets, of the 3 points left at the outlier
+    expected_std = np.full(len(field), np.std([-2e-7, -1e-7, 1e-7, 2e-7], ddof=1)*10**-3)
+    expected_std[OUTLIER] = np.std([-2e-7, -1e-7, 2e-7], ddof=1)*10**-3
+    np.testing.assert_allclose(std, expected_std, rtol=1e-6)
+
+def test_csv_has_the_std_column(copy_DAT, tmp_path):
+    path_DAT = copy_DAT('repeats.DAT')
+    outputs = FORC.convert_DAT_file(path_DAT, tmp_path/'out', formats = ['csv', 'npz'], reject_sigma = 1.4)
+    table = pd.read_csv(outputs['csv'])
+    assert list(table.columns) == ['FORC', 'Field (T)', 'Moment (Am2)', 'Moment std (Am2)']
+    np.testing.assert_array_equal(table['FORC'], np.repeat([1, 2, 3], [5, 7, 9]))
+    arrays = np.load(outputs['npz'])
+    np.testing.assert_allclose(table['Moment std (Am2)'], arrays['moment_std'], rtol=1e-4)
+    # The rejected outlier does not show in the std
+    assert table['Moment std (Am2)'].max() < 3e-10
+
+def test_no_averaging_keeps_the_repeats(copy_DAT, tmp_path):
+    outputs = FORC.convert_DAT_file(copy_DAT('repeats.DAT'), tmp_path/'out', formats = ['csv'], average_repeats = False)
+    table = pd.read_csv(outputs['csv'])
+    assert 'Moment std (Am2)' not in table.columns
+    assert table['FORC'].max() == 12
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+'''Resuming an aborted run
+    aborted.DAT was measured with the uniform plan below: FORC 4 has no END comment and the run stopped in FORC 9
+'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+RUN = dict(max_reversal_field = 100, min_reversal_field = -300, N_FORCs = 10, step_size = 20, H_sat = 500, set_temp = 300)
+PLAN = {name: RUN[name] for name in ('max_reversal_field', 'min_reversal_field', 'N_FORCs', 'step_size')}
+
+@pytest.fixture
+def aborted():
+    return FORC.load_FORC_dataset(DATA_DIR/'aborted.DAT', use_cache = False)
+
+def write_FORCs(path_DAT, path, FORCs):
+    """Writes the FORCs (1 based) of path_DAT with its header into path, every FORC from its saturation point to END"""
+    lines = path_DAT.read_text().splitlines(keepends=True)
+    first_data = lines.index('[Data]\n') + 2
+    starts = [idx - 1 for idx, line in enumerate(lines) if line.startswith('START_DATA_FORC')] + [len(lines)]
+    path.write_text(''.join(lines[:first_data] + [line for FORC_number in FORCs for line in lines[starts[FORC_number - 1]:starts[FORC_number]]]))
+    return path
+
+def test_missing_FORCs(aborted):
+    plan = FORC.uniform_FORC_plan(**PLAN)
+    np.testing.assert_allclose(plan.Ha, 60 - 40*np.arange(9))
+    np.testing.assert_array_equal(np.flatnonzero(FORC.find_missing_FORCs(aborted, plan)) + 1, [4, 9])
+    # Every FORC needs two complete curves
+    assert FORC.find_missing_FORCs(aborted, plan, N_repeat = 2).all()
+    # FORCs planned past the end of the run are missing
+    longer = FORC.uniform_FORC_plan(**{**PLAN, 'min_reversal_field': -380, 'N_FORCs': 12})
+    np.testing.assert_array_equal(np.flatnonzero(FORC.find_missing_FORCs(aborted, longer)) + 1, [4, 9, 10, 11])
+
+def test_tolerance(aborted):
+    # The measured Ha are within 0.05 Oe of the plan
+    shifted = FORC.FORCPlan(Ha = FORC.uniform_FORC_plan(**PLAN).Ha + 1, sweep_stop = 300, step_size = 20, ramp_rate = 40)
+    assert np.count_nonzero(FORC.find_missing_FORCs(aborted, shifted)) == 2
+    assert FORC.find_missing_FORCs(aborted, shifted, tolerance = 0.5).all()
+
+def test_resumed_sequence_measures_the_missing_FORCs(tmp_path, copy_DAT):
+    path_DAT = copy_DAT('aborted.DAT')
+    path_seq = tmp_path/'resume.seq'
+    resumed = FORC.seqns_resume_FORC_measurements(path_DAT, seq_file_path_n_name = path_seq, data_file_path = 'C:\\Data', **RUN)
+    np.testing.assert_array_equal(resumed.FORC_number, [4, 9])
+    np.testing.assert_allclose(resumed.Ha, [-60, -260])
+    lines = path_seq.read_text().splitlines()
+    assert [line for line in lines if line.startswith('REM ##FORC_')] == ['REM ##FORC_004', 'REM ##FORC_009']
+    assert [line for line in lines if line.startswith('VSMDF')] == ['VSMDF "C:\\Data/aborted_resume.DAT"']
+    # The reversal fields of the sweeps
+    assert [float(line.split()[15]) for line in lines if line.startswith('VSMMH')] == [-60, -260]
+
+def test_merge_with_the_resumed_run(copy_DAT, aborted):
+    path_original = copy_DAT('aborted.DAT')
+    # The resumed run measured FORC 4 and 9 again, taken from the complete run
+    path_resumed = write_FORCs(DATA_DIR/'sweep_Hsat500.DAT', path_original.parent/'aborted_resume.DAT', [4, 9])
+    assert FORC.group_DAT_parts([path_resumed, path_original]) == [('aborted', [path_original, path_resumed])]
+    
+    merged = FORC.load_FORC_dataset_parts([path_original, path_resumed], n_workers = 1)
+    complete = FORC.load_FORC_dataset(DATA_DIR/'sweep_Hsat500.DAT', use_cache = False)
+    assert merged.name == 'aborted' and len(merged) == 9 and merged.complete.all()
+    assert (np.diff(merged.Ha) < 0).all()
+    for curve in range(9):
+        # The complete curves of the original run are kept, the truncated ones are replaced
+        source = complete if curve in (3, 8) else aborted
+        np.testing.assert_array_equal(merged.field[merged.offsets[curve]:merged.offsets[curve + 1]],\
+            source.field[source.offsets[curve]:source.offsets[curve + 1]], err_msg=str(curve))
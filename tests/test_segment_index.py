@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+'''Per-curve segment index of the START/END comments
+    aborted.DAT: the END comment of FORC 4 is missing and the run stopped in FORC 9
+'''
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+def index_of(name):
+    data, _ = FORC.read_DAT_FORC_columns(DATA_DIR/name)
+    return FORC.build_FORC_segment_index(data), data
+
+def test_complete_FORCs():
+    index, data = index_of('sweep_Hsat500.DAT')
+    assert (index.n_FORCs, index.n_segments, index.n_rows) == (9, 18, len(data))
+    assert index.complete.all()
+    # One saturation point right before every START, the branch ends at the END comment
+    np.testing.assert_array_equal(index.sat_stop - index.sat_start, 1)
+    np.testing.assert_array_equal(index.sat_stop, index.start_marker)
+    np.testing.assert_array_equal(index.branch_start, index.start_marker + 1)
+    np.testing.assert_array_equal(data['Comment'].iloc[index.branch_stop], 'END_DATA_FORC')
+    np.testing.assert_array_equal(index.sat_start[1:], index.branch_stop[:-1] + 1)
+    # Ha = 60 Oe down to -260 Oe in 40 Oe steps, swept to 300 Oe in 20 Oe steps
+    np.testing.assert_allclose(index.Ha, 60 - 40*np.arange(9), atol=0.1)
+    np.testing.assert_array_equal(index.branch_stop - index.branch_start, (300 - np.round(index.Ha))//20 + 1)
+    assert index.n_points == data['Magnetic Field (Oe)'].notna().sum()
+
+def test_aborted_FORCs():
+    index, data = index_of('aborted.DAT')
+    np.testing.assert_array_equal(index.complete, [True]*3 + [False] + [True]*4 + [False])
+    # FORC 4 runs up to the START of FORC 5, the saturation point of FORC 5 is part of its rows
+    assert index.branch_stop[3] == index.start_marker[4]
+    assert index.sat(4) == slice(76, 76)
+    assert data['Magnetic Field (Oe)'].iloc[index.branch_stop[3] - 1] == pytest.approx(1000, abs=0.1)
+    # FORC 9 stops at the end of the file
+    assert index.branch_stop[-1] == index.n_rows == len(data)
+    assert index.curve(8) == slice(185, 208)
+    np.testing.assert_array_equal(index.branch_stop[:3] - index.branch_start[:3], [13, 15, 17])
+
+def test_hand_made_rows():
+    # sat, START, 3 points, END, sat, START, 4 rows without END (the next saturation points are part of them), START, END, START
+    comments = np.array(['', 'S', '', '', '', 'E', '', 'S', '', '', '', '', 'S', 'E', 'S'])
+    index = FORC.FORCSegmentIndex(np.flatnonzero(comments == 'S'), np.flatnonzero(comments == 'E'), len(comments))
+    np.testing.assert_array_equal(index.start_marker, [1, 7, 12, 14])
+    np.testing.assert_array_equal(index.branch_stop, [5, 12, 13, 15])
+    np.testing.assert_array_equal(index.complete, [True, False, True, False])
+    np.testing.assert_array_equal(index.sat_start, [0, 6, 12, 14])
+    assert np.isnan(index.Ha).all() and index.n_points == 0
+    np.testing.assert_array_equal(FORC.locate_rows(index.branch_start, index.branch_stop, np.array([0, 2, 5, 8, 13, 14])), [-1, 0, -1, 1, -1, -1])
+
+def test_generic_mask_of_chunks_matches_the_whole_file():
+    index, data = index_of('aborted.DAT')
+    whole = index.generic_mask(index.n_rows)
+    assert np.count_nonzero(~whole) == index.n_FORCs
+    assert not whole[index.start_marker].any()
+    chunks = [index.generic_mask(min(37, index.n_rows - first_row), first_row) for first_row in range(0, index.n_rows, 37)]
+    np.testing.assert_array_equal(np.concatenate(chunks), whole)
+
+def test_marker_rows_ignore_case():
+    comments = pd.Series([None, 'start_data_FORC', 'START_DATA_FORC_001_repeat_2', 'end_data_FORC', 'data FORC start'])
+    np.testing.assert_array_equal(FORC.find_marker_rows(comments, FORC.FORC_START_MARKER), [1, 2])
+    np.testing.assert_array_equal(FORC.find_FORC_repeat_labels(comments, np.array([1, 2]))[1], [0, 2])
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''Sequence generator and FORC grid planner
+    expected/uniform_N50.seq was written by the original seqns_FORC_measurements_V1
+'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR
+
+UNIFORM_N50 = dict(set_temp = 200, H_sat = 1000, N_FORCs = 50, min_reversal_field = -500, min_field = -300, step_size = 2,\
+    data_file_path = 'C:\\Data', data_file_name = 'S23_200K.DAT')
+
+def MvsH_lines(lines):
+    return [line.split() for line in lines if line.startswith('VSMMH')]
+
+def test_uniform_sequence_matches_original_generator(tmp_path):
+    # Reversal fields below min_field keep the min_field of the original sweeps
+    FORC.seqns_FORC_measurements_V1(seq_file_path_n_name = tmp_path/'out.seq', **UNIFORM_N50)
+    assert (tmp_path/'out.seq').read_bytes() == (DATA_DIR/'expected'/'uniform_N50.seq').read_bytes()
+
+def test_planned_sweep_window_reaches_below_min_field():
+    plan = FORC.FORCPlan(Ha = [50, -250, -400], sweep_stop = 300, step_size = 5, ramp_rate = 50)
+    lines = FORC.seqns_FORC_measurement_lines(min_field = -300, plan = plan, data_file_path = 'C:\\Data', data_file_name = 'x.DAT')
+    sweeps = MvsH_lines(lines)
+    # min_field, Ha (mid field), max_field of every sweep
+    assert [(float(line[14]), float(line[15]), float(line[16])) for line in sweeps] == [(-300, 50, 300), (-300, -250, 300), (-400, -400, 300)]
+
+def test_plan_stops_sweeps_at_the_window():
+    plan = FORC.plan_FORC_grid(Hc_max = 100, Hu_min = -50, Hu_max = 50, spacing = 10, max_field = 300)
+    assert np.all(np.diff(plan.Ha) < 0)
+    # Ha = Hu_max would end where it starts, Ha = Hu_min - Hc_max is the lowest corner of the window
+    assert plan.Ha[0] == 40 and plan.Ha[-1] == -150
+    # Every sweep ends where it leaves Hc <= Hc_max or Hu <= Hu_max
+    np.testing.assert_allclose(plan.sweep_stop, np.minimum(np.minimum(plan.Ha + 200, 100 - plan.Ha), 300))
+    assert plan.n_points < FORC.uniform_FORC_plan(max_reversal_field = 50, min_reversal_field = -160, N_FORCs = 22, step_size = 10).n_points
+
+def test_plan_regions_use_their_own_spacing():
+    plan = FORC.plan_FORC_grid(regions = [(50, 0, 10), (0, -100, 25)], Hc_max = 100, Hu_min = -100, Hu_max = 100)
+    np.testing.assert_array_equal(plan.Ha, [50, 40, 30, 20, 10, 0, -25, -50, -75, -100])
+    assert plan.step_size[plan.Ha == -50][0] == 25 and plan.step_size[plan.Ha == 20][0] == 10
+
+def test_plan_for_budget_fits_the_budget():
+    kwargs = dict(set_temp = 300, H_sat = 1000, avging_time = 1)
+    plan, estimate = FORC.plan_FORC_grid_for_budget(6, Hc_max = 200, Hu_min = -100, Hu_max = 100, **kwargs)
+    assert estimate.total_hours <= 6
+    # A 20 % finer grid no longer fits
+    spacing = plan.step_size[0]
+    finer = FORC.plan_FORC_grid(Hc_max = 200, Hu_min = -100, Hu_max = 100, spacing = round(spacing*0.8, 3))
+    assert FORC.estimate_FORC_measurement_time(plan = finer, **kwargs).total_hours > 6
+
+def test_plan_for_budget_rejects_impossible_budget():
+    with pytest.raises(ValueError, match='budget'):
+        FORC.plan_FORC_grid_for_budget(0.01, set_temp = 300)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+'''Wall time estimate of sequences from their ramps, waits, measurements and sweeps'''
+import pytest
+
+import FORC_functions_RJ as FORC
+
+SEQ_KWARGS = dict(set_temp = 200, H_sat = 1000, N_FORCs = 20, step_size = 5, avging_time = 1)
+
+def estimate(lines, **kwargs):
+    return FORC.simulate_seq_time(FORC.parse_seq_lines(lines), **kwargs)
+
+def test_field_ramp_is_waited_for():
+    # 500 Oe at 50 Oe/s from 0 Oe, then 5 s wait and the field settle time
+    result = estimate([FORC.seqns_set_field(field = 500, ramp_rate = 50), FORC.seqns_wait_for_settle(wait_time = 5, temp_bool = 0, field_bool = 1)])
+    assert list(result.durations) == pytest.approx([0.5, 0.5 + 10 + 5 + 5])
+
+def test_field_and_temp_ramps_overlap():
+    # 10 s field ramp and 100 K at 10 K/min, the wait takes the longer ramp and both settle times
+    lines = [FORC.seqns_set_field(field = 500, ramp_rate = 50), FORC.seqns_set_temp(temp = 200, rate = 10),\
+        FORC.seqns_wait_for_settle(wait_time = 0, temp_bool = 1, field_bool = 1)]
+    assert estimate(lines).total_time == pytest.approx(1.5 + 600 + 5 + 300)
+    assert estimate(lines, initial_temp = 200).total_time == pytest.approx(1.5 + 10 + 5 + 300)
+
+def test_measurements_and_sweeps():
+    lines = [FORC.seqns_adv_measurement(avg_time = 2, start_stop_bool = 0), FORC.seqns_adv_measurement(avg_time = 2, start_stop_bool = 1),\
+        FORC.seqns_MvsH_sweep_measurement(min_field = -100, mid_field = 0, max_field = 100, step_size = 10, avging_time = 1)]
+    result = estimate(lines)
+    # The sweep measures 0, 10, ..., 100 Oe
+    assert result.n_points == 11
+    assert list(result.durations) == pytest.approx([0.5 + 2 + 2, 0.5, 0.5 + 11*(1 + 0.2)])
+    assert estimate(lines, timing = {'sweep_point': 0}).durations[-1] == pytest.approx(0.5 + 11)
+
+def test_unknown_command():
+    with pytest.raises(ValueError, match="'XYZ' in line 2"):
+        FORC.parse_seq_lines(['REM hello', 'XYZ 1 2'])
+
+def test_seq_file_and_measurement_estimates_agree(tmp_path):
+    path_seq = tmp_path/'FORC.seq'
+    FORC.seqns_FORC_measurements_V1(seq_file_path_n_name = path_seq, data_file_path = 'C:\\Data', data_file_name = 'S1.DAT', **SEQ_KWARGS)
+    from_file = FORC.estimate_seq_file_time(path_seq)
+    from_kwargs = FORC.estimate_FORC_measurement_time(**SEQ_KWARGS)
+    assert from_file.total_time == pytest.approx(from_kwargs.total_time)
+    # The original generator measures N_FORCs - 1 curves
+    plan = FORC.uniform_FORC_plan(N_FORCs = 20, step_size = 5)
+    assert len(from_file.FORC_times) == len(plan.Ha) == 19
+    assert from_file.n_points == plan.n_points
+    assert from_file.setup_time + from_file.FORC_times.sum() + from_file.teardown_time == pytest.approx(from_file.total_time)
+    # The setup cools to 200 K
+    assert from_file.setup_time > 600
+
+def test_FORC_times_follow_the_sweep_length():
+    result = FORC.estimate_FORC_measurement_time(**SEQ_KWARGS)
+    # Lower reversal fields sweep longer and are ramped further from H_sat, the first FORC also
+    # ramps to H_sat from 0 Oe instead of the max field of the previous sweep
+    assert (result.FORC_times[2:] > result.FORC_times[1:-1]).all()
+    finer = FORC.estimate_FORC_measurement_time(**{**SEQ_KWARGS, 'step_size': 2.5})
+    assert finer.total_time > result.total_time
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+'''Multi-temperature store of FORC datasets
+    S1 is measured at 200 K (sweep_Hsat500.DAT) and 300 K (sweep_Hsat1000.DAT), S2 at 300 K (aborted.DAT)
+'''
+import shutil
+
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+import FORC_store
+from conftest import DATA_DIR
+
+SERIES = {'S1_200K.DAT': 'sweep_Hsat500.DAT', 'S1_300K.DAT': 'sweep_Hsat1000.DAT', 'S2_300K.DAT': 'aborted.DAT'}
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = tmp_path/'series'
+    data_dir.mkdir()
+    for name, fixture in SERIES.items():
+        shutil.copy(DATA_DIR/fixture, data_dir/name)
+    return data_dir
+
+@pytest.fixture
+def store(data_dir, tmp_path):
+    return FORC_store.build_FORC_store(tmp_path/'store', data_dir, Hb_step = 10, n_workers = 1)
+
+def assert_same_dataset(stored, dataset):
+    for name in FORC.FORC_CACHE_ARRAYS:
+        np.testing.assert_array_equal(getattr(stored, name), getattr(dataset, name), err_msg=name)
+
+def test_names():
+    assert FORC_store.parse_sample_temperature('S23_200K') == ('S23', 200.0)
+    assert FORC_store.parse_sample_temperature('NN9_4.2K_FORC') == ('NN9', 4.2)
+    assert FORC_store.parse_sample_temperature('NN9_FORC') == ('NN9_FORC', None)
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_build(data_dir, tmp_path, n_workers):
+    store = FORC_store.build_FORC_store(tmp_path/'store', data_dir, Hb_step = 10, n_workers = n_workers)
+    assert len(store) == 3 and store.samples() == ['S1', 'S2']
+    assert store.temperatures('S1') == [200.0, 300.0]
+    assert [(entry['sample'], entry['temperature']) for entry in store.entries] == [('S1', 200.0), ('S1', 300.0), ('S2', 300.0)]
+
+def test_datasets_are_views_of_the_store(store, data_dir):
+    for name in SERIES:
+        sample, temperature = FORC_store.parse_sample_temperature(name[:-4])
+        stored = store.dataset(sample, temperature)
+        assert_same_dataset(stored, FORC.load_FORC_dataset(data_dir/name))
+        assert stored.name == name[:-4]
+        assert np.shares_memory(stored.field, store.array('field'))
+    # The measured temperature is kept next to the set temperature of the name
+    assert store.find('S1', 200)['measured_temperature'] == pytest.approx(300, abs=0.1)
+
+def test_grids_share_Hb(store):
+    # Fixed by the branch fields of the first dataset, rounded out to the 10 Oe step
+    Hb = store.Hb
+    first = store.dataset('S1', 200)
+    np.testing.assert_allclose(np.diff(Hb)*10**4, 10)
+    assert Hb[0] <= first.field.min() < Hb[0] + 10**-3 and Hb[-1] - 10**-3 < first.field.max() <= Hb[-1]
+    for sample, temperature in [('S1', 200), ('S1', 300), ('S2', 300)]:
+        grid = store.grid(sample, temperature)
+        np.testing.assert_array_equal(grid.Hb, Hb)
+        assert grid.moment.shape == (len(grid.Ha), len(Hb))
+        expected = FORC.regrid_FORC_dataset(store.dataset(sample, temperature), Hb = Hb)
+        np.testing.assert_array_equal(grid.moment, expected.moment)
+
+def test_curve(store, data_dir):
+    dataset = FORC.load_FORC_dataset(data_dir/'S2_300K.DAT')
+    for k in (0, 3, len(dataset) - 1):
+        field, moment = store.curve('S2', 300, k)
+        np.testing.assert_array_equal(field, dataset.field[dataset.offsets[k]:dataset.offsets[k + 1]])
+        np.testing.assert_array_equal(moment, dataset.moment[dataset.offsets[k]:dataset.offsets[k + 1]])
+    with pytest.raises(IndexError):
+        store.curve('S2', 300, len(dataset))
+
+def test_nearest_temperature(store):
+    assert store.find('S1', 200.8)['temperature'] == 200
+    with pytest.raises(KeyError):
+        store.find('S1', 250)
+    assert store.find('S1', 250, tolerance = 60)['temperature'] == 200
+
+def test_series(store):
+    assert [T for T, _ in store.series('S1')] == [200.0, 300.0]
+    assert [T for T, _ in store.series('S1', T_min = 250)] == [300.0]
+    (T, grid), = store.series('S2', grids = True)
+    assert isinstance(grid, FORC.FORCGrid) and T == 300.0
+
+def test_reopen(store, tmp_path):
+    reopened = FORC_store.FORCStore(tmp_path/'store')
+    assert len(reopened) == 3
+    assert_same_dataset(reopened.dataset('S1', 300), store.dataset('S1', 300))
+    with pytest.raises(ValueError, match='Hb_step'):
+        FORC_store.FORCStore(tmp_path/'store', Hb_step = 5)
+    with pytest.raises(ValueError, match='grid of Hb'):
+        FORC_store.FORCStore(tmp_path/'store', Hb_range = (-300, 300))
+    # Adding with another step is refused as well
+    with pytest.raises(ValueError, match='Hb_step'):
+        reopened.add_DAT_file(DATA_DIR/'long_header.DAT', Hb_step = 20)
+
+def test_replace(store, data_dir):
+    nbytes = store.nbytes
+    with pytest.raises(ValueError, match='already in'):
+        store.add_DAT_file(data_dir/'S1_300K.DAT')
+    store.add_DAT_file(data_dir/'S1_200K.DAT', temperature = 300, replace = True)
+    assert len(store) == 3
+    assert_same_dataset(store.dataset('S1', 300), FORC.load_FORC_dataset(data_dir/'S1_200K.DAT'))
+    # The replaced arrays stay in the files
+    assert store.nbytes > nbytes
+
+def test_temperature_of_the_data(store):
+    # long_header.DAT has no temperature in its name, it was measured at 10 K
+    entry = store.add_DAT_file(DATA_DIR/'long_header.DAT')
+    assert (entry['sample'], entry['temperature']) == ('long_header', 10.0)
+
+def test_interrupted_add_is_cut_off(store, tmp_path, data_dir):
+    # Arrays written past the manifest by an add that did not finish
+    with open(tmp_path/'store'/'field.bin', 'ab') as f:
+        f.write(b'\x00'*80)
+    store.add_DAT_file(data_dir/'S1_200K.DAT', sample = 'S3')
+    assert_same_dataset(store.dataset('S3', 200), FORC.load_FORC_dataset(data_dir/'S1_200K.DAT'))
+    assert (tmp_path/'store'/'field.bin').stat().st_size == store.manifest['lengths']['field']*8
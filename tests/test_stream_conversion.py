@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+'''The converters write the same bytes as the original pandas converters, data/expected/ holds their output
+    sweep_Hsat500: saturation points at saturating_field, dropped from the generic files
+    sweep_Hsat1000: H_sat != saturating_field, the saturation points stay in the generic files
+    aborted: a FORC without END comment in the middle and a run stopped in the last FORC
+'''
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import DATA_DIR, PATH_PMC_HEADER
+
+FIXTURES = ['sweep_Hsat500', 'sweep_Hsat1000', 'aborted']
+EXPECTED = {'PMC': '{}.forc', 'FORCinel': '{}.frc', 'doFORC': '{}_doFORC.txt'}
+
+def expected_bytes(name, file_type):
+    return (DATA_DIR/'expected'/EXPECTED[file_type].format(name)).read_bytes()
+
+@pytest.mark.parametrize('stream', [False, True], ids=['in_memory', 'stream'])
+@pytest.mark.parametrize('name', FIXTURES)
+def test_gen_functions_match_original_converters(name, stream, copy_DAT, tmp_path):
+    path_DAT = copy_DAT(name + '.DAT')
+    out = tmp_path/'out'
+    # A small chunk_size puts chunk boundaries inside the curves
+    FORC.gen_PMC_FORC_file(PATH_PMC_HEADER, path_DAT.parent, out.with_suffix('.forc'), stream = stream, chunk_size = 37)
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, out.with_suffix('.frc'), 'FORCinel', stream = stream, chunk_size = 37)
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, out.with_suffix('.txt'), 'doFORC', stream = stream, chunk_size = 37)
+    assert out.with_suffix('.forc').read_bytes() == expected_bytes(name, 'PMC')
+    assert out.with_suffix('.frc').read_bytes() == expected_bytes(name, 'FORCinel')
+    assert out.with_suffix('.txt').read_bytes() == expected_bytes(name, 'doFORC')
+
+@pytest.mark.parametrize('stream', [False, True], ids=['single_parse', 'stream'])
+@pytest.mark.parametrize('name', FIXTURES)
+def test_convert_DAT_file_matches_original_converters(name, stream, copy_DAT, tmp_path):
+    outputs = FORC.convert_DAT_file(copy_DAT(name + '.DAT'), tmp_path/'out', path_PMC_header = PATH_PMC_HEADER, stream = stream)
+    for file_type, path_output in outputs.items():
+        with open(path_output, 'rb') as f:
+            assert f.read() == expected_bytes(name, file_type), file_type
+
+def test_saturation_points_stay_when_H_sat_differs(copy_DAT, tmp_path):
+    # 1000 Oe saturation points are not at saturating_field = 500 and stay in front of every branch
+    path_DAT = copy_DAT('sweep_Hsat1000.DAT')
+    FORC.gen_generic_FORC_file_from_PMC_data(path_DAT.parent, tmp_path/'out.frc', 'FORCinel')
+    fields = [float(line.split(',')[0]) for line in (tmp_path/'out.frc').read_text().splitlines() if ',' in line]
+    assert sum(round(field*10**4) == 1000 for field in fields) == len(FORC.load_FORC_dataset(path_DAT))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''Synthetic VersaLab .DAT files of the measurement seqns_FORC_measurements_V1 runs'''
+import numpy as np
+import pytest
+
+import FORC_functions_RJ as FORC
+
+SMALL = dict(N_FORCs = 11, step_size = 10, max_reversal_field = 100, min_reversal_field = -100, N_hysterons = 2000)
+
+def test_same_seed_same_file(tmp_path):
+    FORC.write_synthetic_DAT_file(tmp_path/'a.DAT', seed = 3, **SMALL)
+    FORC.write_synthetic_DAT_file(tmp_path/'b.DAT', seed = 3, **SMALL)
+    FORC.write_synthetic_DAT_file(tmp_path/'c.DAT', seed = 4, **SMALL)
+    assert (tmp_path/'a.DAT').read_bytes() == (tmp_path/'b.DAT').read_bytes()
+    assert (tmp_path/'a.DAT').read_bytes() != (tmp_path/'c.DAT').read_bytes()
+
+def test_layout_of_a_VersaLab_export(tmp_path):
+    path_DAT = tmp_path/'synthetic.DAT'
+    n_rows = FORC.write_synthetic_DAT_file(path_DAT, **SMALL)
+    lines = path_DAT.read_text().splitlines()
+    # 30 header lines, the column names, then the rows
+    assert lines[0] == '[Header]' and lines[29] == '[Data]'
+    assert lines[30].split(',') == list(FORC.SYNTHETIC_DAT_COLUMNS)
+    assert len(lines) == 31 + n_rows
+    # The instrument writes the markers in upper case
+    comments = [line.split(',')[0] for line in lines[31:]]
+    assert comments.count('START_DATA_FORC') == comments.count('END_DATA_FORC') == 10
+    assert set(comments) == {'', 'START_DATA_FORC', 'END_DATA_FORC'}
+
+def test_rows_follow_the_plan(tmp_path):
+    plan = FORC.plan_FORC_grid(Hc_max = 100, Hu_min = -50, Hu_max = 50, spacing = 20)
+    path_DAT = tmp_path/'planned.DAT'
+    n_rows = FORC.write_synthetic_DAT_file(path_DAT, plan = plan, H_sat = 500, N_hysterons = 2000)
+    # Saturation point, START and END comments around every sweep
+    assert n_rows == plan.n_points + 3*plan.n_FORCs
+    
+    dataset = FORC.load_FORC_dataset(path_DAT, use_cache = False)
+    assert len(dataset) == plan.n_FORCs and dataset.complete.all()
+    # 0.02 Oe field noise
+    np.testing.assert_allclose(dataset.Ha*10**4, plan.Ha, atol=0.1)
+    last = dataset.field[dataset.offsets[1:] - 1]*10**4
+    np.testing.assert_allclose(last, plan.sweep_stop, atol=0.1)
+    np.testing.assert_array_equal(dataset.curve_lengths, np.ceil(np.round((plan.sweep_stop - plan.Ha)/plan.step_size, 9)) + 1)
+
+def test_metadata_and_model(tmp_path):
+    path_DAT = tmp_path/'synthetic.DAT'
+    FORC.write_synthetic_DAT_file(path_DAT, H_sat = 800, avging_time = 2, temperature = 200, Ms = 1e-3, chi = 1e-8, noise = 1e-7, **SMALL)
+    dataset = FORC.load_FORC_dataset(path_DAT, use_cache = False)
+    assert dataset.temperature == pytest.approx(200, abs=0.1)
+    assert dataset.avging_time == 2
+    assert dataset.H_sat == pytest.approx(800, abs=0.1)
+    # Saturated moment plus the reversible part, in Am^2
+    np.testing.assert_allclose(dataset.sat_moment, (1e-3 + 1e-8*800)*10**-3, atol=5e-7*10**-3)
+    # Every branch rises from its reversal point
+    assert all(dataset.moment[stop - 1] > dataset.moment[start] for start, stop in zip(dataset.offsets[:-1], dataset.offsets[1:]))
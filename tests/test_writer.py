@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+'''Bulk Field/Moment writer'''
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import FORC_functions_RJ as FORC
+from conftest import PATH_PMC_HEADER
+
+@pytest.fixture
+def arrays():
+    """Fields and moments with the orders of magnitude of the exports, rows 3 and 7 are segment separators"""
+    rng = np.random.default_rng(0)
+    field = rng.uniform(-0.1, 0.1, 12)
+    moment = rng.normal(0, 1e-6, 12)
+    field[[3, 7]] = moment[[3, 7]] = np.nan
+    field[0], moment[0] = -0.0, 1e-20
+    return field, moment
+
+def test_lines_match_the_pandas_export(arrays):
+    field, moment = arrays
+    lines = FORC.format_FORC_data_block(field, moment).split('\n')
+    expected = pd.DataFrame({'Field': field, 'Moment': moment}).to_csv(header=False, index=False, float_format='%.15f', lineterminator='\n')
+    # pandas writes ',' for the NaN rows, the converters write blank lines
+    assert lines == [line if line != ',' else '' for line in expected.split('\n')]
+    assert lines[1] == '%.15f,%.15f' % (field[1], moment[1]) and lines[3] == ''
+
+def test_rows_with_one_value_keep_it():
+    assert FORC.format_FORC_data_block([0.1, np.nan], [np.nan, 2e-6]) == '0.100000000000000\n0.000002000000000\n'
+
+@pytest.mark.parametrize('chunk_rows', [1, 5, 65536])
+def test_chunks_and_end_lines_do_not_change_the_text(arrays, chunk_rows):
+    field, moment = arrays
+    f = io.StringIO()
+    FORC.write_FORC_data(f, field, moment, FORC.FORC_END_LINES['FORCinel'], chunk_rows = chunk_rows)
+    # No newline after the last data line other than the one before the trailer
+    assert f.getvalue() == FORC.format_FORC_data_block(field, moment) + 'END\n'
+
+def test_writer_appends_blocks_without_trailing_newline(arrays):
+    field, moment = arrays
+    f = io.StringIO()
+    writer = FORC.FORCDataWriter(f)
+    writer.write(field[:4], moment[:4])
+    writer.write(field[:0], moment[:0])
+    writer.write(field[4:], moment[4:])
+    writer.close()
+    assert f.getvalue() == FORC.format_FORC_data_block(field, moment)[:-1]
+    assert writer.n_lines == len(field)
+
+def test_PMC_header_counts_are_replaced():
+    lines = FORC.gen_PMC_header_lines(PATH_PMC_HEADER, 12, 3456, avging_time = 0.5, count_width = 8)
+    assert len(lines) == 86
+    assert 'NForc                           12      \n' in lines
+    assert 'Number of segments              24      \n' in lines
+    assert 'Number of data                  3456    \n' in lines
+    assert 'Averaging time                 +500.0000E-03\n' in lines